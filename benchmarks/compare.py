@@ -0,0 +1,57 @@
+"""
+Сравнение двух отчетов benchmarks.run.
+
+    python -m benchmarks.compare base.json head.json --threshold 0.1
+
+Регрессией считается рост p95 больше чем на threshold (доля) или
+увеличение числа запросов. При регрессиях код выхода равен 1.
+"""
+import argparse
+import json
+import sys
+
+
+def compare(base, head, threshold):
+    rows = []
+    regressions = []
+    for name, new in head['results'].items():
+        old = base['results'].get(name)
+        if old is None:
+            rows.append((name, None, new, ''))
+            continue
+        notes = []
+        if old['p95_ms'] and (
+                new['p95_ms'] - old['p95_ms']) / old['p95_ms'] > threshold:
+            notes.append('p95')
+        if new['queries'] > old['queries']:
+            notes.append('queries')
+        if notes:
+            regressions.append(name)
+        rows.append((name, old, new, ', '.join(notes)))
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    args = parser.parse_args(argv)
+    with open(args.base, encoding='utf-8') as stream:
+        base = json.load(stream)
+    with open(args.head, encoding='utf-8') as stream:
+        head = json.load(stream)
+    rows, regressions = compare(base, head, args.threshold)
+    for name, old, new, notes in rows:
+        if old is None:
+            print(f'{name:<12} new   p95 {new["p95_ms"]:>8} ms')
+            continue
+        print('{:<12} p95 {:>8} -> {:>8} ms  queries {:>3} -> {:>3}  {}'
+              .format(name, old['p95_ms'], new['p95_ms'], old['queries'],
+                      new['queries'], 'REGRESSION: ' + notes if notes else ''))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+Наполнение базы для замеров.
+"""
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.sites.models import Site
+
+SIZES = {
+    '1k': 1000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+
+
+def seed(posts, seed=0):
+    """
+    Создает набор через generate_dataset и добавляет flatpages.
+    Набор детерминирован: одинаковый seed дает одинаковые данные.
+    """
+    from posts.dataset import Generator
+
+    Generator(seed=seed).run(
+        users=max(10, posts // 100), groups=20, posts=posts,
+        comments=posts // 2,
+    )
+    site = Site.objects.get_current()
+    for url in ('/about-us/', '/terms/', '/about-author/', '/about-spec/'):
+        page, _ = FlatPage.objects.get_or_create(
+            url=url, defaults={'title': url.strip('/'),
+                               'content': '<p>Страница</p>'}
+        )
+        page.sites.add(site)
@@ -0,0 +1,195 @@
+"""
+Замеры публичных страниц через настоящее WSGI-приложение.
+
+    python -m benchmarks.run --size 1k --output results/1k.json
+    python -m benchmarks.compare base.json head.json
+
+Для каждого URL считаются p50/p95/p99 времени ответа, число SQL-запросов
+и пик выделенной памяти (tracemalloc, в отдельных прогонах без замера
+времени). База для каждого размера создается один раз в benchmarks/data/
+и переиспользуется.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# tracemalloc замедляет каждое выделение памяти, поэтому пик памяти
+# снимается в стольких отдельных прогонах после замера времени.
+MEMORY_ITERATIONS = 5
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1,
+                       round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def prepare(size):
+    os.environ['BENCHMARK_SIZE'] = size
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+
+    os.makedirs(settings.BENCHMARK_DATA_DIR, exist_ok=True)
+    fresh = not os.path.exists(settings.DATABASES['default']['NAME'])
+    call_command('migrate', verbosity=0)
+    if fresh:
+        from benchmarks.datasets import SIZES, seed
+        started = time.perf_counter()
+        seed(SIZES[size])
+        print(f'Набор {size} создан за {time.perf_counter() - started:.1f} с',
+              file=sys.stderr)
+
+
+def targets():
+    """
+    Страницы для замера: по одной на каждое публичное представление.
+    """
+    from posts.models import Group, Post
+    from posts.paginator import KeysetPaginator, encode_cursor
+
+    post = Post.objects.select_related('author').order_by('-pk').first()
+    group = Group.objects.order_by('pk').first()
+    # Курсор страницы далеко от начала ленты.
+    deep = KeysetPaginator(Post.objects.all(), 10).object_list.values(
+        'pub_date', 'id'
+    )[500:501].first() or {'pub_date': post.pub_date, 'id': post.id}
+    return {
+        'index': '/',
+        'index_deep': '/?cursor=' + encode_cursor(
+            [deep['pub_date'], deep['id']], 51
+        ),
+        'group_posts': f'/group/{group.slug}/',
+        'profile': f'/{post.author.username}/',
+        'post_view': f'/{post.author.username}/{post.id}/',
+        'flatpage': '/about-us/',
+    }
+
+
+class Driver:
+    """
+    Выполняет запросы напрямую через yatube.wsgi.application.
+    """
+
+    def __init__(self):
+        from django.db import connection
+        from django.test.client import RequestFactory
+        from yatube.wsgi import application
+
+        self.application = application
+        self.factory = RequestFactory()
+        self.connection = connection
+        self.queries = 0
+
+    def _count(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def get(self, url):
+        path, _, query = url.partition('?')
+        environ = self.factory.get(path, QUERY_STRING=query).environ
+        statuses = []
+        self.queries = 0
+        with self.connection.execute_wrapper(self._count):
+            body = b''.join(self.application(
+                environ, lambda status, headers, exc_info=None:
+                statuses.append(status)
+            ))
+        return statuses[0], body, self.queries
+
+
+def measure(driver, url, iterations, cold):
+    from django.core.cache import cache
+
+    for _ in range(3):
+        driver.get(url)
+    timings = []
+    queries = []
+    for _ in range(iterations):
+        if cold:
+            cache.clear()
+        started = time.perf_counter()
+        status, _, count = driver.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+        queries.append(count)
+        if not status.startswith('200'):
+            raise RuntimeError(f'{url}: {status}')
+    peaks = []
+    for _ in range(MEMORY_ITERATIONS):
+        if cold:
+            cache.clear()
+        tracemalloc.start()
+        driver.get(url)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+    return {
+        'url': url,
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'queries': max(queries),
+        'peak_kib': round(max(peaks), 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', choices=('1k', '100k', '1m'), default='1k')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--cold', action='store_true',
+                        help='Очищать кеш перед каждым запросом')
+    parser.add_argument('--only', nargs='*', help='Имена страниц')
+    parser.add_argument('--output', help='Куда сохранить JSON')
+    args = parser.parse_args(argv)
+
+    prepare(args.size)
+    import django
+    driver = Driver()
+    results = {}
+    for name, url in targets().items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = measure(driver, url, args.iterations, args.cold)
+        print('{:<12} p50 {p50_ms:>8} ms  p95 {p95_ms:>8} ms  '
+              'p99 {p99_ms:>8} ms  {queries:>3} q  {peak_kib:>9} KiB'
+              .format(name, **results[name]), file=sys.stderr)
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'size': args.size,
+            'iterations': args.iterations,
+            'cold': args.cold,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)),
+                    exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as stream:
+            stream.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
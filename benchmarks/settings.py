@@ -0,0 +1,35 @@
+"""
+Настройки для замеров: те же, что у проекта, но с отдельной базой и
+ключами кеша на каждый размер набора данных и с выключенным DEBUG.
+"""
+import os
+
+from yatube.settings import *  # noqa
+
+BENCHMARK_DATA_DIR = os.path.join(BASE_DIR, 'benchmarks', 'data')  # noqa
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        **DATABASES['default'],  # noqa
+        'NAME': os.path.join(
+            BENCHMARK_DATA_DIR,
+            'bench-{}.sqlite3'.format(os.environ.get('BENCHMARK_SIZE', '1k'))
+        ),
+    }
+}
+
+# Ключи кеша отдельные для каждого набора: версии и объекты разных баз
+# не должны смешиваться в общем memcached.
+CACHES = {
+    'default': {
+        **CACHES['default'],  # noqa
+        'KEY_PREFIX': 'bench-{}'.format(
+            os.environ.get('BENCHMARK_SIZE', '1k')
+        ),
+    }
+}
+
+# Фоновые потоки искажают замеры: миниатюры создаются сразу.
+POST_THUMBNAILS_ASYNC = False
@@ -0,0 +1,174 @@
+"""
+Нагрузочная проверка записи в SQLite несколькими процессами.
+
+    python -m benchmarks.sqlite_stress --processes 8 --threads 4 --ops 200
+    python -m benchmarks.sqlite_stress --plain  # sqlite3 по умолчанию
+    python -m benchmarks.sqlite_stress --database /tmp/stress.sqlite3
+
+Каждый процесс в нескольких потоках создает записи и комментарии,
+подписывается и отписывается и читает главную ленту, как это делают
+представления. Считаются ошибки "database is locked"; если они есть,
+код возврата 1.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+
+STRESS_SIZE = 'stress'
+PLAIN_OPTIONS = {}
+
+
+def setup(plain, write_queue, path=None):
+    os.environ['BENCHMARK_SIZE'] = STRESS_SIZE
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    import django
+    from django.conf import settings
+
+    database = settings.DATABASES['default']
+    if path:
+        database['NAME'] = path
+    if plain:
+        database['ENGINE'] = 'django.db.backends.sqlite3'
+        database['OPTIONS'] = PLAIN_OPTIONS
+    else:
+        database['OPTIONS'] = dict(database['OPTIONS'],
+                                   write_queue=write_queue)
+    django.setup()
+
+
+def prepare(plain):
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connection
+    from posts.dataset import Generator
+
+    path = settings.DATABASES['default']['NAME']
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    call_command('migrate', verbosity=0)
+    Generator(seed=1).run(users=50, groups=5, posts=200, comments=200)
+    if plain:
+        # Режим журнала хранится в файле базы.
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode = DELETE')
+    connection.close()
+
+
+def operation(rng, user_ids, post_ids):
+    from posts.models import Comment, Follow, Post
+    from yatube.sqlite.writes import write
+
+    kind = rng.random()
+    user_id = rng.choice(user_ids)
+    if kind < 0.3:
+        post = Post(text='нагрузка ' * rng.randint(1, 20), author_id=user_id)
+        write(post.save)
+        post_ids.append(post.pk)
+    elif kind < 0.8:
+        write(Comment(post_id=rng.choice(post_ids), author_id=user_id,
+                      text='комментарий').save)
+    else:
+        author_id = rng.choice(user_ids)
+        if author_id != user_id:
+            follows = Follow.objects.filter(user_id=user_id,
+                                            author_id=author_id)
+            if not write(follows.delete)[0]:
+                write(Follow.objects.get_or_create, user_id=user_id,
+                      author_id=author_id)
+    list(Post.objects.for_feed()[:10])
+
+
+def worker(number, plain, write_queue, path, threads, ops, results):
+    setup(plain, write_queue, path)
+    from django.db import OperationalError, connection
+    from posts.models import Post, User
+
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    post_ids = list(Post.objects.values_list('pk', flat=True))
+    connection.close()
+    stats = {'ops': 0, 'locked': 0, 'other': 0, 'latencies': []}
+    lock = threading.Lock()
+
+    def run(seed):
+        from django.db import connection as thread_connection
+        rng = random.Random(seed)
+        for _ in range(ops):
+            started = time.perf_counter()
+            outcome = 'ops'
+            try:
+                operation(rng, user_ids, post_ids)
+            except OperationalError as exc:
+                outcome = 'locked' if 'locked' in str(exc) else 'other'
+            except Exception:
+                outcome = 'other'
+            with lock:
+                stats[outcome] += 1
+                stats['latencies'].append(time.perf_counter() - started)
+        thread_connection.close()
+
+    pool = [threading.Thread(target=run, args=(number * 1000 + num,))
+            for num in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put(stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=100,
+                        help='Операций на поток')
+    parser.add_argument('--plain', action='store_true',
+                        help='Бэкенд sqlite3 без WAL и BEGIN IMMEDIATE')
+    parser.add_argument('--write-queue', action='store_true',
+                        help='Включить очередь записи в каждом процессе')
+    parser.add_argument('--database',
+                        help='Файл базы; по умолчанию в benchmarks/data')
+    args = parser.parse_args(argv)
+
+    setup(args.plain, args.write_queue, args.database)
+    prepare(args.plain)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(
+            number, args.plain, args.write_queue, args.database,
+            args.threads, args.ops, results
+        ))
+        for number in range(args.processes)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    totals = {'ops': 0, 'locked': 0, 'other': 0}
+    latencies = []
+    for _ in processes:
+        stats = results.get()
+        latencies.extend(stats.pop('latencies'))
+        for key, value in stats.items():
+            totals[key] += value
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print('успешно {ops}, database is locked {locked}, прочие ошибки '
+          '{other}'.format(**totals))
+    print('{:.0f} оп/с, p50 {:.1f} ms, p99 {:.1f} ms'.format(
+        totals['ops'] / elapsed,
+        latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000,
+    ))
+    return 1 if totals['locked'] or totals['other'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
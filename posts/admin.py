@@ -1,20 +1,95 @@
-from django.contrib import admin
-from .models import Post, Group
+from django.contrib import admin, messages
+from django.db import transaction
+from django.db.models import Count
 
+from .cache import bump_version, invalidate_feeds
+from .models import Comment, Group, GroupStats, Post
+from .paginator import EstimatedCountPaginator
+from .search import search as search_posts
+from .stats import change_counter, get_count
 
-class PostAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'text', 'pub_date', 'author')
-    search_fields = ('text', 'author',)
-    list_filter = ('pub_date', 'text',)
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Общие настройки списков для больших таблиц: приблизительное число
+    строк и без второго COUNT(*) по всей таблице при поиске.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     empty_value_display = ('-пусто-')
 
 
-class GroupAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'title', 'description')
-    search_fields = ('title', 'description',)
-    list_filter = ('title', 'description',)
-    empty_value_display = ('-пусто-')
+class PostAdmin(LargeTableAdmin):
+    list_display = ('pk', 'text', 'pub_date', 'author', 'group')
+    list_select_related = ('author', 'group')
+    autocomplete_fields = ('author', 'group')
+    # Фильтр по дате предлагает фиксированные интервалы и не обращается к
+    # таблице. date_hierarchy его дублировал бы, а для своих ссылок
+    # выбирает различные даты по всей таблице.
+    list_filter = ('pub_date',)
+    search_fields = ('text',)
+    actions = ('clear_group',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по инвертированному индексу вместо LIKE по всему тексту
+        # и точное совпадение имени автора.
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        matches = queryset.filter(
+            pk__in=search_posts(search_term).values('post_id')
+        )
+        by_author = queryset.filter(author__username=search_term)
+        return matches | by_author, False
+
+    @transaction.atomic
+    def clear_group(self, request, queryset):
+        """
+        Одним UPDATE убирает записи из сообществ и поправляет то, что
+        обычно делают сигналы: счетчики, ленты и карточки.
+        """
+        queryset = queryset.filter(group__isnull=False)
+        moved = list(queryset.order_by().values('group_id').annotate(
+            total=Count('id')
+        ))
+        pks = list(queryset.values_list('pk', flat=True))
+        updated = Post.objects.filter(pk__in=pks).update(group=None)
+        for row in moved:
+            change_counter(GroupStats, row['group_id'], 'post_count',
+                           -row['total'])
+        invalidate_feeds(['index'] + [
+            f'group:{slug}' for slug in Group.objects.filter(
+                pk__in=[row['group_id'] for row in moved]
+            ).values_list('slug', flat=True)
+        ])
+        for pk in pks:
+            bump_version('post', pk)
+        self.message_user(request, f'Убрано из сообществ: {updated}',
+                          messages.SUCCESS)
+    clear_group.short_description = 'Убрать из сообщества'
+
+
+class GroupAdmin(LargeTableAdmin):
+    list_display = ('pk', 'title', 'slug', 'post_count')
+    list_select_related = ('stats',)
+    search_fields = ('title', '=slug')
+    prepopulated_fields = {'slug': ('title',)}
+
+    def post_count(self, group):
+        return get_count(group, 'post_count')
+    post_count.short_description = 'Записей'
+
+
+class CommentAdmin(LargeTableAdmin):
+    list_display = ('pk', 'text', 'created', 'author', 'post')
+    list_select_related = ('author', 'post')
+    raw_id_fields = ('post',)
+    autocomplete_fields = ('author',)
+    # По первичному ключу: отдельного индекса по created нет.
+    ordering = ('-pk',)
+    search_fields = ('=author__username', '=post__id')
 
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
+admin.site.register(Comment, CommentAdmin)
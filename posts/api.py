@@ -0,0 +1,171 @@
+"""
+JSON API только для чтения: ленты записей и комментарии.
+
+Строки выбираются через .values() без создания объектов моделей.
+?fields=id,text ограничивает набор столбцов, ?limit= — размер страницы,
+следующая страница запрашивается по ссылке next (курсор).
+"""
+from functools import wraps
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition, require_GET
+
+from .cache import feed_etag, get_versions, make_etag
+from .models import Comment, Post
+from .object_cache import groups, users
+from .paginator import KeysetPaginator
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Поле ответа -> столбец для .values().
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'text_html': 'text_html',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'post': 'post_id',
+    'text': 'text',
+    'text_html': 'text_html',
+    'created': 'created',
+    'author': 'author__username',
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _error(message, status=400):
+    return JsonResponse({'error': message}, status=status,
+                        json_dumps_params={'ensure_ascii': False})
+
+
+def _fields(request, available):
+    requested = request.GET.get('fields')
+    if not requested:
+        return list(available)
+    fields = list(dict.fromkeys(
+        name.strip() for name in requested.split(',') if name.strip()
+    ))
+    unknown = [name for name in fields if name not in available]
+    if unknown or not fields:
+        raise BadRequest('Неизвестные поля: {}. Доступны: {}'.format(
+            ', '.join(unknown), ', '.join(available)
+        ))
+    return fields
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest('limit должен быть числом')
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def _page_url(request, cursor):
+    if cursor is None:
+        return None
+    query = request.GET.copy()
+    query.pop('page', None)
+    query['cursor'] = cursor
+    return request.build_absolute_uri(
+        request.path + '?' + query.urlencode()
+    )
+
+
+def paginated(request, queryset, available, ordering):
+    """
+    Страница строк queryset с полями из ?fields=. Столбцы сортировки
+    выбираются всегда (они нужны курсору), но в ответ попадают только
+    запрошенные.
+    """
+    fields = _fields(request, available)
+    keys = [field.lstrip('-') for field in ordering]
+    columns = dict.fromkeys([available[name] for name in fields] + keys)
+    rows = queryset.values(*columns)
+    paginator, page = KeysetPaginator(
+        rows, _limit(request), ordering=ordering, page_number_limit=0
+    ).paginate(request)
+    results = []
+    for row in page:
+        item = {name: row[available[name]] for name in fields}
+        if 'image' in item:
+            item['image'] = (default_storage.url(item['image'])
+                             if item['image'] else None)
+        results.append(item)
+    return JsonResponse(
+        {
+            'results': results,
+            'next': _page_url(request, page.next_cursor),
+            'previous': _page_url(request, page.previous_cursor),
+        },
+        encoder=DjangoJSONEncoder,
+        json_dumps_params={'ensure_ascii': False},
+    )
+
+
+def api_view(view):
+    """
+    Только GET; ошибки отдаются в JSON, а не HTML-страницей.
+    """
+    @require_GET
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as exc:
+            return _error(str(exc))
+        except Http404:
+            return _error('Не найдено', status=404)
+    return wrapper
+
+
+def _posts(request, queryset):
+    return paginated(request, queryset, POST_FIELDS, ('-pub_date', 'id'))
+
+
+@api_view
+@condition(etag_func=feed_etag(lambda: 'index'))
+def posts(request):
+    return _posts(request, Post.objects.all())
+
+
+@api_view
+@condition(etag_func=feed_etag(lambda slug: f'group:{slug}'))
+def group_posts(request, slug):
+    group = groups.get_or_404(slug)
+    return _posts(request, Post.objects.filter(group_id=group.id))
+
+
+@api_view
+@condition(etag_func=feed_etag(lambda username: f'author:{username}'))
+def user_posts(request, username):
+    author = users.get_or_404(username)
+    return _posts(request, Post.objects.filter(author_id=author.id))
+
+
+def comments_etag(request, post_id):
+    return make_etag(
+        request, *get_versions(('post', post_id), ('thread', post_id))
+    )
+
+
+@api_view
+@condition(etag_func=comments_etag)
+def post_comments(request, post_id):
+    get_object_or_404(Post.objects.only('id'), id=post_id)
+    return paginated(
+        request, Comment.objects.filter(post_id=post_id), COMMENT_FIELDS,
+        ('-created', 'id')
+    )
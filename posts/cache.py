@@ -0,0 +1,188 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import Signal
+from django.http import HttpResponse
+
+from yatube.replicas import use_primary
+
+from .models import Group
+
+VERSION_TIMEOUT = None
+
+
+def cache_is_shared():
+    """
+    Видят ли все процессы сервера один кеш. Сброс в кеше из
+    PROCESS_LOCAL_CACHES до других процессов не доходит.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    return backend not in settings.PROCESS_LOCAL_CACHES
+
+
+def _version_key(kind, pk):
+    return f'posts:version:{kind}:{pk}'
+
+
+def _replica_lag_ns():
+    return settings.DATABASE_REPLICA_STICKY_SECONDS * 10 ** 9
+
+
+def _initial_version():
+    # Версия, которой точно не было раньше: если ключ версии вытеснен
+    # из кеша, старые фрагменты не должны снова стать актуальными.
+    # Свежим изменением она не считается.
+    return time.time_ns() - _replica_lag_ns()
+
+
+def get_versions(*keys):
+    """
+    Возвращает текущие версии для пар (kind, pk) одним обращением к кешу.
+
+    Версия — время последнего изменения в наносекундах. Если какая-то
+    из них моложе DATABASE_REPLICA_STICKY_SECONDS, реплики могли еще не
+    получить изменение, и запрос дальше читает из основной базы: иначе
+    старые данные попали бы в кеш и в ETag под новой версией.
+    """
+    cache_keys = [_version_key(kind, pk) for kind, pk in keys]
+    found = cache.get_many(cache_keys)
+    versions = []
+    for key in cache_keys:
+        if key not in found:
+            cache.add(key, _initial_version(), VERSION_TIMEOUT)
+            found[key] = cache.get(key)
+        versions.append(found[key])
+    if max(versions, default=0) > time.time_ns() - _replica_lag_ns():
+        use_primary()
+    return versions
+
+
+def bump_version(kind, pk):
+    """
+    Делает недействительными все фрагменты, зависящие от объекта.
+
+    Внутри транзакции версия меняется после фиксации: иначе параллельный
+    запрос успел бы прочитать старые данные и сохранить их под новой
+    версией.
+    """
+    key = _version_key(kind, pk)
+    transaction.on_commit(
+        lambda: cache.set(key, time.time_ns(), VERSION_TIMEOUT)
+    )
+
+
+def post_card_version(post):
+    """
+    Версия карточки записи: меняется при изменении записи или ее автора.
+    """
+    post_version, author_version = get_versions(
+        ('post', post.pk), ('author', post.author_id)
+    )
+    return f'{post_version}.{author_version}'
+
+
+def make_etag(request, *parts):
+    """
+    ETag страницы из версий и ключей данных, на которых она построена.
+    Страница зависит и от пользователя (кнопки, подписка), поэтому он
+    тоже входит в ETag.
+    """
+    user = request.user.pk if request.user.is_authenticated else 'anonymous'
+    return hashlib.md5(
+        ':'.join(map(str, (user,) + parts)).encode()
+    ).hexdigest()
+
+
+def feed_etag(feed):
+    """
+    Функция для @condition: ETag ленты по ее версии, как в
+    cache_feed_page. Проверка обходится одним обращением к кешу, без
+    запросов к базе.
+    """
+    def etag(request, **kwargs):
+        version, = get_versions(('feed', feed(**kwargs)))
+        return make_etag(request, version)
+    return etag
+
+
+PAGE_CACHE_TIMEOUT = 60 * 60
+PAGE_CACHE_STATS = Counter()
+_stats_lock = threading.Lock()
+# Отправляется при каждом обращении к страничному кешу; outcome — 'hit'
+# или 'miss'. На него подписаны метрики запросов.
+page_cache_lookup = Signal(providing_args=['outcome'])
+
+
+def feed_names(post, group_ids=()):
+    """
+    Ленты, на которых показывается запись: главная, профиль автора и
+    страницы сообществ (текущего и, при редактировании, прежнего).
+    """
+    names = ['index', f'author:{post.author.username}']
+    group_ids = {pk for pk in (post.group_id, *group_ids) if pk is not None}
+    if group_ids:
+        slugs = Group.objects.filter(pk__in=group_ids).values_list(
+            'slug', flat=True
+        )
+        names.extend(f'group:{slug}' for slug in slugs)
+    return names
+
+
+def invalidate_feeds(names):
+    for name in names:
+        bump_version('feed', name)
+
+
+def _record(outcome):
+    with _stats_lock:
+        PAGE_CACHE_STATS[outcome] += 1
+    page_cache_lookup.send(sender=None, outcome=outcome)
+
+
+def page_cache_stats():
+    """
+    Счетчики попаданий и промахов страничного кеша в этом процессе.
+    """
+    with _stats_lock:
+        return {'hit': PAGE_CACHE_STATS['hit'],
+                'miss': PAGE_CACHE_STATS['miss']}
+
+
+def cache_feed_page(feed):
+    """
+    Кеширует страницу ленты целиком для анонимных GET-запросов.
+
+    feed(**kwargs) возвращает имя ленты по аргументам представления.
+    Ключ включает версию ленты и параметры ?page= и ?cursor=, поэтому
+    изменение записи сбрасывает ровно те ленты, где она показана.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            name = feed(**kwargs)
+            version, = get_versions(('feed', name))
+            key = 'posts:page:{}:{}:{}:{}'.format(
+                name, version,
+                request.GET.get('page', ''), request.GET.get('cursor', '')
+            )
+            cached = cache.get(key)
+            if cached is not None:
+                _record('hit')
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+            _record('miss')
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies:
+                cache.set(key, (response.content, response['Content-Type']),
+                          PAGE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
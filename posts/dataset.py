@@ -0,0 +1,261 @@
+"""
+Синтетический набор данных для нагрузочного тестирования.
+
+Распределения намеренно неравномерные, как в живом сервисе: несколько
+авторов пишут большую часть записей, несколько сообществ собирают
+большую часть трафика, а у небольшой доли записей длинные обсуждения.
+"""
+import io
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from . import search, stats, timeline
+from .cache import invalidate_feeds
+from .media import post_images, recount_blobs
+from .models import (Comment, Group, Post, User, render_comment_text,
+                     render_post_text)
+from .transfer import keep_timestamps
+
+BATCH_SIZE = 5000
+# Показатель закона Ципфа: чем больше, тем сильнее перекос.
+AUTHOR_SKEW = 1.1
+GROUP_SKEW = 1.3
+THREAD_SKEW = 0.8
+NO_GROUP_SHARE = 0.3
+# Средний интервал между записями и разброс ответов в обсуждении.
+POST_INTERVAL = timedelta(minutes=3)
+COMMENT_DELAY = timedelta(days=2)
+# SQLite ограничивает число параметров одного запроса.
+LOOKUP_CHUNK = 900
+
+WORDS = (
+    'город', 'утро', 'дорога', 'книга', 'музыка', 'море', 'лес', 'работа',
+    'друзья', 'кофе', 'погода', 'фотография', 'путешествие', 'вечер',
+    'проект', 'история', 'кино', 'зима', 'лето', 'праздник', 'новости',
+    'спорт', 'код', 'кошка', 'собака', 'выставка', 'концерт', 'рецепт',
+    'хороший', 'новый', 'долгий', 'красивый', 'интересный', 'первый',
+    'читать', 'писать', 'смотреть', 'гулять', 'думать', 'помнить',
+    'сегодня', 'снова', 'наконец', 'очень', 'почти', 'всегда',
+)
+
+
+def _zipf_weights(size, skew):
+    return list(accumulate(1 / rank ** skew for rank in range(1, size + 1)))
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _sentence(rng, low, high):
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return ' '.join(words).capitalize() + '.'
+
+
+def _ids(model, field, values):
+    ids = []
+    for chunk in _batches(values, LOOKUP_CHUNK):
+        ids.extend(model.objects.filter(
+            **{f'{field}__in': chunk}
+        ).order_by('pk').values_list('pk', flat=True))
+    return ids
+
+
+def placeholder_image(rng, num, size=(640, 480)):
+    """
+    Однотонная картинка JPEG с номером в хранилище изображений записей.
+    """
+    from PIL import Image, ImageDraw
+
+    color = tuple(rng.randrange(256) for _ in range(3))
+    image = Image.new('RGB', size, color)
+    ImageDraw.Draw(image).text((10, 10), str(num), fill=(255, 255, 255))
+    content = io.BytesIO()
+    image.save(content, 'JPEG', quality=80)
+    return post_images.save(
+        f'posts/placeholder-{num}.jpg', ContentFile(content.getvalue())
+    )
+
+
+class Generator:
+    """
+    Создает пользователей, сообщества, записи, комментарии и картинки
+    пакетами через bulk_create. Одинаковый seed дает одинаковые данные.
+    """
+
+    def __init__(self, seed=0, batch_size=BATCH_SIZE, prefix='user',
+                 progress=None):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.progress = progress
+        self.created = {'user': 0, 'group': 0, 'post': 0, 'comment': 0,
+                        'image': 0}
+
+    def report(self):
+        if self.progress:
+            self.progress(self.created)
+
+    def run(self, users, groups, posts, comments, images=0):
+        user_ids = self.create_users(users)
+        group_ids = self.create_groups(groups)
+        post_ids, started = self.create_posts(posts, user_ids, group_ids)
+        self.create_comments(comments, post_ids, started, user_ids)
+        self.attach_images(images, post_ids)
+        # bulk_create не отправляет сигналы: счетчики и индекс
+        # дополняются по ходу, ленты подписчиков и закешированные ленты —
+        # явно.
+        timeline.backfill_authors(user_ids)
+        invalidate_feeds(
+            ['index']
+            + [f'group:{self.prefix}-group-{num}' for num in range(groups)]
+            + [f'author:{self.prefix}{num}' for num in range(users)]
+        )
+        return self.created
+
+    def create_users(self, count):
+        names = [f'{self.prefix}{num}' for num in range(count)]
+        for batch in _batches(names, self.batch_size):
+            with transaction.atomic():
+                User.objects.bulk_create(
+                    [User(username=name, first_name='Имя',
+                          last_name=f'Фамилия {name}', password='!')
+                     for name in batch],
+                    ignore_conflicts=True
+                )
+        self.created['user'] += count
+        self.report()
+        return _ids(User, 'username', names)
+
+    def create_groups(self, count):
+        slugs = [f'{self.prefix}-group-{num}' for num in range(count)]
+        with transaction.atomic():
+            Group.objects.bulk_create(
+                [Group(title=f'Сообщество {num}', slug=slug,
+                       description=_sentence(self.rng, 5, 15))
+                 for num, slug in enumerate(slugs)],
+                ignore_conflicts=True
+            )
+        self.created['group'] += count
+        self.report()
+        return _ids(Group, 'slug', slugs)
+
+    def create_posts(self, count, user_ids, group_ids):
+        """
+        Записи идут по времени с равным шагом, последние — в настоящем.
+        Возвращает id созданных записей и дату первой из них.
+        """
+        rng = self.rng
+        authors = _zipf_weights(len(user_ids), AUTHOR_SKEW)
+        hot_groups = _zipf_weights(len(group_ids), GROUP_SKEW)
+        started = timezone.now() - POST_INTERVAL * count
+        last_pk = Post.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+
+        def build(num):
+            group_id = None
+            if group_ids and rng.random() >= NO_GROUP_SHARE:
+                group_id = rng.choices(group_ids, cum_weights=hot_groups)[0]
+            text = ' '.join(_sentence(rng, 4, 20)
+                            for _ in range(rng.randint(1, 4)))
+            return Post(
+                text=text,
+                text_html=render_post_text(text),
+                author_id=rng.choices(user_ids, cum_weights=authors)[0],
+                group_id=group_id,
+                pub_date=started + POST_INTERVAL * num,
+            )
+
+        with keep_timestamps():
+            for batch in _batches(map(build, range(count)), self.batch_size):
+                with transaction.atomic():
+                    Post.objects.bulk_create(batch)
+                    stats.count_new(posts=batch)
+                self.created['post'] += len(batch)
+                self.report()
+        created = Post.objects.filter(pk__gt=last_pk).order_by('pk')
+        # SQLite не возвращает id из bulk_create: новые записи
+        # индексируются по диапазону id.
+        search.index_new(
+            posts=created.values_list('pk', 'text').iterator(),
+            batch_size=self.batch_size,
+        )
+        return list(created.values_list('pk', flat=True)), started
+
+    def create_comments(self, count, post_ids, started, user_ids):
+        """
+        Обсуждаемые записи выбираются по Ципфу среди перемешанных записей,
+        поэтому длинные ветки встречаются по всей ленте, а не только в
+        ее начале.
+        """
+        if not post_ids or not user_ids:
+            return
+        rng = self.rng
+        threads = list(range(len(post_ids)))
+        rng.shuffle(threads)
+        thread_weights = _zipf_weights(len(threads), THREAD_SKEW)
+        authors = _zipf_weights(len(user_ids), AUTHOR_SKEW)
+        delay = COMMENT_DELAY.total_seconds()
+        now = timezone.now()
+        last_pk = Comment.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+
+        def build(num):
+            position = rng.choices(threads, cum_weights=thread_weights)[0]
+            created = started + POST_INTERVAL * position + timedelta(
+                seconds=rng.random() * delay
+            )
+            text = _sentence(rng, 2, 25)
+            return Comment(
+                post_id=post_ids[position],
+                author_id=rng.choices(user_ids, cum_weights=authors)[0],
+                text=text,
+                text_html=render_comment_text(text),
+                created=min(created, now),
+            )
+
+        with keep_timestamps():
+            for batch in _batches(map(build, range(count)), self.batch_size):
+                with transaction.atomic():
+                    Comment.objects.bulk_create(batch)
+                    stats.count_new(comments=batch)
+                self.created['comment'] += len(batch)
+                self.report()
+        search.index_new(
+            comments=Comment.objects.filter(pk__gt=last_pk).order_by(
+                'pk'
+            ).values_list('pk', 'text', 'post_id').iterator(),
+            batch_size=self.batch_size,
+        )
+
+    def attach_images(self, count, post_ids):
+        """
+        Сохраняет count картинок и раздает их случайным записям; одна
+        картинка может достаться нескольким записям.
+        """
+        if not count or not post_ids:
+            return
+        names = [placeholder_image(self.rng, num) for num in range(count)]
+        self.created['image'] += count
+        picked = self.rng.sample(post_ids, min(len(post_ids), count * 4))
+        with transaction.atomic():
+            for pk in picked:
+                Post.objects.filter(pk=pk).update(
+                    image=self.rng.choice(names)
+                )
+            recount_blobs()
+        self.report()
@@ -0,0 +1,130 @@
+"""
+Простые страницы (django.contrib.flatpages) из памяти процесса.
+
+Все страницы загружаются одним запросом при первом обращении вместе с
+шаблонами, которыми их выводить. Версия ('flatpages', 'all') в кеше
+меняется при любой правке страницы; процесс сверяет ее на каждом
+запросе и перечитывает страницы, если она изменилась. Для анонимных
+посетителей готовый HTML тоже хранится в памяти.
+
+Версию видят все процессы, только если кеш общий. С кешем в памяти
+процесса (PROCESS_LOCAL_CACHES) правку сразу видит один процесс, а
+остальные перечитывают страницы не реже раза в FLATPAGES_MAX_AGE.
+
+Ответы отдаются с ETag и Cache-Control: max-age=FLATPAGES_MAX_AGE, так
+что браузеры и прокси показывают старую страницу не дольше этого.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.flatpages.views import DEFAULT_TEMPLATE
+from django.contrib.sites.shortcuts import get_current_site
+from django.http import Http404, HttpResponse, HttpResponsePermanentRedirect
+from django.template import loader
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                quote_etag)
+from django.utils.safestring import mark_safe
+from django.views.decorators.csrf import csrf_protect
+
+from .cache import bump_version, cache_is_shared, get_versions, make_etag
+
+VERSION_KEY = ('flatpages', 'all')
+
+
+class FlatPageCache:
+    def __init__(self):
+        self.version = None
+        self.loaded = 0
+        self.pages = {}
+        self.rendered = {}
+        self.lock = threading.Lock()
+
+    def is_current(self, version):
+        if version != self.version:
+            return False
+        # Правку в другом процессе с локальным кешем видно только так.
+        return (cache_is_shared() or time.monotonic() - self.loaded
+                < settings.FLATPAGES_MAX_AGE)
+
+    def get(self, site_id, url):
+        """
+        Страница и версия, по которой она загружена.
+        """
+        version, = get_versions(VERSION_KEY)
+        if not self.is_current(version):
+            with self.lock:
+                if not self.is_current(version):
+                    self.load(version)
+        return self.pages.get((site_id, url)), version
+
+    def load(self, version):
+        pages = {}
+        for page in FlatPage.objects.prefetch_related('sites'):
+            # Как во flatpages.views: содержимое — это готовый HTML.
+            page.title = mark_safe(page.title)
+            page.content = mark_safe(page.content)
+            if page.template_name:
+                page.template = loader.select_template(
+                    (page.template_name, DEFAULT_TEMPLATE)
+                )
+            else:
+                page.template = loader.get_template(DEFAULT_TEMPLATE)
+            for site in page.sites.all():
+                pages[site.pk, page.url] = page
+        self.pages = pages
+        self.rendered = {}
+        self.version = version
+        self.loaded = time.monotonic()
+
+    def clear(self):
+        with self.lock:
+            self.version = None
+
+
+pages = FlatPageCache()
+
+
+def invalidate():
+    bump_version(*VERSION_KEY)
+    pages.clear()
+
+
+def flatpage(request, url):
+    if not url.startswith('/'):
+        url = '/' + url
+    site_id = get_current_site(request).id
+    page, version = pages.get(site_id, url)
+    if page is None:
+        if (not url.endswith('/') and settings.APPEND_SLASH
+                and pages.get(site_id, url + '/')[0] is not None):
+            return HttpResponsePermanentRedirect(f'{request.path}/')
+        raise Http404('No FlatPage matches the given query.')
+    if page.registration_required and not request.user.is_authenticated:
+        return redirect_to_login(request.path)
+    etag = quote_etag(make_etag(request, version, url))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = render_flatpage(request, page, (version, site_id, url))
+    response['ETag'] = etag
+    visibility = 'private' if request.user.is_authenticated else 'public'
+    patch_cache_control(
+        response, max_age=settings.FLATPAGES_MAX_AGE, **{visibility: True}
+    )
+    return response
+
+
+@csrf_protect
+def render_flatpage(request, page, key):
+    anonymous = not request.user.is_authenticated
+    content = pages.rendered.get(key) if anonymous else None
+    if content is not None:
+        return HttpResponse(content)
+    response = HttpResponse(page.template.render({'flatpage': page}, request))
+    # Страницу с CSRF-токеном делить между посетителями нельзя. Версия в
+    # ключе не дает отрисовке старой страницы попасть в новую версию.
+    if anonymous and not request.META.get('CSRF_COOKIE_USED'):
+        pages.rendered[key] = response.content
+    return response
@@ -1,5 +1,9 @@
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm
 from django import forms
+from PIL import Image
+
+from .images import ingest
 from .models import Post, Comment
 
 
@@ -18,6 +22,21 @@ class PostForm(ModelForm):
             "image": "Изображение"
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get("image")
+        # Новую загрузку уменьшаем и очищаем от EXIF до сохранения.
+        if isinstance(image, UploadedFile):
+            # verify() пропускает, например, обрезанный JPEG: ошибка
+            # появляется только при декодировании.
+            try:
+                return ingest(image)
+            except (OSError, ValueError, Image.DecompressionBombError):
+                raise forms.ValidationError(
+                    self.fields["image"].error_messages["invalid_image"],
+                    code="invalid_image",
+                )
+        return image
+
 
 class CommentForm(ModelForm):
     text = forms.CharField(widget=forms.Textarea)
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.cache import bump_version, invalidate_feeds
+from posts.models import (Comment, Post, render_comment_text,
+                          render_post_text)
+
+
+def invalidate_posts(pks):
+    """
+    Карточки записей и ленты, на которых они показываются.
+    """
+    feeds = {'index'}
+    for pk, username, slug in Post.objects.filter(pk__in=pks).values_list(
+            'pk', 'author__username', 'group__slug'):
+        bump_version('post', pk)
+        feeds.add(f'author:{username}')
+        if slug:
+            feeds.add(f'group:{slug}')
+    invalidate_feeds(feeds)
+
+
+def invalidate_comments(pks):
+    post_ids = set(Comment.objects.filter(pk__in=pks).values_list(
+        'post_id', flat=True
+    ))
+    for post_id in post_ids:
+        bump_version('thread', post_id)
+
+
+def backfill(model, render, batch_size, everything=False, invalidate=None):
+    """
+    Заполняет text_html пакетами по возрастанию pk. Без everything
+    обрабатываются только строки, где HTML еще пуст. Пишутся только
+    изменившиеся строки; для них вызывается invalidate, чтобы кеш не
+    отдавал старый HTML. Возвращает число измененных строк.
+    """
+    queryset = model.objects.order_by('pk')
+    if not everything:
+        queryset = queryset.filter(text_html='')
+    last_pk = 0
+    done = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).values_list(
+            'pk', 'text', 'text_html'
+        )[:batch_size])
+        if not rows:
+            return done
+        rendered = [(pk, render(text), html) for pk, text, html in rows]
+        changed = [model(pk=pk, text_html=new)
+                   for pk, new, old in rendered if new != old]
+        with transaction.atomic():
+            model.objects.bulk_update(changed, ['text_html'])
+            if invalidate and changed:
+                invalidate([obj.pk for obj in changed])
+        last_pk = rows[-1][0]
+        done += len(changed)
+
+
+class Command(BaseCommand):
+    help = 'Заполняет готовый HTML текста записей и комментариев'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--all', action='store_true', dest='everything',
+            help='Перерисовать и уже заполненные строки',
+        )
+
+    def handle(self, *args, **options):
+        for model, render, invalidate in (
+                (Post, render_post_text, invalidate_posts),
+                (Comment, render_comment_text, invalidate_comments)):
+            done = backfill(model, render, options['batch_size'],
+                            options['everything'], invalidate)
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {done}')
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from posts.models import Comment, Post
+from posts.paginator import KeysetPaginator
+from posts.views import COMMENTS_PER_PAGE, post_queryset
+
+# Признаки полного просмотра таблицы в планах SQLite и PostgreSQL.
+FULL_SCAN_MARKERS = {
+    'sqlite': ('SCAN TABLE', 'SCAN posts_'),
+    'postgresql': ('Seq Scan',),
+}
+INDEX_MARKERS = ('USING INDEX', 'USING COVERING INDEX', 'Index Scan',
+                 'Index Only Scan', 'Bitmap Index Scan')
+
+
+def feed_queries():
+    """
+    Запросы, которые выполняют представления ленты и страницы записи.
+    Значения параметров условные: для EXPLAIN строки не нужны.
+    """
+    feeds = {
+        'index': (Post.objects.for_feed(), 10, ('-pub_date', 'id')),
+        'group_posts': (Post.objects.for_feed().filter(group_id=1), 10,
+                        ('-pub_date', 'id')),
+        'profile': (Post.objects.for_feed().filter(author_id=1), 10,
+                    ('-pub_date', 'id')),
+        'post_view (comments)': (
+            Comment.objects.for_thread().filter(post_id=1),
+            COMMENTS_PER_PAGE, ('-created', 'id')
+        ),
+    }
+    for name, (queryset, per_page, ordering) in feeds.items():
+        paginator = KeysetPaginator(queryset, per_page, ordering=ordering)
+        yield name, paginator.object_list[:per_page + 1]
+        condition = paginator._cursor_condition(
+            ['2020-01-01 00:00:00+00:00', 1], 'next'
+        )
+        yield f'{name} (cursor)', paginator.object_list.filter(
+            condition
+        )[:per_page + 1]
+    # get_object_or_404() выполняет get(), а он сбрасывает сортировку.
+    yield 'post_view', post_queryset().filter(author_id=1, id=1).order_by()
+
+
+class Command(BaseCommand):
+    help = 'Выводит EXPLAIN для запросов лент и страницы записи'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Завершиться с ошибкой, если запрос просматривает '
+                 'таблицу записей или комментариев без индекса',
+        )
+
+    def handle(self, *args, **options):
+        markers = FULL_SCAN_MARKERS.get(connection.vendor, ())
+        failed = []
+        for name, queryset in feed_queries():
+            plan = queryset.explain()
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+            self.stdout.write('')
+            for line in plan.splitlines():
+                if any(marker in line for marker in markers) and not any(
+                        marker in line for marker in INDEX_MARKERS):
+                    failed.append(f'{name}: {line.strip()}')
+        if options['check'] and failed:
+            raise CommandError(
+                'Запросы без индекса:\n' + '\n'.join(failed)
+            )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from posts.transfer import export_rows, write_csv, write_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Выгружает сообщества, записи и комментарии в JSON Lines или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            default='jsonl')
+        parser.add_argument('--output', help='Файл; по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        writer = write_csv if options['format'] == 'csv' else write_jsonl
+        rows = export_rows(chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8',
+                      newline='') as stream:
+                writer(rows, stream)
+        else:
+            writer(rows, self.stdout)
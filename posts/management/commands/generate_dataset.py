@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from posts import search, stats
+from posts.dataset import BATCH_SIZE, Generator
+
+
+class Command(BaseCommand):
+    help = 'Создает синтетический набор данных для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--comments', type=int, default=2000)
+        parser.add_argument(
+            '--images', type=int, default=0,
+            help='Сколько картинок-заглушек создать в media/posts/',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--prefix', default='user',
+            help='Префикс имен пользователей и адресов сообществ',
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Пересчитать все счетчики и перестроить поисковый индекс '
+                 '(новые строки учитываются и без этого)',
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 and options['posts']:
+            self.stderr.write('Для записей нужен хотя бы один пользователь')
+            return
+
+        def progress(created):
+            self.stderr.write('создано: ' + ', '.join(
+                f'{k} {v}' for k, v in created.items()
+            ))
+
+        generator = Generator(
+            seed=options['seed'], batch_size=options['batch_size'],
+            prefix=options['prefix'], progress=progress,
+        )
+        generator.run(
+            users=options['users'], groups=options['groups'],
+            posts=options['posts'], comments=options['comments'],
+            images=options['images'],
+        )
+        if options['rebuild']:
+            stats.recount()
+            search.rebuild(batch_size=options['batch_size'])
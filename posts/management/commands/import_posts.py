@@ -0,0 +1,52 @@
+import sys
+from contextlib import nullcontext
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from posts import search, stats
+from posts.transfer import Importer, read_csv, read_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Загружает сообщества, записи и комментарии из JSON Lines или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл выгрузки или - для stdin')
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            default='jsonl')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--skip', type=int, default=0,
+            help='Пропустить первые N строк (продолжение после сбоя)',
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Пересчитать все счетчики и перестроить поисковый индекс '
+                 '(новые строки учитываются и без этого)',
+        )
+
+    def handle(self, *args, **options):
+        reader = read_csv if options['format'] == 'csv' else read_jsonl
+        importer = Importer(batch_size=options['batch_size'])
+
+        def progress(created, skipped):
+            self.stderr.write(
+                'создано: {}, пропущено: {}'.format(
+                    ', '.join(f'{k} {v}' for k, v in created.items()),
+                    skipped
+                )
+            )
+
+        # stdin закрывать нельзя: команду могут вызывать из другого кода.
+        if options['path'] == '-':
+            source = nullcontext(sys.stdin)
+        else:
+            source = open(options['path'], encoding='utf-8', newline='')
+        with source as stream:
+            rows = islice(reader(stream), options['skip'], None)
+            created, skipped = importer.run(rows, progress=progress)
+        if options['rebuild']:
+            stats.recount()
+            search.rebuild(batch_size=options['batch_size'])
+        progress(created, skipped)
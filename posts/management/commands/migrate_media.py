@@ -0,0 +1,74 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from sorl.thumbnail import delete as delete_thumbnails
+
+from posts.cache import bump_version, feed_names, invalidate_feeds
+from posts.media import (content_hash, content_name, is_content_addressed,
+                         post_images, recount_blobs)
+from posts.models import Post
+
+
+def move(name, keep_originals=False):
+    """
+    Переносит файл name в хранилище по содержимому и переключает на
+    него записи. Возвращает новое имя и признак того, что такой файл уже
+    был.
+    """
+    with default_storage.open(name) as source:
+        new_name = content_name(name, content_hash(source))
+        existed = post_images.exists(new_name)
+        if not existed:
+            post_images.save(name, source)
+    with transaction.atomic():
+        posts = list(Post.objects.filter(image=name).select_related(
+            'author'
+        ))
+        Post.objects.filter(image=name).update(image=new_name)
+        for post in posts:
+            bump_version('post', post.pk)
+            invalidate_feeds(feed_names(post))
+    if not keep_originals:
+        delete_thumbnails(name)
+    return new_name, existed
+
+
+class Command(BaseCommand):
+    help = ('Переносит изображения записей в хранилище по содержимому и '
+            'пересчитывает ссылки на файлы')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-originals', action='store_true',
+            help='Не удалять старые файлы и их миниатюры',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, сколько файлов будет перенесено',
+        )
+
+    def handle(self, *args, **options):
+        names = [
+            name for name in Post.objects.exclude(image__isnull=True)
+            .exclude(image='').order_by().values_list('image', flat=True)
+            .distinct().iterator()
+            if not is_content_addressed(name)
+        ]
+        stats = {'moved': 0, 'duplicates': 0, 'missing': 0}
+        for name in names:
+            if not default_storage.exists(name):
+                stats['missing'] += 1
+                self.stderr.write(f'Нет файла: {name}')
+                continue
+            if options['dry_run']:
+                stats['moved'] += 1
+                continue
+            new_name, existed = move(name, options['keep_originals'])
+            stats['duplicates' if existed else 'moved'] += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{name} -> {new_name}')
+        if not options['dry_run']:
+            stats['files'] = recount_blobs()
+        self.stdout.write(', '.join(
+            f'{key}: {value}' for key, value in stats.items()
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.stats import recount
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики записей и комментариев'
+
+    def handle(self, *args, **options):
+        for name, rows in recount().items():
+            self.stdout.write(f'{name}: {rows}')
@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from yatube.replicas import sync
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную SQLite-базу в реплики; локальная замена '
+            'репликации')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'replicas', nargs='*',
+            help='Псевдонимы реплик, по умолчанию DATABASE_REPLICAS',
+        )
+        parser.add_argument(
+            '--interval', type=float,
+            help='Повторять каждые N секунд, пока команду не остановят',
+        )
+
+    def handle(self, *args, **options):
+        replicas = options['replicas'] or settings.DATABASE_REPLICAS
+        if not replicas:
+            raise CommandError('Не указаны реплики')
+        for alias in ['default', *replicas]:
+            if alias not in settings.DATABASES:
+                raise CommandError(f'Нет базы {alias}')
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f'{alias}: поддерживается только SQLite')
+        while True:
+            started = time.perf_counter()
+            sync(targets=replicas)
+            self.stdout.write('Скопировано в {} за {:.0f} ms'.format(
+                ', '.join(replicas), (time.perf_counter() - started) * 1000
+            ))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import generate_in_worker
+
+
+class Command(BaseCommand):
+    help = 'Создает миниатюры для всех изображений записей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            default=settings.POST_THUMBNAILS_WORKERS,
+            help='Число параллельных потоков',
+        )
+
+    def handle(self, *args, **options):
+        names = Post.objects.exclude(image='').exclude(
+            image__isnull=True
+        ).order_by().values_list('image', flat=True).distinct()
+        done = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            futures = [
+                pool.submit(generate_in_worker, name)
+                for name in names.iterator()
+            ]
+            for done, _ in enumerate(as_completed(futures), 1):
+                if done % 100 == 0:
+                    self.stdout.write(f'{done}/{len(futures)}')
+        self.stdout.write(f'Готово: {done}')
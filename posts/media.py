@@ -0,0 +1,141 @@
+"""
+Хранилище изображений записей по содержимому.
+
+Файл называется SHA-256 своего содержимого и лежит в двух уровнях
+подкаталогов: posts/3f/a2/3fa2...e1.jpg. Одинаковые загрузки дают одно
+имя, и файл записывается один раз. ImageBlob считает записи, которые
+ссылаются на файл; когда ссылок не остается, файл и его миниатюры
+удаляются после фиксации транзакции.
+
+Тот же файл могут загрузить снова, пока удаление еще не выполнено.
+Поэтому файл без строки ImageBlob при сохранении записывается заново, а
+collect() не трогает файлы, измененные после снятия последней ссылки.
+Сохранение и удаление выполняются в транзакции записи: в SQLite с
+begin_immediate она держит блокировку, и эти шаги не перемежаются.
+"""
+import hashlib
+import os
+import re
+import time
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 64 * 1024
+CONTENT_NAME = re.compile(
+    r'^(?:.+/)?(?P<a>[0-9a-f]{2})/(?P<b>[0-9a-f]{2})/'
+    r'(?P=a)(?P=b)[0-9a-f]{60}(?:\.\w+)?$'
+)
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def content_name(name, digest):
+    """
+    Имя файла по хешу: каталог из name, два уровня по 256 подкаталогов,
+    расширение из name.
+    """
+    directory = os.path.dirname(name)
+    extension = os.path.splitext(name)[1].lower()
+    return os.path.join(
+        directory, digest[:2], digest[2:4], digest + extension
+    ).replace('\\', '/')
+
+
+def is_content_addressed(name):
+    return bool(name and CONTENT_NAME.match(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def _save(self, name, content):
+        from .models import ImageBlob
+        name = content_name(name, content_hash(content))
+        with transaction.atomic():
+            if self.exists(name):
+                # Без ссылок файл может ждать удаления в collect():
+                # новая запись обновляет время его изменения.
+                if ImageBlob.objects.filter(name=name).exists():
+                    return name
+                self.delete(name)
+            return super()._save(name, content)
+
+
+post_images = ContentAddressedStorage()
+
+
+def acquire(name):
+    from .models import ImageBlob
+    if not name:
+        return
+    rows = ImageBlob.objects.filter(name=name)
+    if rows.update(refcount=F('refcount') + 1):
+        return
+    with transaction.atomic():
+        ImageBlob.objects.get_or_create(name=name)
+        rows.update(refcount=F('refcount') + 1)
+
+
+def release(name):
+    """
+    Снимает ссылку на файл. Файлы без строки ImageBlob (загруженные до
+    перехода, если migrate_media еще не запускали) не трогаются.
+    """
+    from .models import ImageBlob
+    if not name:
+        return
+    rows = ImageBlob.objects.filter(name=name)
+    rows.filter(refcount__gt=0).update(refcount=F('refcount') - 1)
+    if rows.filter(refcount=0).delete()[0]:
+        released = time.time()
+        transaction.on_commit(lambda: collect(name, released))
+
+
+def collect(name, released=None):
+    """
+    Удаляет файл без ссылок и его миниатюры. Файл, который записан
+    заново после released, остается.
+    """
+    from sorl.thumbnail import delete as delete_thumbnails
+    from sorl.thumbnail.images import ImageFile
+
+    from .models import ImageBlob
+    with transaction.atomic():
+        # Пока шла транзакция, файл могли загрузить снова.
+        if ImageBlob.objects.filter(name=name).exists():
+            return
+        if (released is not None and post_images.exists(name)
+                and os.path.getmtime(post_images.path(name)) > released):
+            return
+        delete_thumbnails(ImageFile(name, post_images))
+
+
+@transaction.atomic
+def recount_blobs():
+    """
+    Пересчитывает ссылки по фактическим записям: после bulk_create,
+    импорта и переноса файлов. Возвращает число файлов.
+    """
+    from .models import ImageBlob, Post
+    counts = dict(
+        Post.objects.exclude(image__isnull=True).exclude(image='')
+        .order_by().values_list('image').annotate(total=Count('id'))
+    )
+    ImageBlob.objects.all().delete()
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(name=name, refcount=total)
+         for name, total in counts.items()],
+        batch_size=500
+    )
+    return len(counts)
@@ -0,0 +1,52 @@
+# Generated by Django 2.2.9 on 2026-10-18 17:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_index(apps, schema_editor):
+    from posts.search import COMMENT_WEIGHT, POST_WEIGHT, terms
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    SearchPosting = apps.get_model('posts', 'SearchPosting')
+    rows = [(pk, None, text, POST_WEIGHT)
+            for pk, text in Post.objects.values_list('pk', 'text')]
+    rows += [(post_id, pk, text, COMMENT_WEIGHT)
+             for pk, post_id, text in Comment.objects.values_list(
+                 'pk', 'post_id', 'text')]
+    postings = []
+    for post_id, comment_id, text, weight in rows:
+        frequencies = {}
+        for term in terms(text):
+            frequencies[term] = frequencies.get(term, 0) + 1
+        postings.extend(
+            SearchPosting(term=term, weight=weight * count, post_id=post_id,
+                          comment_id=comment_id)
+            for term, count in frequencies.items()
+        )
+    SearchPosting.objects.bulk_create(postings, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField(default=1)),
+                ('comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.Comment')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.Post')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchposting',
+            index=models.Index(fields=['term', 'post'], name='search_term_post_idx'),
+        ),
+        migrations.RunPython(fill_index, migrations.RunPython.noop),
+    ]
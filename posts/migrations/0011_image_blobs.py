@@ -0,0 +1,31 @@
+# Generated by Django 2.2.9 on 2026-10-18 17:29
+
+from django.db import migrations, models
+import posts.media
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_text_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Файл')),
+                ('refcount', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+            ],
+            options={
+                'verbose_name': 'Файл изображения',
+                'verbose_name_plural': 'Файлы изображений',
+            },
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.media.ContentAddressedStorage(), upload_to='posts/'),
+        ),
+    ]
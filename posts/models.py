@@ -1,9 +1,33 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.template.defaultfilters import linebreaksbr
+from django.utils.html import escape
+
+from .media import post_images
+from .querysets import CommentQuerySet, PostQuerySet
 
 User = get_user_model()
 
 
+def render_post_text(text):
+    """
+    HTML текста записи: экранированный текст с <br> вместо переносов.
+    """
+    return linebreaksbr(text, autoescape=True)
+
+
+def render_comment_text(text):
+    return escape(text)
+
+
+def _with_text_html(kwargs):
+    # Сохранение только текста должно обновить и его HTML.
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'text' in update_fields:
+        kwargs['update_fields'] = {*update_fields, 'text_html'}
+    return kwargs
+
+
 class Group(models.Model):
     title = models.CharField(
         max_length=200,
@@ -18,6 +42,8 @@ class Group(models.Model):
 
 class Post(models.Model):
     text = models.TextField()
+    # Готовый HTML текста, заполняется в save().
+    text_html = models.TextField(editable=False, blank=True)
     pub_date = models.DateTimeField(
         'Дата публикации',
         auto_now_add=True
@@ -32,20 +58,54 @@ class Post(models.Model):
         related_name="group_posts",
         blank=True, null=True
     )
+    # Имя файла — хеш содержимого, см. posts.media.
     image = models.ImageField(
         upload_to='posts/',
+        storage=post_images,
         blank=True,
         null=True
     )
 
+    objects = PostQuerySet.as_manager()
+
     class Meta:
         ordering = ["-pub_date"]
+        indexes = [
+            models.Index(fields=["author", "-pub_date"],
+                         name="post_author_pub_date_idx"),
+            models.Index(fields=["group", "-pub_date"],
+                         name="post_group_pub_date_idx"),
+            models.Index(fields=["-pub_date", "id"],
+                         name="post_pub_date_id_idx"),
+        ]
         verbose_name = "Запись"
         verbose_name_plural = "Записи"
 
     def __str__(self):
         return self.text
 
+    def save(self, *args, **kwargs):
+        self.text_html = render_post_text(self.text)
+        super().save(*args, **_with_text_html(kwargs))
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        # Сообщество на момент загрузки: при смене сообщества нужно
+        # обновить и ленту прежнего.
+        instance._loaded_group_id = loaded.get('group_id')
+        # Файл на момент загрузки: при замене изображения с прежнего
+        # снимается ссылка.
+        if 'image' in loaded:
+            instance._loaded_image = loaded['image'] or ''
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._loaded_group_id = self.group_id
+        self._loaded_image = self.image.name or ''
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -58,19 +118,161 @@ class Comment(models.Model):
         on_delete=models.CASCADE
     )
     text = models.TextField()
+    text_html = models.TextField(editable=False, blank=True)
     created = models.DateTimeField(
         'Дата публикации',
         auto_now_add=True
     )
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ["-created"]
+        indexes = [
+            models.Index(fields=["post", "-created"],
+                         name="comment_post_created_idx"),
+        ]
         verbose_name = "Комментарий"
         verbose_name_plural = "Комментарии"
 
     def __str__(self):
         return self.text
 
+    def save(self, *args, **kwargs):
+        self.text_html = render_comment_text(self.text)
+        super().save(*args, **_with_text_html(kwargs))
+
+
+class AuthorStats(models.Model):
+    author = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name="stats",
+        on_delete=models.CASCADE
+    )
+    post_count = models.PositiveIntegerField("Записей", default=0)
+    follower_count = models.PositiveIntegerField("Подписчиков", default=0)
+    following_count = models.PositiveIntegerField("Подписок", default=0)
+
+    class Meta:
+        verbose_name = "Статистика автора"
+        verbose_name_plural = "Статистика авторов"
+
+
+class GroupStats(models.Model):
+    group = models.OneToOneField(
+        Group,
+        primary_key=True,
+        related_name="stats",
+        on_delete=models.CASCADE
+    )
+    post_count = models.PositiveIntegerField("Записей", default=0)
+
+    class Meta:
+        verbose_name = "Статистика сообщества"
+        verbose_name_plural = "Статистика сообществ"
+
+
+class PostStats(models.Model):
+    post = models.OneToOneField(
+        Post,
+        primary_key=True,
+        related_name="stats",
+        on_delete=models.CASCADE
+    )
+    comment_count = models.PositiveIntegerField("Комментариев", default=0)
+
+    class Meta:
+        verbose_name = "Статистика записи"
+        verbose_name_plural = "Статистика записей"
+
+
+class ImageBlob(models.Model):
+    name = models.CharField("Файл", max_length=100, unique=True)
+    refcount = models.PositiveIntegerField("Ссылок", default=0)
+
+    class Meta:
+        verbose_name = "Файл изображения"
+        verbose_name_plural = "Файлы изображений"
+
+    def __str__(self):
+        return self.name
+
+
+class Follow(models.Model):
+    user = models.ForeignKey(
+        User,
+        related_name="follower",
+        on_delete=models.CASCADE
+    )
+    author = models.ForeignKey(
+        User,
+        related_name="following",
+        on_delete=models.CASCADE
+    )
+
+    class Meta:
+        unique_together = ("user", "author")
+        verbose_name = "Подписка"
+        verbose_name_plural = "Подписки"
+
+
+class TimelineEntry(models.Model):
+    """
+    Запись в материализованной ленте подписок пользователя.
+    """
+    user = models.ForeignKey(
+        User,
+        related_name="+",
+        on_delete=models.CASCADE
+    )
+    post = models.ForeignKey(
+        Post,
+        related_name="+",
+        on_delete=models.CASCADE
+    )
+    author = models.ForeignKey(
+        User,
+        related_name="+",
+        on_delete=models.CASCADE
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("user", "post")
+        indexes = [
+            models.Index(fields=["user", "-pub_date", "post"],
+                         name="timeline_user_pub_date_idx"),
+            models.Index(fields=["user", "author"],
+                         name="timeline_user_author_idx"),
+        ]
+
+
+class SearchPosting(models.Model):
+    """
+    Запись инвертированного индекса: основа слова и ее вес в тексте записи
+    или комментария к ней.
+    """
+    term = models.CharField(max_length=64)
+    post = models.ForeignKey(
+        Post,
+        related_name="+",
+        on_delete=models.CASCADE
+    )
+    comment = models.ForeignKey(
+        Comment,
+        related_name="+",
+        on_delete=models.CASCADE,
+        blank=True, null=True
+    )
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["term", "post"],
+                         name="search_term_post_idx"),
+        ]
+
 
 """
 class Comment(models.Model):
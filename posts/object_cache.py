@@ -0,0 +1,209 @@
+"""
+Кеш объектов для частых поисков по уникальному полю: сообщество по
+slug и пользователь по username.
+
+Два уровня: LRU в памяти процесса (ограничен размером и временем жизни)
+перед общим кешем Django. Сохранение и удаление объекта сбрасывают оба
+уровня в этом процессе; в других процессах локальная копия живет не
+дольше OBJECT_CACHE_LOCAL_TTL. Отсутствующие объекты тоже кешируются,
+чтобы запросы несуществующих адресов не доходили до базы.
+"""
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+
+from .models import Group
+
+MISSING = '<missing>'
+# Сколько ждать, пока объект загружает другой процесс, и как часто
+# проверять общий кеш.
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 0.5
+LOCK_POLL = 0.01
+LOCK_STRIPES = 64
+
+
+class LocalLRU:
+    """
+    Потокобезопасный LRU с временем жизни записей.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0 or self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class ObjectCache:
+    """
+    Читающий кеш объектов model по уникальному полю field.
+
+    local_size=0 отключает уровень в памяти процесса: тогда изменения
+    видны всем процессам сразу после сброса.
+    """
+
+    def __init__(self, queryset, field, name=None, local_size=None,
+                 local_ttl=None):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.field = field
+        self.name = name or self.model._meta.label_lower
+        self.local = LocalLRU(
+            settings.OBJECT_CACHE_LOCAL_SIZE if local_size is None
+            else local_size,
+            settings.OBJECT_CACHE_LOCAL_TTL if local_ttl is None
+            else local_ttl,
+        )
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+
+    def _key(self, value):
+        return f'posts:object:{self.name}:{self.field}:{value}'
+
+    def _record(self, outcome):
+        with self.stats_lock:
+            self.stats[outcome] += 1
+
+    def get(self, value):
+        """
+        Объект с field == value или None. Каждый вызов возвращает новый
+        экземпляр, его можно менять.
+        """
+        key = self._key(value)
+        data = self.local.get(key)
+        if data is not None:
+            self._record('local')
+            return self._restore(data)
+        # Одновременные промахи по одному ключу в процессе ждут друг друга.
+        with self.locks[hash(key) % LOCK_STRIPES]:
+            data = self.local.get(key)
+            if data is None:
+                data = self._from_shared(key, value)
+                self.local.set(key, data)
+            else:
+                self._record('local')
+        return self._restore(data)
+
+    def get_or_404(self, value):
+        instance = self.get(value)
+        if instance is None:
+            raise Http404(f'{self.model._meta.object_name} not found')
+        return instance
+
+    def _dump(self, instance):
+        return pickle.dumps(instance, pickle.HIGHEST_PROTOCOL)
+
+    def _restore(self, data):
+        return None if data == MISSING else pickle.loads(data)
+
+    def _from_shared(self, key, value):
+        data = cache.get(key)
+        if data is not None:
+            self._record('shared')
+            return data
+        self._record('miss')
+        # Между процессами: загружает тот, кто взял блокировку, остальные
+        # недолго ждут его результата в общем кеше.
+        lock_key = key + ':lock'
+        if cache.add(lock_key, 1, LOCK_TIMEOUT):
+            try:
+                return self._load(key, value)
+            finally:
+                cache.delete(lock_key)
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL)
+            data = cache.get(key)
+            if data is not None:
+                return data
+        return self._load(key, value)
+
+    def _load(self, key, value):
+        # Только из основной базы: с отстающей реплики после сброса в кеш
+        # снова попала бы старая строка.
+        instance = self.queryset.using('default').filter(
+            **{self.field: value}
+        ).first()
+        if instance is None:
+            data = MISSING
+            timeout = settings.OBJECT_CACHE_MISSING_TIMEOUT
+        else:
+            data = self._dump(instance)
+            timeout = settings.OBJECT_CACHE_TIMEOUT
+        cache.set(key, data, timeout)
+        return data
+
+    def invalidate(self, *values):
+        """
+        Сбрасывает объекты после фиксации транзакции: до нее промах
+        загрузил бы в кеш старую строку.
+        """
+        keys = [self._key(value) for value in values if value is not None]
+        transaction.on_commit(lambda: self._delete(keys))
+
+    def _delete(self, keys):
+        for key in keys:
+            self.local.delete(key)
+        cache.delete_many(keys)
+
+    def hit_ratio(self):
+        with self.stats_lock:
+            total = sum(self.stats.values())
+            hits = self.stats['local'] + self.stats['shared']
+        return hits / total if total else None
+
+
+groups = ObjectCache(Group.objects.all(), 'slug')
+# Хеш пароля в кеш не попадает.
+users = ObjectCache(get_user_model().objects.defer('password'), 'username')
+CACHES = (groups, users)
+
+
+def object_cache_stats():
+    """
+    Попадания по уровням и промахи для каждой модели в этом процессе.
+    """
+    result = {}
+    for object_cache in CACHES:
+        with object_cache.stats_lock:
+            result[object_cache.name] = dict(object_cache.stats)
+        result[object_cache.name]['hit_ratio'] = object_cache.hit_ratio()
+    return result
@@ -0,0 +1,187 @@
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+# Страницы с номером не больше этого значения отдаются по ?page=N,
+# более глубокие — только по курсору.
+PAGE_NUMBER_LIMIT = 5
+# Выше этого числа строки отфильтрованного списка не досчитываются.
+COUNT_LIMIT = 10000
+
+
+def encode_cursor(values, number, direction='next'):
+    """
+    Упаковывает значения ключа сортировки в непрозрачный токен.
+    """
+    payload = json.dumps(
+        {'v': values, 'n': number, 'd': direction},
+        separators=(',', ':'),
+        default=str
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Разбирает токен курсора. Для испорченного токена возвращает None.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values, number = payload['v'], int(payload['n'])
+        direction = payload.get('d', 'next')
+    except (ValueError, TypeError, KeyError):
+        return None
+    if not isinstance(values, list) or direction not in ('next', 'prev'):
+        return None
+    return values, max(number, 1), direction
+
+
+class KeysetPaginator:
+    """
+    Курсорный (keyset) паджинатор по уникальному ключу сортировки,
+    например ('-pub_date', 'id').
+
+    Не выполняет COUNT(*) и не сканирует OFFSET для глубоких страниц.
+    Для совместимости с шаблонами возвращает обычные Paginator и Page:
+    вместо точного числа записей у Paginator выставляется нижняя
+    граница, которой достаточно для has_next()/has_previous().
+    """
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', 'id'),
+                 page_number_limit=PAGE_NUMBER_LIMIT):
+        self.object_list = object_list.order_by(*ordering)
+        self.per_page = per_page
+        self.ordering = ordering
+        self.page_number_limit = page_number_limit
+        self.fields = [field.lstrip('-') for field in ordering]
+
+    def paginate(self, request):
+        """
+        Возвращает пару (paginator, page) для параметров ?cursor= и ?page=.
+        """
+        cursor = request.GET.get('cursor')
+        decoded = decode_cursor(cursor) if cursor else None
+        if decoded is not None:
+            values, number, direction = decoded
+            return self.get_cursor_page(values, number, direction)
+        return self.get_numbered_page(request.GET.get('page'))
+
+    def get_numbered_page(self, number):
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+        # OFFSET не глубже page_number_limit страниц: дальше лента
+        # листается только по курсору.
+        number = min(number, max(self.page_number_limit, 1))
+        rows = self._numbered_rows(number)
+        if not rows and number > 1:
+            # Номер за концом ленты: показываем последнюю страницу.
+            total = len(self.object_list.values_list('pk', flat=True)[
+                :(number - 1) * self.per_page
+            ])
+            number = max((total - 1) // self.per_page + 1, 1)
+            rows = self._numbered_rows(number)
+        has_next = len(rows) > self.per_page
+        return self._build_page(rows[:self.per_page], number, has_next)
+
+    def _numbered_rows(self, number):
+        offset = (number - 1) * self.per_page
+        return list(self.object_list[offset:offset + self.per_page + 1])
+
+    def get_cursor_page(self, values, number, direction):
+        try:
+            condition = self._cursor_condition(values, direction)
+        except (ValidationError, ValueError, TypeError):
+            return self.get_numbered_page(1)
+        if direction == 'prev':
+            queryset = self.object_list.filter(condition).reverse()
+            rows = list(queryset[:self.per_page])
+            rows.reverse()
+            has_next = True
+        else:
+            rows = list(
+                self.object_list.filter(condition)[:self.per_page + 1]
+            )
+            has_next = len(rows) > self.per_page
+        if direction == 'prev' and len(rows) < self.per_page:
+            # Дошли до начала ленты: это первая страница.
+            return self.get_numbered_page(1)
+        return self._build_page(rows[:self.per_page], number, has_next)
+
+    def _cursor_condition(self, values, direction):
+        values = [
+            self._to_python(field, value)
+            for field, value in zip(self.fields, values)
+        ]
+        if len(values) != len(self.fields):
+            raise ValueError('cursor does not match ordering')
+        condition = Q()
+        for position, field in enumerate(self.fields):
+            descending = self.ordering[position].startswith('-')
+            if direction == 'prev':
+                descending = not descending
+            lookup = 'lt' if descending else 'gt'
+            step = Q(**{f'{field}__{lookup}': values[position]})
+            for previous, value in zip(self.fields[:position], values):
+                step &= Q(**{previous: value})
+            condition |= step
+        return condition
+
+    def _to_python(self, field, value):
+        try:
+            model_field = self.object_list.model._meta.get_field(field)
+        except FieldDoesNotExist:
+            # Аннотация или столбец values(): значение берется как есть.
+            return value
+        return model_field.to_python(value)
+
+    def _key(self, obj):
+        if isinstance(obj, dict):
+            return [obj[field] for field in self.fields]
+        return [getattr(obj, field) for field in self.fields]
+
+    def _build_page(self, rows, number, has_next):
+        paginator = Paginator(self.object_list, self.per_page)
+        # Нижняя граница вместо COUNT(*): текущая страница плюс одна
+        # запись, если следующая страница существует.
+        paginator.count = (number - 1) * self.per_page + len(rows) + has_next
+        page = Page(rows, number, paginator)
+        page.next_cursor = None
+        page.previous_cursor = None
+        if has_next and rows:
+            if number + 1 > self.page_number_limit:
+                page.next_cursor = encode_cursor(
+                    self._key(rows[-1]), number + 1
+                )
+        if number > 1 and rows and number - 1 > self.page_number_limit:
+            page.previous_cursor = encode_cursor(
+                self._key(rows[0]), number - 1, 'prev'
+            )
+        page.page_links = range(
+            1, min(number + has_next, self.page_number_limit) + 1
+        )
+        return paginator, page
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator с приблизительным числом строк для больших таблиц.
+
+    Без фильтров вместо COUNT(*) берется наибольший id. Отфильтрованный
+    список считается точно, но не дальше COUNT_LIMIT строк.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            return queryset.order_by('-pk').values_list(
+                'pk', flat=True
+            ).first() or 0
+        return queryset.order_by().values('pk')[:COUNT_LIMIT].count()
@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """
+        Записи для ленты: автор и сообщество подгружаются одним запросом.
+        """
+        return self.select_related('author', 'group')
+
+
+class CommentQuerySet(models.QuerySet):
+    def for_thread(self):
+        """
+        Комментарии к записи вместе с их авторами.
+        """
+        return self.select_related('author')
@@ -0,0 +1,290 @@
+import math
+import re
+from functools import lru_cache
+from itertools import chain
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, When
+
+from .models import Comment, Post, SearchPosting
+
+# Вес вхождения в тексте записи и в комментарии к ней.
+POST_WEIGHT = 3
+COMMENT_WEIGHT = 1
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+# Сколько самых новых записей с самым редким словом запроса ранжируется.
+MAX_CANDIDATES = 1000
+DOCUMENT_FREQUENCY_TIMEOUT = 10 * 60
+# Основы недавних слов: словарь текстов намного меньше их объема.
+STEM_CACHE_SIZE = 100000
+
+WORD_RE = re.compile(r'\w+')
+VOWELS = 'аеиоуыэюя'
+
+# Окончания русского стеммера Snowball (Портера). Окончания первой
+# группы отсекаются, только если перед ними стоит «а» или «я».
+PERFECTIVE_GERUND = (('в', 'вши', 'вшись'),
+                     ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+REFLEXIVE = ((), ('ся', 'сь'))
+ADJECTIVE = ((), ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый',
+                  'ой', 'ем', 'им', 'ым', 'ом', 'его', 'ого', 'ему', 'ому',
+                  'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею'))
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+VERB = (('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но',
+         'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+        ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей',
+         'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят',
+         'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'))
+NOUN = ((), ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи',
+             'ии', 'и', 'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием',
+             'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию',
+             'ью', 'ю', 'ия', 'ья', 'я'))
+SUPERLATIVE = ((), ('ейше', 'ейш'))
+DERIVATIONAL = ((), ('ость', 'ост'))
+
+
+@lru_cache(maxsize=None)
+def _candidates(endings):
+    """
+    Окончания группы от длинных к коротким с признаком «только после а/я».
+    """
+    after_a, plain = endings
+    candidates = [(ending, True) for ending in after_a]
+    candidates += [(ending, False) for ending in plain]
+    candidates.sort(key=lambda item: len(item[0]), reverse=True)
+    return candidates
+
+
+def _strip(word, endings):
+    """
+    Отсекает самое длинное подходящее окончание; None, если его нет.
+    """
+    for ending, needs_a in _candidates(endings):
+        if not word.endswith(ending):
+            continue
+        stem = word[:-len(ending)]
+        if needs_a and not stem.endswith(('а', 'я')):
+            continue
+        return stem
+    return None
+
+
+def _region(word, start=0):
+    """
+    Начало области после первого сочетания «гласная + согласная».
+    """
+    for position in range(start + 1, len(word)):
+        if word[position] not in VOWELS and word[position - 1] in VOWELS:
+            return position + 1
+    return len(word)
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word):
+    """
+    Основа русского слова по алгоритму Snowball; остальные слова
+    возвращаются без изменений.
+    """
+    word = word.lower().replace('ё', 'е')
+    match = re.search(f'[{VOWELS}]', word)
+    if match is None or not re.fullmatch('[а-я]+', word):
+        return word
+    prefix, rv = word[:match.end()], word[match.end():]
+    r2 = _region(word, _region(word)) - len(prefix)
+
+    # Шаг 1.
+    stripped = _strip(rv, PERFECTIVE_GERUND)
+    if stripped is None:
+        reflexive = _strip(rv, REFLEXIVE)
+        if reflexive is not None:
+            rv = reflexive
+        stripped = _strip(rv, ADJECTIVE)
+        if stripped is not None:
+            stripped = _strip(stripped, PARTICIPLE) or stripped
+        else:
+            stripped = _strip(rv, VERB)
+            if stripped is None:
+                stripped = _strip(rv, NOUN)
+    if stripped is not None:
+        rv = stripped
+    # Шаг 2.
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    # Шаг 3.
+    derived = _strip(rv, DERIVATIONAL)
+    if derived is not None and len(derived) >= r2:
+        rv = derived
+    # Шаг 4.
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        superlative = _strip(rv, SUPERLATIVE)
+        if superlative is not None:
+            rv = superlative[:-1] if superlative.endswith('нн') \
+                else superlative
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def terms(text):
+    """
+    Основы слов текста, пригодные для индекса.
+    """
+    for word in WORD_RE.findall(text.lower()):
+        if len(word) > 1 and not word.isdigit():
+            yield stem(word)[:MAX_TERM_LENGTH]
+
+
+def _term_weights(text, weight):
+    frequencies = {}
+    for term in terms(text):
+        frequencies[term] = frequencies.get(term, 0) + 1
+    return [(term, weight * count) for term, count in frequencies.items()]
+
+
+def _postings(text, weight, **source):
+    return [
+        SearchPosting(term=term, weight=term_weight, **source)
+        for term, term_weight in _term_weights(text, weight)
+    ]
+
+
+@transaction.atomic
+def index_post(post):
+    SearchPosting.objects.filter(post=post, comment__isnull=True).delete()
+    SearchPosting.objects.bulk_create(
+        _postings(post.text, POST_WEIGHT, post_id=post.pk)
+    )
+
+
+@transaction.atomic
+def index_comment(comment):
+    SearchPosting.objects.filter(comment=comment).delete()
+    SearchPosting.objects.bulk_create(
+        _postings(comment.text, COMMENT_WEIGHT, post_id=comment.post_id,
+                  comment_id=comment.pk)
+    )
+
+
+@transaction.atomic
+def _insert(rows):
+    """
+    Вставляет строки (term, post_id, comment_id, weight) одним
+    executemany, без объектов модели.
+    """
+    opts = SearchPosting._meta
+    quote = connection.ops.quote_name
+    columns = [opts.get_field(name).column
+               for name in ('term', 'post', 'comment', 'weight')]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO {} ({}) VALUES ({})'.format(
+                quote(opts.db_table), ', '.join(map(quote, columns)),
+                ', '.join(['%s'] * len(columns))
+            ),
+            rows
+        )
+
+
+def index_new(posts=(), comments=(), batch_size=1000):
+    """
+    Добавляет в индекс записи — пары (pk, text) — и комментарии — тройки
+    (pk, text, post_id), у которых строк в индексе еще нет: после
+    bulk_create и при перестроении. Возвращает число объектов.
+    """
+    documents = chain(
+        ((text, POST_WEIGHT, pk, None) for pk, text in posts),
+        ((text, COMMENT_WEIGHT, post_id, pk)
+         for pk, text, post_id in comments),
+    )
+    indexed = 0
+    rows = []
+    for text, weight, post_id, comment_id in documents:
+        rows.extend(
+            (term, post_id, comment_id, term_weight)
+            for term, term_weight in _term_weights(text, weight)
+        )
+        indexed += 1
+        if len(rows) >= batch_size:
+            _insert(rows)
+            rows = []
+    if rows:
+        _insert(rows)
+    return indexed
+
+
+def rebuild(batch_size=1000):
+    """
+    Переиндексирует все записи и комментарии пакетами.
+    Возвращает число проиндексированных объектов.
+    """
+    SearchPosting.objects.all().delete()
+    return index_new(
+        posts=Post.objects.order_by('pk').values_list(
+            'pk', 'text'
+        ).iterator(chunk_size=batch_size),
+        comments=Comment.objects.order_by('pk').values_list(
+            'pk', 'text', 'post_id'
+        ).iterator(chunk_size=batch_size),
+        batch_size=batch_size,
+    )
+
+
+def _document_frequency(term):
+    """
+    Число записей с термином, закешированное на несколько минут.
+    """
+    key = f'posts:search:df:{term}'
+    frequency = cache.get(key)
+    if frequency is None:
+        frequency = SearchPosting.objects.filter(term=term).values(
+            'post_id'
+        ).distinct().count()
+        cache.set(key, frequency, DOCUMENT_FREQUENCY_TIMEOUT)
+    return frequency
+
+
+def _idf(term, total):
+    """
+    Обратная частота термина; total — оценка числа записей.
+    """
+    frequency = _document_frequency(term)
+    return max(1, round(10 * math.log(1 + total / (1 + frequency))))
+
+
+def search(query):
+    """
+    Записи, в которых (или в комментариях к которым) встречаются все слова
+    запроса. Возвращает строки {'post_id', 'score'} без сортировки.
+
+    Ранжируются только MAX_CANDIDATES самых новых записей с самым редким
+    словом запроса: каждая найденная запись его содержит, а время
+    запроса не растет вместе с индексом.
+    """
+    query_terms = list(dict.fromkeys(terms(query)))[:MAX_QUERY_TERMS]
+    if not query_terms:
+        return SearchPosting.objects.none().values('post_id').annotate(
+            score=Sum('weight')
+        )
+    # Наибольший id вместо COUNT(*) — достаточная оценка числа записей.
+    total = Post.objects.order_by('-pk').values_list(
+        'pk', flat=True
+    ).first() or 1
+    weighted = Case(
+        *[When(term=term, then=F('weight') * _idf(term, total))
+          for term in query_terms],
+        output_field=IntegerField()
+    )
+    rarest = min(query_terms, key=_document_frequency)
+    candidates = SearchPosting.objects.filter(term=rarest).order_by(
+        '-post_id'
+    ).values('post_id').distinct()[:MAX_CANDIDATES]
+    return SearchPosting.objects.filter(
+        term__in=query_terms, post_id__in=candidates
+    ).values('post_id').annotate(
+        score=Sum(weighted),
+        matched=Count('term', distinct=True)
+    ).filter(matched=len(query_terms))
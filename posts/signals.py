@@ -0,0 +1,207 @@
+from django.contrib.auth import get_user_model
+from django.contrib.flatpages.models import FlatPage
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from users.models import SessionUser
+
+from . import flatpages
+from .cache import bump_version, feed_names, invalidate_feeds
+from .media import acquire, release
+from .models import (AuthorStats, Comment, Follow, Group, GroupStats, Post,
+                     PostStats)
+from .object_cache import groups, users
+from .search import index_comment, index_post
+from .stats import change_counter
+from .timeline import backfill, fan_out, remove
+
+User = get_user_model()
+
+# Поля пользователя, которые выводятся в карточках записей.
+AUTHOR_CARD_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+def _changes_author_cards(instance, update_fields):
+    if instance.pk is None:
+        return False
+    # Например, обновление last_login при входе не меняет карточки.
+    return update_fields is None or bool(
+        AUTHOR_CARD_FIELDS & set(update_fields)
+    )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_card(sender, instance, **kwargs):
+    bump_version('post', instance.pk)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_feeds(sender, instance, **kwargs):
+    loaded_group_id = getattr(instance, '_loaded_group_id', None)
+    invalidate_feeds(feed_names(instance, [loaded_group_id]))
+
+
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=SessionUser)
+def remember_username(sender, instance, update_fields, **kwargs):
+    if _changes_author_cards(instance, update_fields):
+        instance._old_username = User.objects.filter(
+            pk=instance.pk
+        ).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=SessionUser)
+def invalidate_author_cards(sender, instance, created, update_fields,
+                            **kwargs):
+    if created or not _changes_author_cards(instance, update_fields):
+        return
+    bump_version('author', instance.pk)
+    usernames = {instance.username, getattr(instance, '_old_username', None)}
+    group_ids = Post.objects.filter(author=instance).values_list(
+        'group_id', flat=True
+    ).distinct()
+    invalidate_feeds(['index'])
+    invalidate_feeds(f'author:{name}' for name in usernames if name)
+    invalidate_feeds(
+        f'group:{slug}' for slug in Group.objects.filter(
+            pk__in=group_ids
+        ).values_list('slug', flat=True)
+    )
+
+
+@receiver(pre_save, sender=Group)
+def remember_slug(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._old_slug = Group.objects.filter(
+            pk=instance.pk
+        ).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_feed(sender, instance, **kwargs):
+    slugs = {instance.slug, getattr(instance, '_old_slug', None)}
+    invalidate_feeds(f'group:{slug}' for slug in slugs if slug)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_cached_group(sender, instance, **kwargs):
+    groups.invalidate(instance.slug, getattr(instance, '_old_slug', None))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=SessionUser)
+@receiver(post_delete, sender=SessionUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Новый пользователь мог быть закеширован как отсутствующий.
+    users.invalidate(instance.username,
+                     getattr(instance, '_old_username', None))
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    if created:
+        change_counter(AuthorStats, instance.author_id, 'post_count', 1)
+        change_counter(GroupStats, instance.group_id, 'post_count', 1)
+    else:
+        loaded_group_id = getattr(instance, '_loaded_group_id', None)
+        if loaded_group_id != instance.group_id:
+            change_counter(GroupStats, loaded_group_id, 'post_count', -1)
+            change_counter(GroupStats, instance.group_id, 'post_count', 1)
+    # Обработчики выше уже учли прежнее сообщество; следующее сохранение
+    # того же объекта сравнивается с текущим.
+    instance._loaded_group_id = instance.group_id
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    change_counter(AuthorStats, instance.author_id, 'post_count', -1)
+    change_counter(GroupStats, instance.group_id, 'post_count', -1)
+
+
+@receiver(post_save, sender=Post)
+def count_image_references(sender, instance, created, update_fields,
+                           **kwargs):
+    name = instance.image.name or ''
+    if created:
+        acquire(name)
+    elif hasattr(instance, '_loaded_image') and (
+            update_fields is None or 'image' in update_fields):
+        if name != instance._loaded_image:
+            acquire(name)
+            release(instance._loaded_image)
+    else:
+        return
+    instance._loaded_image = name
+
+
+@receiver(post_delete, sender=Post)
+def release_image(sender, instance, **kwargs):
+    if 'image' not in instance.get_deferred_fields():
+        release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_thread(sender, instance, **kwargs):
+    bump_version('thread', instance.post_id)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    if created:
+        change_counter(PostStats, instance.post_id, 'comment_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    change_counter(PostStats, instance.post_id, 'comment_count', -1)
+
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, **kwargs):
+    index_post(instance)
+
+
+@receiver(post_save, sender=Comment)
+def index_saved_comment(sender, instance, **kwargs):
+    index_comment(instance)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, **kwargs):
+    if created:
+        fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def start_following(sender, instance, created, **kwargs):
+    if not created:
+        return
+    change_counter(AuthorStats, instance.author_id, 'follower_count', 1)
+    change_counter(AuthorStats, instance.user_id, 'following_count', 1)
+    backfill(instance.user_id, instance.author_id)
+    invalidate_feeds([f'author:{instance.author.username}',
+                      f'author:{instance.user.username}'])
+
+
+@receiver(post_delete, sender=Follow)
+def stop_following(sender, instance, **kwargs):
+    change_counter(AuthorStats, instance.author_id, 'follower_count', -1)
+    change_counter(AuthorStats, instance.user_id, 'following_count', -1)
+    remove(instance.user_id, instance.author_id)
+    invalidate_feeds([f'author:{instance.author.username}',
+                      f'author:{instance.user.username}'])
+
+
+@receiver(post_save, sender=FlatPage)
+@receiver(post_delete, sender=FlatPage)
+@receiver(m2m_changed, sender=FlatPage.sites.through)
+def invalidate_flatpages(sender, **kwargs):
+    flatpages.invalidate()
@@ -0,0 +1,123 @@
+from collections import Counter, defaultdict
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import (AuthorStats, Comment, Follow, GroupStats, Post,
+                     PostStats)
+
+# SQLite ограничивает число параметров одного запроса.
+LOOKUP_CHUNK = 900
+
+
+def change_counter(model, pk, field, delta):
+    """
+    Атомарно изменяет счетчик через F(). Строка статистики создается
+    только при увеличении: при каскадном удалении объекта ее не нужно
+    восстанавливать.
+    """
+    if pk is None:
+        return
+    expression = {field: F(field) + delta}
+    rows = model.objects.filter(pk=pk)
+    if delta < 0:
+        # Не уходим ниже нуля, если объект удаляют по устаревшей копии;
+        # такие расхождения исправляет команда recount.
+        rows.filter(**{f'{field}__gte': -delta}).update(**expression)
+        return
+    if rows.update(**expression):
+        return
+    with transaction.atomic():
+        model.objects.get_or_create(pk=pk)
+        model.objects.filter(pk=pk).update(**expression)
+
+
+def count_new(posts=(), comments=()):
+    """
+    Учитывает в счетчиках записи и комментарии, созданные через
+    bulk_create: он не отправляет сигналы.
+    """
+    deltas = defaultdict(Counter)
+    for post in posts:
+        deltas[AuthorStats, 'post_count'][post.author_id] += 1
+        if post.group_id is not None:
+            deltas[GroupStats, 'post_count'][post.group_id] += 1
+    for comment in comments:
+        deltas[PostStats, 'comment_count'][comment.post_id] += 1
+    for (model, field), counts in deltas.items():
+        _add_counts(model, field, counts)
+
+
+@transaction.atomic
+def _add_counts(model, field, counts):
+    """
+    Прибавляет counts[pk] к счетчику field: недостающие строки создаются
+    одним bulk_create, остальные обновляются одним запросом на каждое
+    значение прибавки.
+    """
+    pks = list(counts)
+    existing = set()
+    for start in range(0, len(pks), LOOKUP_CHUNK):
+        existing.update(model.objects.filter(
+            pk__in=pks[start:start + LOOKUP_CHUNK]
+        ).values_list('pk', flat=True))
+    model.objects.bulk_create(
+        [model(pk=pk, **{field: delta}) for pk, delta in counts.items()
+         if pk not in existing],
+        batch_size=500
+    )
+    by_delta = defaultdict(list)
+    for pk in existing:
+        by_delta[counts[pk]].append(pk)
+    for delta, delta_pks in by_delta.items():
+        for start in range(0, len(delta_pks), LOOKUP_CHUNK):
+            model.objects.filter(
+                pk__in=delta_pks[start:start + LOOKUP_CHUNK]
+            ).update(**{field: F(field) + delta})
+
+
+def get_count(instance, field):
+    """
+    Значение счетчика для объекта с подгруженной статистикой
+    (select_related('stats')); если строки еще нет, счетчик равен нулю.
+    """
+    try:
+        return getattr(instance.stats, field)
+    except ObjectDoesNotExist:
+        return 0
+
+
+@transaction.atomic
+def recount():
+    """
+    Пересчитывает все счетчики по фактическим данным.
+    Возвращает число строк статистики каждого вида.
+    """
+    authors = defaultdict(dict)
+    sources = (
+        ('author_id', 'post_count', Post.objects.values('author_id')),
+        ('author_id', 'follower_count', Follow.objects.values('author_id')),
+        ('user_id', 'following_count', Follow.objects.values('user_id')),
+    )
+    for key, field, counts in sources:
+        for row in counts.order_by().annotate(total=Count('id')):
+            authors[row[key]][field] = row['total']
+    group_counts = Post.objects.order_by().filter(
+        group__isnull=False
+    ).values('group_id').annotate(post_count=Count('id'))
+    post_counts = Comment.objects.order_by().values('post_id').annotate(
+        comment_count=Count('id')
+    )
+    author_counts = (
+        {'author_id': pk, **fields} for pk, fields in authors.items()
+    )
+    result = {}
+    for model, counts in ((AuthorStats, author_counts),
+                          (GroupStats, group_counts),
+                          (PostStats, post_counts)):
+        model.objects.all().delete()
+        rows = [model(**row) for row in counts]
+        model.objects.bulk_create(rows, batch_size=500)
+        result[model._meta.model_name] = len(rows)
+    return result
@@ -0,0 +1,10 @@
+from django import template
+
+from posts.cache import post_card_version
+
+register = template.Library()
+
+
+@register.filter
+def card_version(post):
+    return post_card_version(post)
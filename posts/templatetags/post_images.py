@@ -0,0 +1,55 @@
+import logging
+
+from django import template
+from django.conf import settings
+from sorl.thumbnail import default
+
+from posts.images import MIME_TYPES, source_variants
+
+logger = logging.getLogger(__name__)
+
+register = template.Library()
+
+
+def _thumbnail(image, geometry, options):
+    # Как тег {% thumbnail %}: ошибка миниатюры не ломает страницу.
+    try:
+        return default.backend.get_thumbnail(image, geometry, **options)
+    except Exception:
+        logger.exception('Не удалось получить миниатюру %s %s',
+                         image.name, geometry)
+        return None
+
+
+@register.inclusion_tag('includes/post_picture.html')
+def post_picture(post):
+    """
+    <picture> изображения записи. Пока миниатюры не созданы, выводится
+    заглушка; формат попадает в <source>, когда готовы все его ширины.
+    """
+    context = {'image': post.image, 'fallback': None, 'sources': [],
+               'sizes': settings.POST_IMAGE_SIZES}
+    if not post.image:
+        return context
+    geometry = settings.POST_IMAGE_FALLBACK
+    context['fallback'] = _thumbnail(
+        post.image, geometry, settings.POST_THUMBNAILS[geometry]
+    )
+    if context['fallback'] is None:
+        return context
+    for fmt, items in source_variants().items():
+        thumbnails = [_thumbnail(post.image, geometry, options)
+                      for geometry, options in items]
+        if None in thumbnails:
+            continue
+        # Маленький оригинал не увеличивается, и ширины могут совпасть.
+        urls = {}
+        for thumbnail in thumbnails:
+            urls.setdefault(thumbnail.width, thumbnail.url)
+        context['sources'].append({
+            'type': MIME_TYPES[fmt],
+            'srcset': ', '.join(
+                f'{url} {width}w' for width, url in sorted(urls.items())
+            ),
+        })
+    return context
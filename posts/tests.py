@@ -1,10 +1,121 @@
-from django.test import TestCase, Client
-from posts.models import Post, User, Group
-from django.urls import reverse
+import hashlib
+import io
 import os
+import pickle
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from io import StringIO
+from tempfile import NamedTemporaryFile, TemporaryDirectory, mkdtemp
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import Count, F
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image, ImageFile
+
+from posts import thumbnails
+from posts.cache import cache_is_shared, page_cache_stats
+from posts.flatpages import pages
+from posts.images import available_formats
+from posts.media import collect, is_content_addressed, post_images
+from posts.models import (AuthorStats, Comment, Follow, Group, ImageBlob,
+                          Post, SearchPosting, TimelineEntry, User)
+from posts.object_cache import CACHES, LocalLRU, ObjectCache, groups, users
+from posts.stats import get_count
+from posts.transfer import Importer
+from posts.views import COMMENTS_PER_PAGE
+from users.backends import session_users
+from users.models import SessionUser
+from yatube.metrics import expose
+from yatube.replicas import ReplicaMiddleware, ReplicaRouter
+from yatube.sqlite.writes import WriteQueue, write
+
+
+class CommitCallbacksMixin:
+    """
+    TestCase не фиксирует транзакцию, и колбэки on_commit в нем не
+    выполняются. Здесь они выполняются сразу, как при автокоммите.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.on_commit = mock.patch.object(
+            transaction, 'on_commit', lambda func, using=None: func()
+        )
+        cls.on_commit.start()
+        super().setUpClass()
 
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.on_commit.stop()
 
-class PageTest(TestCase):
+
+class TemporaryMediaMixin:
+    """
+    Загруженные в тесте файлы и миниатюры пишутся во временный
+    MEDIA_ROOT, который удаляется после тестов класса.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+class SharedCacheMixin:
+    """
+    Кеш в файлах временного каталога, общий для процессов, вместо
+    LocMemCache тестовых настроек, и сессии в нем.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dir = mkdtemp()
+        cls.cache_settings = override_settings(
+            CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': cls.cache_dir,
+            }},
+            SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+        )
+        cls.cache_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.cache_settings.disable()
+        shutil.rmtree(cls.cache_dir, ignore_errors=True)
+
+
+@override_settings(POST_THUMBNAILS_ASYNC=False)
+class PageTest(CommitCallbacksMixin, TemporaryMediaMixin, TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='skywalker')
         self.auth_client = Client()
@@ -230,4 +341,1806 @@ class PageTest(TestCase):
                           True,
                           "Не найден файл картинки для теста!")
         types = ['jpg', 'jpeg', 'gif', 'png']
-        self.assertEqual(self.wrong_image_path.split('.')[-1] not in types, True)
\ No newline at end of file
+        self.assertEqual(self.wrong_image_path.split('.')[-1] not in types, True)
+
+
+class KeysetPaginatorTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='paginated')
+        self.client = Client()
+        Post.objects.bulk_create(
+            Post(text=f'post {num}', author=self.user) for num in range(75)
+        )
+        self.expected = list(
+            Post.objects.order_by('-pub_date', 'id')
+            .values_list('id', flat=True)
+        )
+
+    def walk(self, url):
+        seen = []
+        pages = []
+        params = {}
+        while True:
+            response = self.client.get(url, params)
+            page = response.context['page']
+            pages.append(page)
+            seen.extend(post.id for post in page)
+            if not page.has_next():
+                return seen, pages
+            if page.next_cursor:
+                params = {'cursor': page.next_cursor}
+            else:
+                params = {'page': page.next_page_number()}
+
+    def test_walk_all_pages(self):
+        """
+        Тест проходит ленту по ссылкам «Следующая» и проверяет, что каждая
+        запись показана ровно один раз и в правильном порядке
+        """
+        for url in (reverse('index'),
+                    reverse('profile', kwargs={'username': 'paginated'})):
+            seen, pages = self.walk(url)
+            self.assertEqual(seen, self.expected)
+            self.assertEqual([page.number for page in pages],
+                             list(range(1, 9)))
+            self.assertIsNone(pages[3].next_cursor)
+            self.assertIsNotNone(pages[6].next_cursor)
+
+    def test_previous_cursor(self):
+        """
+        Тест проверяет переход на предыдущую страницу по курсору
+        """
+        seen, pages = self.walk(reverse('index'))
+        response = self.client.get(
+            reverse('index'), {'cursor': pages[7].previous_cursor}
+        )
+        page = response.context['page']
+        self.assertEqual(page.number, 7)
+        self.assertEqual([post.id for post in page], self.expected[60:70])
+
+    def test_no_count_query(self):
+        """
+        Тест проверяет, что лента не выполняет COUNT(*)
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'), {'page': 3})
+        for query in queries.captured_queries:
+            self.assertNotIn('COUNT(', query['sql'].upper())
+
+    def test_broken_cursor(self):
+        """
+        Тест проверяет, что испорченный курсор ведет на первую страницу
+        """
+        response = self.client.get(reverse('index'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([post.id for post in response.context['page']],
+                         self.expected[:10])
+
+    def test_deep_page_number(self):
+        """
+        Тест проверяет, что номер глубже PAGE_NUMBER_LIMIT не сканирует
+        OFFSET, а ведет на последнюю страницу с номером и курсором дальше
+        """
+        response = self.client.get(reverse('index'), {'page': 7})
+        page = response.context['page']
+        self.assertEqual(page.number, 5)
+        self.assertEqual([post.id for post in page], self.expected[40:50])
+        self.assertIsNotNone(page.next_cursor)
+
+    def test_page_past_end(self):
+        """
+        Тест проверяет, что номер за концом ленты ведет на последнюю
+        страницу, а не на пустую
+        """
+        Post.objects.filter(id__in=self.expected[25:]).delete()
+        cache.clear()
+        response = self.client.get(reverse('index'), {'page': 5})
+        page = response.context['page']
+        self.assertEqual(page.number, 3)
+        self.assertEqual([post.id for post in page], self.expected[20:25])
+        self.assertFalse(page.has_next())
+
+
+class FeedQueryCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.group = Group.objects.create(
+            title='queries', slug='queries', description='queries'
+        )
+        self.authors = [
+            User.objects.create_user(username=f'author{num}',
+                                     first_name='Имя',
+                                     last_name=f'Фамилия {num}')
+            for num in range(10)
+        ]
+        for author in self.authors:
+            Post.objects.create(text='feed', author=author, group=self.group)
+        self.post = Post.objects.create(
+            text='thread', author=self.authors[0], group=self.group
+        )
+        for author in self.authors:
+            Comment.objects.create(post=self.post, author=author, text='hi')
+
+    def assert_queries(self, url, num):
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_feed_query_count(self):
+        """
+        Тест проверяет, что число запросов на странице не зависит от
+        количества записей и комментариев
+        """
+        # Сообщество и автор уже в кеше объектов.
+        groups.get(self.group.slug)
+        users.get('author0')
+        self.assert_queries(reverse('index'), 1)
+        self.assert_queries(
+            reverse('group', kwargs={'slug': self.group.slug}), 1
+        )
+        self.assert_queries(
+            reverse('profile', kwargs={'username': 'author0'}), 2
+        )
+        self.assert_queries(
+            reverse('post', kwargs={'username': 'author0',
+                                    'post_id': self.post.id}), 2
+        )
+
+
+class ExplainFeedsCommandTest(TestCase):
+    def test_feed_queries_use_indexes(self):
+        """
+        Тест проверяет, что запросы лент используют индексы
+        """
+        out = StringIO()
+        call_command('explain_feeds', '--check', stdout=out)
+        self.assertIn('post_author_pub_date_idx', out.getvalue())
+        self.assertIn('comment_post_created_idx', out.getvalue())
+        # Порядок строк берется из индекса, без отдельной сортировки.
+        self.assertNotIn('TEMP B-TREE', out.getvalue())
+
+
+class PostCardCacheTest(CommitCallbacksMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cached',
+                                             first_name='Старое',
+                                             last_name='Имя')
+        self.post = Post.objects.create(text='cached text', author=self.user)
+        self.client = Client()
+
+    def test_card_rendered_from_cache(self):
+        """
+        Тест проверяет, что повторный показ карточки берется из кеша, а
+        изменение записи сбрасывает закешированный фрагмент
+        """
+        self.client.get(reverse('index'))
+        Post.objects.filter(pk=self.post.pk).update(text='stale')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'cached text')
+        self.post.text = 'fresh text'
+        self.post.save()
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'fresh text')
+
+    def test_author_rename_invalidates_cards(self):
+        """
+        Тест проверяет, что смена имени автора обновляет его карточки
+        """
+        url = reverse('index')
+        self.assertContains(self.client.get(url), 'Старое Имя')
+        self.user.first_name = 'Новое'
+        self.user.save()
+        self.assertContains(self.client.get(url), 'Новое Имя')
+
+    def test_edit_button_not_cached(self):
+        """
+        Тест проверяет, что кнопка редактирования зависит от пользователя,
+        а не от закешированного фрагмента
+        """
+        url = reverse('profile', kwargs={'username': 'cached'})
+        self.assertNotContains(self.client.get(url), 'Редактировать')
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(url), 'Редактировать')
+
+
+class FeedPageCacheTest(CommitCallbacksMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='writer')
+        self.group = Group.objects.create(
+            title='old', slug='old', description='old group'
+        )
+        self.other_group = Group.objects.create(
+            title='new', slug='new', description='new group'
+        )
+        self.post = Post.objects.create(
+            text='first', author=self.user, group=self.group
+        )
+        self.anonymous = Client()
+        self.auth_client = Client()
+        self.auth_client.force_login(self.user)
+        self.urls = [
+            reverse('index'),
+            reverse('group', kwargs={'slug': 'old'}),
+            reverse('profile', kwargs={'username': 'writer'}),
+        ]
+
+    def test_anonymous_pages_are_cached(self):
+        """
+        Тест проверяет, что повторный анонимный запрос ленты не обращается
+        к базе данных, а номер страницы входит в ключ кеша
+        """
+        for url in self.urls:
+            self.anonymous.get(url)
+            before = page_cache_stats()
+            with self.assertNumQueries(0):
+                response = self.anonymous.get(url)
+            self.assertContains(response, 'first')
+            self.assertEqual(page_cache_stats()['hit'], before['hit'] + 1)
+        before = page_cache_stats()
+        self.anonymous.get(self.urls[0], {'page': 2})
+        self.assertEqual(page_cache_stats()['miss'], before['miss'] + 1)
+
+    def test_new_post_purges_feeds(self):
+        """
+        Тест проверяет, что новая запись сразу видна в закешированных лентах
+        """
+        for url in self.urls:
+            self.anonymous.get(url)
+        self.auth_client.post(
+            reverse('new_post'), data={'group': self.group.id, 'text': 'second'}
+        )
+        for url in self.urls:
+            self.assertContains(self.anonymous.get(url), 'second')
+
+    def test_edit_purges_previous_group(self):
+        """
+        Тест проверяет, что при переносе записи в другое сообщество
+        обновляются ленты обоих сообществ
+        """
+        old_url = reverse('group', kwargs={'slug': 'old'})
+        new_url = reverse('group', kwargs={'slug': 'new'})
+        self.anonymous.get(old_url)
+        self.anonymous.get(new_url)
+        self.auth_client.post(
+            reverse('post_edit', kwargs={'username': 'writer',
+                                         'post_id': self.post.id}),
+            data={'group': self.other_group.id, 'text': 'moved'}
+        )
+        self.assertNotContains(self.anonymous.get(old_url), 'moved')
+        self.assertContains(self.anonymous.get(new_url), 'moved')
+
+    def test_authenticated_pages_not_cached(self):
+        """
+        Тест проверяет, что страницы авторизованных пользователей
+        не попадают в общий кеш
+        """
+        response = self.auth_client.get(self.urls[2])
+        self.assertContains(response, 'Редактировать')
+        self.assertNotContains(self.anonymous.get(self.urls[2]),
+                               'Редактировать')
+
+
+class StatsCountersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='counted')
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.group = Group.objects.create(
+            title='first', slug='first', description='first'
+        )
+        self.other_group = Group.objects.create(
+            title='second', slug='second', description='second'
+        )
+
+    def counts(self):
+        user = User.objects.select_related('stats').get(pk=self.user.pk)
+        return (
+            get_count(user, 'post_count'),
+            get_count(Group.objects.get(pk=self.group.pk), 'post_count'),
+            get_count(Group.objects.get(pk=self.other_group.pk),
+                      'post_count'),
+        )
+
+    def test_counters_follow_changes(self):
+        """
+        Тест проверяет, что счетчики записей и комментариев обновляются при
+        создании, переносе и удалении
+        """
+        self.client.post(reverse('new_post'),
+                         data={'group': self.group.id, 'text': 'one'})
+        self.client.post(reverse('new_post'), data={'text': 'two'})
+        self.assertEqual(self.counts(), (2, 1, 0))
+        post = Post.objects.get(text='one')
+        self.client.post(
+            reverse('post_edit', kwargs={'username': 'counted',
+                                         'post_id': post.id}),
+            data={'group': self.other_group.id, 'text': 'one'}
+        )
+        self.assertEqual(self.counts(), (2, 0, 1))
+        self.client.post(
+            reverse('add_comment', kwargs={'username': 'counted',
+                                           'post_id': post.id}),
+            data={'text': 'comment'}
+        )
+        self.assertEqual(post.stats.comment_count, 1)
+        post.refresh_from_db()
+        post.delete()
+        self.assertEqual(self.counts(), (1, 0, 0))
+
+    def test_recount_repairs_drift(self):
+        """
+        Тест проверяет, что команда recount исправляет расхождения
+        """
+        Post.objects.create(text='one', author=self.user, group=self.group)
+        AuthorStats.objects.filter(pk=self.user.pk).update(post_count=42)
+        call_command('recount', stdout=StringIO())
+        self.assertEqual(self.counts(), (1, 1, 0))
+
+    def test_profile_without_aggregates(self):
+        """
+        Тест проверяет, что профиль показывает число записей без COUNT(*)
+        """
+        Post.objects.create(text='one', author=self.user)
+        url = reverse('profile', kwargs={'username': 'counted'})
+        self.client.logout()
+        response = self.client.get(url)
+        self.assertEqual(response.context['post_sum'], 1)
+
+
+class DeferredThumbnailTest(CommitCallbacksMixin, TemporaryMediaMixin,
+                            TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='photographer')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def upload(self, image=None):
+        with open('./posts/test_data/monkey.png', 'rb') as img:
+            self.client.post(reverse('new_post'), data={
+                'text': 'with image', 'image': image or img
+            })
+        return Post.objects.get(text='with image')
+
+    def random_image(self):
+        # Файлы называются по содержимому: у уже загружавшейся картинки
+        # миниатюра могла остаться от другого теста.
+        content = io.BytesIO()
+        Image.frombytes('RGB', (8, 8), os.urandom(192)).save(content, 'PNG')
+        return SimpleUploadedFile('random.png', content.getvalue(),
+                                  content_type='image/png')
+
+    def test_placeholder_until_thumbnail_ready(self):
+        """
+        Тест проверяет, что до создания миниатюры лента показывает заглушку,
+        а после фоновой задачи — изображение
+        """
+        with override_settings(POST_THUMBNAILS_ASYNC=True), \
+                mock.patch.object(thumbnails, '_submit') as submit:
+            post = self.upload(self.random_image())
+            submit.assert_called_once_with(post.image.name)
+            response = self.client.get(reverse('index'))
+            self.assertNotContains(response, '<img')
+            self.assertContains(response, 'bg-light')
+            thumbnails.generate_thumbnails(post.image.name)
+            response = self.client.get(reverse('index'))
+            self.assertContains(response, '<img')
+
+    @override_settings(POST_THUMBNAILS_ASYNC=False)
+    def test_new_post_accepts_image(self):
+        """
+        Тест проверяет, что форма новой записи сохраняет изображение
+        """
+        post = self.upload()
+        self.assertTrue(post.image.name.startswith('posts/'))
+        self.assertContains(self.client.get(reverse('index')), '<img')
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='searcher')
+        self.client = Client()
+        self.monkeys = Post.objects.create(
+            text='Обезьяны любят бананы', author=self.user
+        )
+        self.cats = Post.objects.create(
+            text='Котики спят весь день', author=self.user
+        )
+        Comment.objects.create(post=self.cats, author=self.user,
+                               text='А еще котики едят бананы')
+
+    def found(self, query, **params):
+        response = self.client.get(reverse('search'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [post.id for post in response.context['page']]
+
+    def test_stemmed_search(self):
+        """
+        Тест проверяет поиск по основам слов без учета регистра
+        """
+        self.assertEqual(self.found('КОТИКОВ'), [self.cats.id])
+        self.assertEqual(self.found('банан'),
+                         [self.monkeys.id, self.cats.id])
+        self.assertEqual(self.found('котик банан'), [self.cats.id])
+        self.assertEqual(self.found('жираф'), [])
+        self.assertEqual(self.found(''), [])
+
+    def test_index_follows_edits(self):
+        """
+        Тест проверяет, что индекс обновляется при изменении записи
+        """
+        self.monkeys.text = 'Жирафы любят листья'
+        self.monkeys.save()
+        self.assertEqual(self.found('обезьяна'), [])
+        self.assertEqual(self.found('жирафов'), [self.monkeys.id])
+
+    def test_keyset_pages(self):
+        """
+        Тест проверяет постраничный вывод результатов по курсору
+        """
+        for num in range(25):
+            Post.objects.create(text=f'зебра {"зебра " * num}',
+                                author=self.user)
+        ids = []
+        params = {}
+        while True:
+            response = self.client.get(reverse('search'),
+                                       {'q': 'зебры', **params})
+            page = response.context['page']
+            ids.extend(post.id for post in page)
+            if not page.has_next():
+                break
+            params = {'page': page.next_page_number()}
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+        texts = Post.objects.in_bulk(ids)
+        lengths = [len(texts[pk].text) for pk in ids]
+        self.assertEqual(lengths, sorted(lengths, reverse=True))
+
+    def test_candidates_limit(self):
+        """
+        Тест проверяет, что ранжируются только самые новые записи с самым
+        редким словом запроса
+        """
+        newer = [
+            Post.objects.create(text=f'Котики {num} любят бананы',
+                                author=self.user)
+            for num in range(2)
+        ]
+        with mock.patch('posts.search.MAX_CANDIDATES', 2):
+            found = self.found('котик банан')
+        self.assertEqual(sorted(found), [post.id for post in newer])
+        self.assertEqual(len(self.found('котик банан')), 3)
+
+    def test_rebuild_command(self):
+        """
+        Тест проверяет команду перестроения индекса
+        """
+        SearchPosting.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.found('бананы'),
+                         [self.monkeys.id, self.cats.id])
+
+
+class TransferCommandsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='exporter')
+        self.group = Group.objects.create(
+            title='Группа', slug='export', description='Описание'
+        )
+        self.post = Post.objects.create(
+            text='Запись, с "кавычками"\nи переносом', author=self.user,
+            group=self.group
+        )
+        Post.objects.create(text='Без группы', author=self.user)
+        Comment.objects.create(post=self.post, author=self.user,
+                               text='Комментарий')
+
+    def snapshot(self):
+        return (
+            list(Group.objects.order_by('pk').values()),
+            list(Post.objects.order_by('pk').values()),
+            list(Comment.objects.order_by('pk').values()),
+        )
+
+    def round_trip(self, file_format):
+        before = self.snapshot()
+        with NamedTemporaryFile('w+', suffix=f'.{file_format}') as dump:
+            call_command('export_posts', format=file_format,
+                         output=dump.name)
+            Group.objects.all().delete()
+            User.objects.all().delete()
+            call_command('import_posts', dump.name, format=file_format,
+                         batch_size=2, stderr=StringIO())
+            self.assertEqual(self.snapshot()[1:], (
+                [dict(row, author_id=User.objects.get().pk)
+                 for row in before[1]],
+                [dict(row, author_id=User.objects.get().pk)
+                 for row in before[2]],
+            ))
+            self.assertEqual(self.snapshot()[0], before[0])
+            err = StringIO()
+            call_command('import_posts', dump.name, format=file_format,
+                         stderr=err)
+            self.assertIn('пропущено: 4', err.getvalue())
+
+    def test_jsonl_round_trip(self):
+        """
+        Тест проверяет выгрузку и загрузку в формате JSON Lines
+        """
+        self.round_trip('jsonl')
+
+    def test_csv_round_trip(self):
+        """
+        Тест проверяет выгрузку и загрузку в формате CSV
+        """
+        self.round_trip('csv')
+
+    def test_import_from_stdin(self):
+        """
+        Тест проверяет загрузку из stdin: поток остается открытым, а
+        auto_now_add снова включен
+        """
+        dump = StringIO()
+        call_command('export_posts', stdout=dump)
+        Group.objects.all().delete()
+        stdin = StringIO(dump.getvalue())
+        with mock.patch('sys.stdin', stdin):
+            call_command('import_posts', '-', stderr=StringIO())
+        self.assertFalse(stdin.closed)
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+
+    def test_import_counts_and_indexes_rows(self):
+        """
+        Тест проверяет, что загруженные строки учтены в счетчиках и
+        поисковом индексе без полного пересчета
+        """
+        self.round_trip('jsonl')
+        author = User.objects.select_related('stats').get()
+        self.assertEqual(get_count(author, 'post_count'), 2)
+        post = Post.objects.select_related('stats').get(pk=self.post.pk)
+        self.assertEqual(get_count(post, 'comment_count'), 1)
+        for query in ('кавычки', 'комментарии'):
+            response = self.client.get(reverse('search'), {'q': query})
+            self.assertEqual(
+                [found.pk for found in response.context['page']], [post.pk]
+            )
+
+
+class FollowFeedTest(SharedCacheMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='favourite')
+        self.stranger = User.objects.create_user(username='stranger')
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def feed(self):
+        response = self.client.get(reverse('follow_index'))
+        return [post.text for post in response.context['page']]
+
+    def follow(self, author):
+        self.client.get(reverse('profile_follow',
+                                kwargs={'username': author.username}))
+
+    def test_follow_and_unfollow(self):
+        """
+        Тест проверяет подписку, отписку и счетчики подписчиков
+        """
+        Post.objects.create(text='before follow', author=self.author)
+        self.follow(self.author)
+        self.follow(self.reader)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(self.feed(), ['before follow'])
+        author = User.objects.select_related('stats').get(pk=self.author.pk)
+        self.assertEqual(get_count(author, 'follower_count'), 1)
+        self.client.get(reverse('profile_unfollow',
+                                kwargs={'username': 'favourite'}))
+        self.assertEqual(self.feed(), [])
+        author = User.objects.select_related('stats').get(pk=self.author.pk)
+        self.assertEqual(get_count(author, 'follower_count'), 0)
+
+    def test_new_posts_fan_out(self):
+        """
+        Тест проверяет, что новая запись попадает только в ленты подписчиков
+        """
+        self.follow(self.author)
+        author_client = Client()
+        author_client.force_login(self.author)
+        author_client.post(reverse('new_post'), data={'text': 'fresh'})
+        Post.objects.create(text='unrelated', author=self.stranger)
+        self.assertEqual(self.feed(), ['fresh'])
+
+    def test_feed_is_one_range_scan(self):
+        """
+        Тест проверяет, что чтение ленты не зависит от числа подписок
+        """
+        for num in range(5):
+            author = User.objects.create_user(username=f'writer{num}')
+            Post.objects.create(text=f'post {num}', author=author)
+            self.follow(author)
+        self.client.get(reverse('follow_index'))
+        # Сессия и пользователь берутся из кеша. Авторы с моделью чтения,
+        # лента, записи.
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('follow_index'))
+        self.assertEqual(len(response.context['page']), 5)
+
+    @override_settings(POSTS_FANOUT_LIMIT=0)
+    def test_pull_for_popular_authors(self):
+        """
+        Тест проверяет, что записи популярных авторов не рассылаются, а
+        подтягиваются при открытии ленты
+        """
+        self.follow(self.author)
+        Post.objects.create(text='popular', author=self.author)
+        self.assertFalse(TimelineEntry.objects.filter(
+            post__text='popular').exists())
+        self.assertEqual(self.feed(), ['popular'])
+
+    @override_settings(POSTS_BACKFILL_BATCH_SIZE=2)
+    def test_backfill_whole_history(self):
+        """
+        Тест проверяет, что подписка и подтягивание копируют все записи
+        автора, а не только последний пакет
+        """
+        for num in range(5):
+            Post.objects.create(text=f'old {num}', author=self.author)
+        self.follow(self.author)
+        self.assertEqual(TimelineEntry.objects.filter(
+            user=self.reader).count(), 5)
+        with override_settings(POSTS_FANOUT_LIMIT=0):
+            for num in range(5):
+                Post.objects.create(text=f'new {num}', author=self.author)
+            self.assertEqual(len(self.feed()), 10)
+
+    def test_imported_posts_reach_followers(self):
+        """
+        Тест проверяет, что записи, загруженные через bulk_create,
+        попадают в ленты подписчиков
+        """
+        self.follow(self.author)
+        Importer().run([{
+            'type': 'post', 'id': '100', 'author': 'favourite',
+            'group': '', 'text': 'imported', 'image': '',
+            'pub_date': '2019-01-01T00:00:00+00:00',
+        }])
+        self.assertEqual(self.feed(), ['imported'])
+
+
+class GenerateDatasetTest(TestCase):
+    def test_generate_dataset(self):
+        """
+        Тест проверяет, что команда создает заданный объем данных с
+        перекосом по авторам и картинками-заглушками
+        """
+        with TemporaryDirectory() as media, \
+                self.settings(MEDIA_ROOT=media):
+            call_command('generate_dataset', users=20, groups=4, posts=300,
+                         comments=500, images=2, batch_size=64,
+                         stderr=StringIO())
+            self.assertEqual(User.objects.count(), 20)
+            self.assertEqual(Group.objects.count(), 4)
+            self.assertEqual(Post.objects.count(), 300)
+            self.assertEqual(Comment.objects.count(), 500)
+            with_image = Post.objects.exclude(image='').exclude(
+                image__isnull=True)
+            self.assertTrue(with_image.exists())
+            self.assertTrue(os.path.exists(
+                os.path.join(media, with_image.first().image.name)))
+        top = Post.objects.values('author').annotate(
+            posts=Count('id')).order_by('-posts')[0]['posts']
+        self.assertGreater(top, 300 / 20 * 2)
+        self.assertEqual(
+            User.objects.get(username='user0').stats.post_count, top
+        )
+        self.assertFalse(Comment.objects.filter(
+            created__lt=F('post__pub_date')).exists())
+        self.assertEqual(
+            SearchPosting.objects.values('post_id', 'comment_id').distinct(
+            ).count(), 800)
+
+
+@override_settings(METRICS_TOKEN='scrape-secret')
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='measured')
+        Post.objects.create(text='measured post', author=self.user)
+
+    def scrape(self, token='scrape-secret'):
+        return self.client.get(reverse('metrics'),
+                               HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def sample(self, body, name, **labels):
+        prefix = name + '{' + ','.join(
+            f'{key}="{value}"' for key, value in labels.items())
+        for line in body.splitlines():
+            if line.startswith(prefix):
+                return float(line.rsplit(' ', 1)[1])
+        return 0
+
+    def test_metrics_by_view(self):
+        """
+        Тест проверяет, что время, SQL и обращения к кешу учитываются
+        по имени представления
+        """
+        before = self.scrape().content.decode()
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        response = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        for name, labels, delta in (
+                ('yatube_request_duration_seconds_count', {'view': 'index'},
+                 2),
+                ('yatube_db_queries_bucket', {'view': 'index', 'le': '1'}, 2),
+                ('yatube_page_cache_total', {'outcome': 'hit',
+                                             'view': 'index'}, 1),
+                ('yatube_page_cache_total', {'outcome': 'miss',
+                                             'view': 'index'}, 1)):
+            self.assertEqual(
+                self.sample(body, name, **labels)
+                - self.sample(before, name, **labels), delta, name
+            )
+        self.assertGreater(self.sample(
+            body, 'yatube_template_duration_seconds_sum', view='index'), 0)
+
+    def test_metrics_restricted(self):
+        """
+        Тест проверяет, что метрики закрыты для посторонних, в том числе
+        для запросов с локального адреса прокси
+        """
+        response = self.client.get(reverse('metrics'),
+                                   REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.scrape('wrong').status_code, 403)
+        with self.settings(METRICS_TOKEN=None):
+            self.assertEqual(self.scrape('None').status_code, 403)
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code,
+                         200)
+
+    def test_slow_requests_logged(self):
+        """
+        Тест проверяет, что медленный запрос пишется в журнал с SQL
+        """
+        with self.settings(METRICS_SLOW_REQUEST_MS=0), \
+                self.assertLogs('yatube.metrics', 'WARNING') as logs:
+            self.client.get(reverse('profile', args=['measured']))
+        self.assertIn('posts_post', logs.output[0])
+        self.assertIn('profile', logs.output[0])
+
+
+class ConditionalGetTest(CommitCallbacksMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='poller')
+        self.group = Group.objects.create(title='Группа', slug='polled')
+        self.post = Post.objects.create(text='polled post', author=self.user,
+                                        group=self.group)
+        self.urls = [
+            reverse('index'),
+            reverse('group', args=['polled']),
+            reverse('profile', args=['poller']),
+            reverse('post', args=['poller', self.post.id]),
+        ]
+
+    def revalidate(self, url, client=None):
+        client = client or self.client
+        etag = client.get(url)['ETag']
+        return client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_not_modified_without_rendering(self):
+        """
+        Тест проверяет, что неизменившиеся страницы отдаются как 304
+        без основного запроса и шаблонов
+        """
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0), \
+                        self.assertTemplateNotUsed('base.html'):
+                    response = self.client.get(url,
+                                               HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_changes_produce_new_etag(self):
+        """
+        Тест проверяет, что правка, комментарий и новая запись меняют ETag
+        """
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        self.post.text = 'edited'
+        self.post.save()
+        for url, etag in zip(self.urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+        post_url = self.urls[-1]
+        etag = self.client.get(post_url)['ETag']
+        Comment.objects.create(post=self.post, author=self.user, text='new')
+        response = self.client.get(post_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = self.client.get(self.urls[0])['ETag']
+        Post.objects.create(text='fresh', author=self.user)
+        response = self.client.get(self.urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        """
+        Тест проверяет, что ETag гостя не подходит вошедшему пользователю
+        """
+        url = self.urls[2]
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.revalidate(url).status_code, 304)
+
+
+class CommentThreadTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='talker')
+        self.post = Post.objects.create(text='talk', author=self.author)
+        for num in range(45):
+            Comment.objects.create(post=self.post, author=self.author,
+                                   text=f'comment {num}')
+
+    def test_comments_in_chunks(self):
+        """
+        Тест проверяет, что на странице записи только первая порция
+        комментариев, а остальные отдаются фрагментами по курсору
+        """
+        response = self.client.get(
+            reverse('post', args=['talker', self.post.id]))
+        page = response.context['items']
+        self.assertEqual(len(page), COMMENTS_PER_PAGE)
+        self.assertEqual(page[0].text, 'comment 44')
+        seen = [item.text for item in page]
+        cursor = page.next_cursor
+        url = reverse('post_comments', args=['talker', self.post.id])
+        while cursor:
+            with self.assertNumQueries(2):
+                response = self.client.get(url, {'cursor': cursor})
+            self.assertTemplateNotUsed(response, 'base.html')
+            seen.extend(item.text for item in response.context['items'])
+            cursor = response.context['items'].next_cursor
+        self.assertEqual(
+            seen, [f'comment {num}' for num in range(44, -1, -1)])
+        self.assertContains(
+            self.client.get(url), 'data-fragment="{}?cursor='.format(url))
+
+    def test_unknown_post_fragment(self):
+        """
+        Тест проверяет, что фрагмент чужой или несуществующей записи — 404
+        """
+        url = reverse('post_comments', args=['nobody', self.post.id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_invalid_comment_keeps_page(self):
+        """
+        Тест проверяет, что ошибка в форме комментария показывается на
+        странице записи с первой порцией комментариев
+        """
+        self.client.force_login(self.author)
+        response = self.client.post(
+            reverse('add_comment', args=['talker', self.post.id]),
+            {'text': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+        self.assertEqual(len(response.context['items']), 20)
+
+
+class ApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='apiauthor')
+        self.group = Group.objects.create(title='API', slug='api-group')
+        self.posts = [
+            Post.objects.create(text=f'api post {num}', author=self.author,
+                                group=self.group if num % 2 else None)
+            for num in range(5)
+        ]
+        for num in range(3):
+            Comment.objects.create(post=self.posts[0], author=self.author,
+                                   text=f'api comment {num}')
+
+    def collect(self, url, **params):
+        results = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            results.extend(data['results'])
+            if not data['next']:
+                return results
+            response = self.client.get(data['next'])
+
+    def test_feeds_with_cursor(self):
+        """
+        Тест проверяет ленты API с курсором и выборкой полей
+        """
+        results = self.collect(reverse('api_posts'), limit=2,
+                               fields='id,author')
+        self.assertEqual(results, [
+            {'id': post.id, 'author': 'apiauthor'}
+            for post in reversed(self.posts)
+        ])
+        group = self.collect(reverse('api_group_posts', args=['api-group']))
+        self.assertEqual([row['text'] for row in group],
+                         ['api post 3', 'api post 1'])
+        self.assertEqual(group[0]['group'], 'api-group')
+        user = self.collect(reverse('api_user_posts', args=['apiauthor']))
+        self.assertEqual(len(user), 5)
+        comments = self.collect(
+            reverse('api_post_comments', args=[self.posts[0].id]), limit=1)
+        self.assertEqual([row['text'] for row in comments],
+                         [f'api comment {num}' for num in (2, 1, 0)])
+
+    def test_sparse_fields_select_only_columns(self):
+        """
+        Тест проверяет, что ?fields= сужает SQL-запрос
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('api_posts'), {'fields': 'id'})
+        sql = queries.captured_queries[-1]['sql']
+        self.assertNotIn('"text"', sql)
+        self.assertNotIn('auth_user', sql)
+
+    def test_errors_and_etag(self):
+        """
+        Тест проверяет ответы 400, 404 и 304
+        """
+        response = self.client.get(reverse('api_posts'), {'fields': 'oops'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('oops', response.json()['error'])
+        response = self.client.get(
+            reverse('api_group_posts', args=['missing']))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        etag = self.client.get(reverse('api_posts'))['ETag']
+        response = self.client.get(reverse('api_posts'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class TextHtmlTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='writer')
+
+    def test_html_rendered_on_save(self):
+        """
+        Тест проверяет, что HTML текста готовится при сохранении и
+        выводится в шаблонах
+        """
+        post = Post.objects.create(text='<b>bold</b>\nline', author=self.user)
+        self.assertEqual(post.text_html, '&lt;b&gt;bold&lt;/b&gt;<br>line')
+        comment = Comment.objects.create(post=post, author=self.user,
+                                         text='<i>x</i>')
+        self.assertEqual(comment.text_html, '&lt;i&gt;x&lt;/i&gt;')
+        post.text = 'plain'
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertEqual(post.text_html, 'plain')
+        response = self.client.get(
+            reverse('post', args=['writer', post.id]))
+        self.assertContains(response, '&lt;i&gt;x&lt;/i&gt;')
+        self.assertNotContains(response, '<i>x</i>')
+
+    def test_backfill_command(self):
+        """
+        Тест проверяет, что команда заполняет HTML у старых строк
+        """
+        post = Post.objects.create(text='a\nb', author=self.user)
+        Comment.objects.create(post=post, author=self.user, text='c & d')
+        Post.objects.update(text_html='')
+        Comment.objects.update(text_html='')
+        call_command('backfill_text_html', batch_size=1, stdout=StringIO())
+        self.assertEqual(Post.objects.get().text_html, 'a<br>b')
+        self.assertEqual(Comment.objects.get().text_html, 'c &amp; d')
+
+    def test_backfill_all_bumps_versions(self):
+        """
+        Тест проверяет, что перерисовка с --all сбрасывает кеш карточек,
+        лент и обсуждений только для изменившихся строк
+        """
+        post = Post.objects.create(text='a\nb', author=self.user)
+        Comment.objects.create(post=post, author=self.user, text='c & d')
+        Post.objects.create(text='unchanged', author=self.user)
+        Post.objects.filter(pk=post.pk).update(text_html='stale')
+        Comment.objects.update(text_html='stale')
+        with mock.patch(
+                'posts.management.commands.backfill_text_html.bump_version'
+        ) as bump:
+            out = StringIO()
+            call_command('backfill_text_html', everything=True, stdout=out)
+        bumped = {call.args for call in bump.call_args_list}
+        self.assertIn(('post', post.pk), bumped)
+        self.assertIn(('thread', post.pk), bumped)
+        self.assertEqual(len([kind for kind, _ in bumped if kind == 'post']),
+                         1)
+        self.assertIn(': 1\n', out.getvalue())
+
+
+class SqliteConcurrencyTest(TestCase):
+    def test_processes_without_lock_errors(self):
+        """
+        Тест проверяет, что несколько процессов пишут в одну базу WAL
+        без ошибок "database is locked"
+        """
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stress.sqlite3')
+            result = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.sqlite_stress',
+                 '--processes', '3', '--threads', '2', '--ops', '20',
+                 '--database', path],
+                cwd=settings.BASE_DIR, capture_output=True, text=True,
+                timeout=120,
+            )
+            db = sqlite3.connect(path)
+            try:
+                mode, = db.execute('PRAGMA journal_mode').fetchone()
+            finally:
+                db.close()
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertIn('database is locked 0', result.stdout)
+        self.assertEqual(mode, 'wal')
+
+    def test_pragmas_applied(self):
+        """
+        Тест проверяет, что настройки SQLite применяются к соединению
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+
+    def test_write_queue_batch(self):
+        """
+        Тест проверяет, что ошибка одного задания в пакете не откатывает
+        остальные
+        """
+        user = User.objects.create_user(username='queued')
+
+        def broken():
+            Post.objects.create(text='lost', author=user)
+            raise ValueError('broken')
+
+        good, bad = Future(), Future()
+        WriteQueue().run_batch([
+            (bad, broken, (), {}),
+            (good, Post.objects.create, (), {'text': 'kept', 'author': user}),
+        ])
+        self.assertEqual(good.result().text, 'kept')
+        self.assertRaises(ValueError, bad.result)
+        self.assertEqual(
+            list(Post.objects.values_list('text', flat=True)), ['kept'])
+
+    def test_write_inside_transaction(self):
+        """
+        Тест проверяет, что внутри транзакции write() выполняется сразу
+        """
+        options = dict(connection.settings_dict['OPTIONS'], write_queue=True)
+        user = User.objects.create_user(username='direct')
+        with mock.patch.dict(connection.settings_dict, OPTIONS=options):
+            post = write(Post.objects.create, text='now', author=user)
+        self.assertTrue(Post.objects.filter(pk=post.pk).exists())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader')
+        self.post = Post.objects.create(text='replicated', author=self.user)
+
+    def read_aliases(self, method, url, **extra):
+        """
+        Базы, которые выбрал роутер для чтения во время запроса. Запросы
+        все равно выполняются в default: в тестах реплика — зеркало.
+        """
+        original = ReplicaRouter.db_for_read
+        aliases = set()
+
+        def spy(router, model, **hints):
+            aliases.add(original(router, model, **hints))
+            return 'default'
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', spy):
+            response = getattr(self.client, method)(url, **extra)
+        return aliases, response
+
+    def test_read_views_use_replica(self):
+        """
+        Тест проверяет, что страницы для чтения читают с реплики, а
+        остальные — из основной базы
+        """
+        aliases, _ = self.read_aliases(
+            'get', reverse('post', args=['reader', self.post.id]))
+        self.assertEqual(aliases, {'replica'})
+        self.client.force_login(self.user)
+        aliases, _ = self.read_aliases('get', reverse('follow_index'))
+        self.assertEqual(aliases, {'default'})
+
+    def test_flatpage_uses_replica(self):
+        """
+        Тест проверяет, что простые страницы читают с реплики
+        """
+        page = FlatPage.objects.create(url='/about-us/', title='О нас',
+                                       content='<p>Страница</p>')
+        page.sites.add(Site.objects.get_current())
+        pages.clear()
+        aliases, response = self.read_aliases('get', reverse('about'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(aliases, {'replica'})
+
+    def test_sticky_after_write(self):
+        """
+        Тест проверяет, что после записи клиент какое-то время читает из
+        основной базы
+        """
+        self.client.force_login(self.user)
+        _, response = self.read_aliases(
+            'post', reverse('add_comment', args=['reader', self.post.id]),
+            data={'text': 'fresh'})
+        self.assertIn('primary_until', response.cookies)
+        aliases, _ = self.read_aliases(
+            'get', reverse('post', args=['reader', self.post.id]))
+        self.assertEqual(aliases, {'default'})
+        self.client.cookies['primary_until'] = '0'
+        aliases, _ = self.read_aliases(
+            'get', reverse('post', args=['reader', self.post.id]))
+        self.assertIn('replica', aliases)
+
+    def test_queued_write_is_sticky(self):
+        """
+        Тест проверяет, что запись через очередь SQLite тоже включает
+        чтение из основной базы, хотя выполняет ее другой поток
+        """
+        done = Future()
+        done.set_result(None)
+
+        def view(request):
+            write(lambda: None)
+            return HttpResponse()
+
+        # TestCase держит транзакцию открытой: без подмены write()
+        # выполнил бы задание сразу, минуя очередь.
+        with mock.patch.dict(connection.settings_dict['OPTIONS'],
+                             write_queue=True), \
+                mock.patch.object(connection, 'in_atomic_block', False), \
+                mock.patch.object(WriteQueue, 'submit', return_value=done):
+            response = ReplicaMiddleware(view)(RequestFactory().get('/'))
+        self.assertIn('primary_until', response.cookies)
+
+    def test_recent_change_reads_primary(self):
+        """
+        Тест проверяет, что страницу с недавно измененными данными все
+        читают из основной базы, пока реплики могут отставать
+        """
+        url = reverse('index')
+        aliases, _ = self.read_aliases('get', url)
+        self.assertEqual(aliases, {'replica'})
+        with mock.patch.object(transaction, 'on_commit',
+                               lambda func, using=None: func()):
+            self.post.text = 'edited'
+            self.post.save()
+        aliases, response = self.read_aliases('get', url)
+        self.assertEqual(aliases, {'default'})
+        self.assertContains(response, 'edited')
+        with override_settings(DATABASE_REPLICA_STICKY_SECONDS=0):
+            cache.clear()
+            aliases, _ = self.read_aliases('get', url)
+        self.assertEqual(aliases, {'replica'})
+
+    def test_sync_replica(self):
+        """
+        Тест проверяет, что sync_replica копирует основную базу в реплику
+        """
+        with TemporaryDirectory() as directory:
+            primary = os.path.join(directory, 'primary.sqlite3')
+            replica = os.path.join(directory, 'replica.sqlite3')
+            with sqlite3.connect(primary) as db:
+                db.execute('CREATE TABLE t (value TEXT)')
+                db.execute("INSERT INTO t VALUES ('copied')")
+            with mock.patch.dict(connections['default'].settings_dict,
+                                 NAME=primary), \
+                    mock.patch.dict(connections['replica'].settings_dict,
+                                    NAME=replica):
+                call_command('sync_replica', stdout=StringIO())
+            with sqlite3.connect(replica) as db:
+                self.assertEqual(
+                    db.execute('SELECT value FROM t').fetchall(),
+                    [('copied',)])
+
+
+class AdminChangelistTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(
+            'boss', 'boss@example.com', 'pass')
+        self.client.force_login(self.admin)
+        self.group = Group.objects.create(title='Админ', slug='admin-group')
+        for num in range(30):
+            author = User.objects.create_user(username=f'admin_author{num}')
+            post = Post.objects.create(text=f'запись номер {num}',
+                                       author=author, group=self.group)
+            Comment.objects.create(post=post, author=author, text='ok')
+
+    def test_changelists(self):
+        """
+        Тест проверяет, что списки админки открываются без запроса на
+        строку и без COUNT(*) по всей таблице
+        """
+        for name in ('post', 'group', 'comment'):
+            url = reverse(f'admin:posts_{name}_changelist')
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLess(len(queries), 12, name)
+            self.assertFalse(
+                [query for query in queries.captured_queries
+                 if query['sql'].startswith('SELECT COUNT(*)')
+                 and 'WHERE' not in query['sql']], name)
+
+    def test_indexed_search(self):
+        """
+        Тест проверяет поиск записей по индексу и по имени автора
+        """
+        url = reverse('admin:posts_post_changelist')
+        response = self.client.get(url, {'q': 'номер'})
+        self.assertEqual(response.context['cl'].result_count, 30)
+        response = self.client.get(url, {'q': 'admin_author7'})
+        self.assertEqual(
+            [post.text for post in response.context['cl'].result_list],
+            ['запись номер 7'])
+
+    def test_clear_group_action(self):
+        """
+        Тест проверяет, что действие убирает записи из сообщества одним
+        запросом и поправляет счетчик
+        """
+        pks = list(Post.objects.values_list('pk', flat=True)[:10])
+        self.client.post(reverse('admin:posts_post_changelist'), {
+            'action': 'clear_group',
+            '_selected_action': pks,
+        })
+        self.assertEqual(Post.objects.filter(group=self.group).count(), 20)
+        self.group.stats.refresh_from_db()
+        self.assertEqual(self.group.stats.post_count, 20)
+
+
+class ObjectCacheTest(CommitCallbacksMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        for object_cache in CACHES:
+            object_cache.local.clear()
+        self.client = Client()
+        self.group = Group.objects.create(
+            title='cached', slug='cached', description='cached'
+        )
+        self.user = User.objects.create_user(username='cached',
+                                             password='secret')
+
+    def test_tiers(self):
+        """
+        Тест проверяет, что объект берется из базы один раз, затем из
+        памяти процесса, а после ее сброса из общего кеша
+        """
+        before = groups.stats.copy()
+        with self.assertNumQueries(1):
+            self.assertEqual(groups.get('cached'), self.group)
+        with self.assertNumQueries(0):
+            group = groups.get('cached')
+            group.title = 'changed'
+            self.assertEqual(groups.get('cached').title, 'cached')
+            groups.local.clear()
+            self.assertEqual(groups.get('cached'), self.group)
+        self.assertEqual(groups.stats - before,
+                         {'miss': 1, 'local': 2, 'shared': 1})
+
+    def test_missing(self):
+        """
+        Тест проверяет, что отсутствие объекта тоже кешируется и
+        сбрасывается при создании объекта
+        """
+        with self.assertNumQueries(1):
+            self.assertIsNone(users.get('newcomer'))
+            self.assertIsNone(users.get('newcomer'))
+        response = self.client.get(reverse('profile', args=['newcomer']))
+        self.assertEqual(response.status_code, 404)
+        User.objects.create_user(username='newcomer')
+        response = self.client.get(reverse('profile', args=['newcomer']))
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalidation(self):
+        """
+        Тест проверяет, что переименование и удаление сбрасывают кеш
+        """
+        groups.get('cached')
+        users.get('cached')
+        self.group.slug = 'renamed'
+        self.group.save()
+        self.assertIsNone(groups.get('cached'))
+        self.assertEqual(groups.get('renamed'), self.group)
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertIsNone(users.get('cached'))
+        self.user.delete()
+        self.assertIsNone(users.get('renamed'))
+
+    def test_password_not_cached(self):
+        """
+        Тест проверяет, что хеш пароля не попадает в кеш
+        """
+        users.get('cached')
+        self.assertNotIn(b'secret', cache.get(users._key('cached')))
+        self.assertNotIn('password', users.get('cached').__dict__)
+
+    def test_local_tier_bounds(self):
+        """
+        Тест проверяет вытеснение старых записей и время жизни
+        """
+        lru = LocalLRU(size=2, ttl=10)
+        with mock.patch('posts.object_cache.time.monotonic',
+                        return_value=100):
+            lru.set('a', 1)
+            lru.set('b', 2)
+            lru.get('a')
+            lru.set('c', 3)
+            self.assertEqual((lru.get('a'), lru.get('b')), (1, None))
+        with mock.patch('posts.object_cache.time.monotonic',
+                        return_value=111):
+            self.assertIsNone(lru.get('c'))
+
+    def test_stampede(self):
+        """
+        Тест проверяет, что одновременные промахи по одному ключу
+        загружают объект из базы один раз
+        """
+        groups = ObjectCache(Group.objects.all(), 'slug')
+        loads = []
+
+        def load(key, value):
+            loads.append(value)
+            time.sleep(0.05)
+            return pickle.dumps(self.group)
+
+        groups._load = load
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                groups.get('cached')))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(loads, ['cached'])
+        self.assertEqual(results, [self.group] * 8)
+
+    def test_hit_ratio_in_metrics(self):
+        """
+        Тест проверяет, что доля попаданий по моделям есть в метриках
+        """
+        self.client.get(reverse('group', args=['cached']))
+        self.client.get(reverse('group', args=['cached']), {'page': 2})
+        output = expose()
+        self.assertIn(
+            'yatube_object_cache_total{model="posts.group",outcome="miss"}',
+            output)
+        self.assertIn('yatube_object_cache_hit_ratio{model="posts.group"}',
+                      output)
+
+
+class SessionUserCacheTest(CommitCallbacksMixin, SharedCacheMixin,
+                           TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='member',
+                                             password='old-secret')
+        self.client = Client()
+        self.client.login(username='member', password='old-secret')
+        self.url = reverse('new_post')
+
+    def test_no_queries_for_session_and_user(self):
+        """
+        Тест проверяет, что сессия и пользователь берутся из кеша, а
+        неизмененная сессия не пишется в базу
+        """
+        self.client.get(self.url)
+        # Остается только список сообществ в форме.
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['user'], self.user)
+
+    def test_password_change(self):
+        """
+        Тест проверяет, что после смены пароля старая сессия не работает
+        """
+        self.client.get(self.url)
+        self.user.set_password('new-secret')
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_user_edit(self):
+        """
+        Тест проверяет, что изменения пользователя видны сразу
+        """
+        self.client.get(self.url)
+        User.objects.filter(pk=self.user.pk).update(first_name='stale')
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['user'].first_name, '')
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_logout(self):
+        """
+        Тест проверяет, что выход сбрасывает пользователя в кеше
+        """
+        self.client.get(self.url)
+        self.assertIsNotNone(cache.get(session_users._key(self.user.pk)))
+        self.client.get(reverse('logout'))
+        self.assertIsNone(cache.get(session_users._key(self.user.pk)))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_password_hash_not_cached(self):
+        """
+        Тест проверяет, что в кеше хеш сессии, а не хеш пароля
+        """
+        self.client.get(self.url)
+        data = cache.get(session_users._key(self.user.pk))
+        self.assertNotIn(self.user.password.encode(), data)
+        self.assertIn(self.user.get_session_auth_hash().encode(), data)
+
+    def test_saving_request_user_resets_cache(self):
+        """
+        Тест проверяет, что сохранение пользователя из кеша (прокси
+        SessionUser) сбрасывает его запись и карточки автора
+        """
+        self.client.get(self.url)
+        user = session_users.get(self.user.pk)
+        self.assertIsInstance(user, SessionUser)
+        self.assertEqual(user, self.user)
+        user.first_name = 'Новое'
+        user.save()
+        self.assertIsNone(cache.get(session_users._key(self.user.pk)))
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['user'].first_name, 'Новое')
+
+    def test_password_change_keeps_session(self):
+        """
+        Тест проверяет, что после смены пароля через форму сессия
+        остается рабочей
+        """
+        self.client.get(self.url)
+        response = self.client.post(reverse('password_change'), {
+            'old_password': 'old-secret',
+            'new_password1': 'new-Secret-42',
+            'new_password2': 'new-Secret-42',
+        })
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['user'], self.user)
+
+
+class SessionUserFallbackTest(CommitCallbacksMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='member',
+                                             password='old-secret')
+        self.client = Client()
+        self.client.login(username='member', password='old-secret')
+        self.url = reverse('new_post')
+
+    def test_process_local_cache(self):
+        """
+        Тест проверяет, что с кешем в памяти процесса сессия и
+        пользователь читаются из базы
+        """
+        self.assertFalse(cache_is_shared())
+        self.client.get(self.url)
+        self.assertIsNone(cache.get(session_users._key(self.user.pk)))
+        # Сессия, пользователь и список сообществ в форме.
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['user'], self.user)
+        self.client.get(reverse('logout'))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+
+class FlatPageCacheTest(CommitCallbacksMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        pages.clear()
+        self.client = Client()
+        self.site = Site.objects.get_current()
+        self.page = FlatPage.objects.create(
+            url='/about-us/', title='О нас', content='<p>Первая версия</p>'
+        )
+        self.page.sites.add(self.site)
+        self.url = reverse('about')
+
+    def test_served_from_memory(self):
+        """
+        Тест проверяет, что повторный показ страницы не обращается к
+        базе и отдается с заголовками кеширования
+        """
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, '<p>Первая версия</p>')
+        self.assertIn(f'max-age={settings.FLATPAGES_MAX_AGE}',
+                      response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+        response = self.client.get(self.url,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_edit_refreshes_page(self):
+        """
+        Тест проверяет, что правка страницы сразу видна и меняет ETag
+        """
+        etag = self.client.get(self.url)['ETag']
+        self.page.content = '<p>Вторая версия</p>'
+        self.page.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, '<p>Вторая версия</p>')
+        self.assertNotEqual(response['ETag'], etag)
+        self.page.sites.remove(self.site)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_reload_without_shared_cache(self):
+        """
+        Тест проверяет, что без общего кеша страницы перечитываются не
+        реже раза в FLATPAGES_MAX_AGE
+        """
+        self.client.get(self.url)
+        FlatPage.objects.filter(pk=self.page.pk).update(
+            content='<p>Из другого процесса</p>'
+        )
+        self.assertNotContains(self.client.get(self.url),
+                               'Из другого процесса')
+        with override_settings(FLATPAGES_MAX_AGE=0):
+            self.assertContains(self.client.get(self.url),
+                                'Из другого процесса')
+
+    def test_about_include(self):
+        """
+        Тест проверяет страницы под about/ и переадресацию без слеша
+        """
+        page = FlatPage.objects.create(url='/rules/', title='Правила',
+                                       content='правила')
+        page.sites.add(self.site)
+        self.assertContains(self.client.get('/about/rules/'), 'правила')
+        self.assertRedirects(self.client.get('/about/rules'),
+                             '/about/rules/', status_code=301,
+                             fetch_redirect_response=False)
+        self.assertEqual(self.client.get('/about/missing/').status_code, 404)
+
+    def test_authenticated(self):
+        """
+        Тест проверяет, что вошедшему пользователю страница отдается как
+        личная
+        """
+        user = User.objects.create_user(username='reader')
+        self.client.force_login(user)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'reader')
+        self.assertIn('private', response['Cache-Control'])
+
+
+@override_settings(POST_THUMBNAILS_ASYNC=False)
+class ContentAddressedMediaTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='uploader')
+        self.client = Client()
+        self.client.force_login(self.user)
+        with open('./posts/test_data/monkey.png', 'rb') as img:
+            self.monkey = img.read()
+
+    def upload(self, text, content=None):
+        image = SimpleUploadedFile('Monkey.PNG', content or self.monkey,
+                                   content_type='image/png')
+        self.client.post(reverse('new_post'),
+                         data={'text': text, 'image': image})
+        return Post.objects.get(text=text)
+
+    def other_image(self):
+        content = io.BytesIO()
+        Image.new('RGB', (20, 20), (10, 200, 30)).save(content, 'PNG')
+        return content.getvalue()
+
+    def test_duplicates_share_file(self):
+        """
+        Тест проверяет, что одинаковые загрузки хранятся одним файлом с
+        именем по хешу и счетчиком ссылок
+        """
+        first = self.upload('first')
+        second = self.upload('second')
+        # Загрузка пересохраняется без метаданных, имя — хеш результата.
+        with first.image.storage.open(first.image.name) as stored:
+            digest = hashlib.sha256(stored.read()).hexdigest()
+        self.assertEqual(first.image.name,
+                         f'posts/{digest[:2]}/{digest[2:4]}/{digest}.png')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertTrue(is_content_addressed(first.image.name))
+        self.assertEqual(ImageBlob.objects.get().refcount, 2)
+
+    def test_orphans_collected(self):
+        """
+        Тест проверяет, что файл удаляется, когда на него не остается
+        ссылок: при удалении и при замене изображения
+        """
+        first = self.upload('first')
+        second = self.upload('second')
+        name = first.image.name
+        first.delete()
+        self.assertEqual(ImageBlob.objects.get(name=name).refcount, 1)
+        self.client.post(
+            reverse('post_edit', args=['uploader', second.id]),
+            data={'text': 'second', 'image': SimpleUploadedFile(
+                'green.png', self.other_image(), content_type='image/png')}
+        )
+        second.refresh_from_db()
+        self.assertNotEqual(second.image.name, name)
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+        self.assertEqual(
+            ImageBlob.objects.get(name=second.image.name).refcount, 1)
+        # В TestCase колбэки on_commit не выполняются.
+        self.assertTrue(post_images.exists(name))
+        collect(name)
+        self.assertFalse(post_images.exists(name))
+
+    def test_reupload_before_collect(self):
+        """
+        Тест проверяет, что файл, загруженный снова до удаления без
+        ссылок, не удаляется
+        """
+        first = self.upload('first')
+        name = first.image.name
+        with post_images.open(name) as stored:
+            content = stored.read()
+        first.delete()
+        released = time.time()
+        # Новая запись еще не зафиксирована, строки ImageBlob нет.
+        self.assertEqual(post_images.save('posts/again.png',
+                                          ContentFile(content)), name)
+        collect(name, released)
+        self.assertTrue(post_images.exists(name))
+        collect(name, time.time())
+        self.assertFalse(post_images.exists(name))
+
+    def test_migrate_media(self):
+        """
+        Тест проверяет перенос старых файлов в хранилище по содержимому
+        """
+        old = [default_storage.save(f'posts/legacy-{num}.png',
+                                    ContentFile(self.monkey))
+               for num in range(2)]
+        for num, name in enumerate(old * 2):
+            Post.objects.create(text=f'legacy {num}', author=self.user,
+                                image=name)
+        # До переноса ссылки на файлы не считались.
+        ImageBlob.objects.all().delete()
+        call_command('migrate_media', stdout=open(os.devnull, 'w'))
+        names = set(Post.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(is_content_addressed(name))
+        self.assertEqual(ImageBlob.objects.get().refcount, 4)
+        for legacy in old:
+            self.assertFalse(default_storage.exists(legacy))
+
+
+class ImageIngestTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='photographer2')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def upload(self, image):
+        self.client.post(reverse('new_post'),
+                         data={'text': 'photo', 'image': image})
+        return Post.objects.get(text='photo')
+
+    @override_settings(POST_IMAGE_MAX_SIZE=1000)
+    def test_downscale_and_strip_exif(self):
+        """
+        Тест проверяет, что оригинал поворачивается по EXIF, уменьшается
+        и сохраняется без метаданных
+        """
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: повернуть на 90°
+        exif[0x010F] = 'Camera'  # Make
+        content = io.BytesIO()
+        Image.new('RGB', (3000, 1200), (200, 30, 30)).save(
+            content, 'JPEG', exif=exif.tobytes())
+        with mock.patch.object(thumbnails, '_submit'):
+            post = self.upload(SimpleUploadedFile(
+                'camera.jpg', content.getvalue(), content_type='image/jpeg'))
+        with post.image.storage.open(post.image.name) as stored:
+            image = Image.open(stored)
+            self.assertEqual(image.size, (400, 1000))
+            self.assertEqual(dict(image.getexif()), {})
+            self.assertNotIn('exif', image.info)
+
+    def test_truncated_image(self):
+        """
+        Тест проверяет, что поврежденное изображение дает ошибку формы,
+        а не ошибку сервера
+        """
+        content = io.BytesIO()
+        Image.new('RGB', (600, 400), (200, 30, 30)).save(content, 'JPEG')
+        truncated = content.getvalue()[:len(content.getvalue()) // 2]
+        response = self.client.post(reverse('new_post'), data={
+            'text': 'photo',
+            'image': SimpleUploadedFile('broken.jpg', truncated,
+                                        content_type='image/jpeg'),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].has_error(
+            'image', 'invalid_image'))
+        self.assertFalse(Post.objects.filter(text='photo').exists())
+
+    @override_settings(POST_THUMBNAILS_ASYNC=False)
+    def test_picture_markup(self):
+        """
+        Тест проверяет, что лента отдает <picture> с вариантами разной
+        ширины и запасной картинкой
+        """
+        with open('./posts/test_data/monkey.png', 'rb') as img:
+            self.upload(img)
+        response = self.client.get(reverse('index'))
+        html = response.content.decode()
+        self.assertIn('<picture>', html)
+        self.assertIn('<source type="image/webp" srcset="', html)
+        # Оригинал шириной 637 не увеличивается: ширины 960 и 1440
+        # совпадают с ним.
+        self.assertIn('.webp 480w, ', html)
+        self.assertIn('.webp 637w"', html)
+        self.assertNotIn('1440w', html)
+        self.assertIn('<img class="card-img"', html)
+
+    @override_settings(POST_THUMBNAILS_ASYNC=False)
+    def test_thumbnails_keep_block_size(self):
+        """
+        Тест проверяет, что миниатюры sorl не меняют размер блока
+        Pillow за пределами блокировки записи
+        """
+        block_size = ImageFile.MAXBLOCK
+        with open('./posts/test_data/monkey.png', 'rb') as img:
+            self.upload(img)
+        self.assertEqual(ImageFile.MAXBLOCK, block_size)
+
+    def test_formats_follow_pillow(self):
+        """
+        Тест проверяет, что AVIF используется, только если Pillow умеет
+        его записывать
+        """
+        with mock.patch.dict(Image.SAVE):
+            Image.SAVE.pop('AVIF', None)
+            self.assertEqual(available_formats(), ['WEBP'])
+        with mock.patch.dict(Image.SAVE, {'AVIF': object()}):
+            self.assertEqual(available_formats(), ['AVIF', 'WEBP'])
@@ -0,0 +1,130 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.engines import pil_engine
+from sorl.thumbnail.images import ImageFile
+
+from .cache import bump_version, feed_names, invalidate_feeds
+from .images import encoder_block, variants
+from .media import post_images
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_pending = set()
+_pending_lock = threading.Lock()
+_executor = None
+
+
+class ThumbnailPending(Exception):
+    pass
+
+
+def is_async():
+    return settings.POST_THUMBNAILS_ASYNC and not getattr(
+        _local, 'generating', False
+    )
+
+
+def get_executor():
+    global _executor
+    with _pending_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.POST_THUMBNAILS_WORKERS,
+                thread_name_prefix='thumbnails'
+            )
+    return _executor
+
+
+def generate_thumbnails(name):
+    """
+    Создает все миниатюры изображения (см. posts.images.variants) и
+    сбрасывает кеш карточек и лент, где оно показывается.
+    """
+    from .models import Post
+    _local.generating = True
+    # Ключи миниатюр sorl включают хранилище исходника: оно должно быть
+    # тем же, что у поля Post.image в шаблонах.
+    source = ImageFile(name, post_images)
+    try:
+        for geometry, options in variants():
+            default.backend.get_thumbnail(source, geometry, **options)
+        for post in Post.objects.filter(image=name).select_related('author'):
+            bump_version('post', post.pk)
+            invalidate_feeds(feed_names(post))
+    finally:
+        _local.generating = False
+        with _pending_lock:
+            _pending.discard(name)
+
+
+def generate_in_worker(name):
+    try:
+        generate_thumbnails(name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+    finally:
+        connections.close_all()
+
+
+def _submit(name):
+    get_executor().submit(generate_in_worker, name)
+
+
+def schedule_thumbnails(name):
+    """
+    Ставит создание миниатюр в фоновый пул; без POST_THUMBNAILS_ASYNC
+    создает их сразу.
+    """
+    if not name:
+        return
+    if not is_async():
+        generate_thumbnails(name)
+        return
+    with _pending_lock:
+        if name in _pending:
+            return
+        _pending.add(name)
+    _submit(name)
+
+
+class DeferredThumbnailBackend(ThumbnailBackend):
+    """
+    Не создает миниатюру во время запроса: ставит задачу в фоновый пул и
+    возвращает None. Тег post_picture тогда выводит вместо <picture>
+    заглушку из includes/post_picture.html, а формат без всех ширин
+    пропускает. Готовые миниатюры по-прежнему берутся из хранилища
+    ключей sorl.
+    """
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        try:
+            return super().get_thumbnail(file_, geometry_string, **options)
+        except ThumbnailPending:
+            schedule_thumbnails(getattr(file_, 'name', file_))
+            return None
+
+    def _create_thumbnail(self, source_image, geometry_string, options,
+                          thumbnail):
+        if is_async():
+            raise ThumbnailPending(thumbnail.name)
+        super()._create_thumbnail(source_image, geometry_string, options,
+                                  thumbnail)
+
+
+class Engine(pil_engine.Engine):
+    """
+    Движок PIL из sorl, который записывает миниатюры под блокировкой
+    posts.images.encoder_block: иначе фоновые потоки меняли бы
+    ImageFile.MAXBLOCK посреди ingest в другом потоке.
+    """
+
+    def _get_raw_data(self, *args, **kwargs):
+        with encoder_block():
+            return super()._get_raw_data(*args, **kwargs)
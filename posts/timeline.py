@@ -0,0 +1,112 @@
+from django.conf import settings
+from django.db.models import Max
+
+from .models import AuthorStats, Follow, Post, TimelineEntry
+
+
+def _entries(user_ids, post):
+    return [
+        TimelineEntry(user_id=user_id, post_id=post.pk,
+                      author_id=post.author_id, pub_date=post.pub_date)
+        for user_id in user_ids
+    ]
+
+
+def is_pulled(author_id):
+    """
+    Записи авторов с большим числом подписчиков не рассылаются при
+    публикации, а подтягиваются в ленту читателя при ее открытии.
+    """
+    return AuthorStats.objects.filter(
+        pk=author_id, follower_count__gt=settings.POSTS_FANOUT_LIMIT
+    ).exists()
+
+
+def fan_out(post):
+    """
+    Добавляет новую запись в ленты всех подписчиков автора пакетами.
+    """
+    if is_pulled(post.author_id):
+        return
+    batch_size = settings.POSTS_FANOUT_BATCH_SIZE
+    followers = Follow.objects.filter(author_id=post.author_id).values_list(
+        'user_id', flat=True
+    ).order_by().iterator(chunk_size=batch_size)
+    batch = []
+    for user_id in followers:
+        batch.append(user_id)
+        if len(batch) >= batch_size:
+            TimelineEntry.objects.bulk_create(_entries(batch, post),
+                                              ignore_conflicts=True)
+            batch = []
+    TimelineEntry.objects.bulk_create(_entries(batch, post),
+                                      ignore_conflicts=True)
+
+
+def backfill(user_id, author_id, since=None):
+    """
+    Копирует записи автора в ленту подписчика, начиная с since, если он
+    задан. Записи читаются пакетами по id, чтобы лента не обрывалась на
+    последних записях, а память не росла с их числом.
+    """
+    posts = Post.objects.filter(author_id=author_id).order_by('pk')
+    if since is not None:
+        posts = posts.filter(pub_date__gt=since)
+    batch_size = settings.POSTS_BACKFILL_BATCH_SIZE
+    last_pk = 0
+    while True:
+        batch = list(posts.filter(pk__gt=last_pk).values_list(
+            'pk', 'pub_date'
+        )[:batch_size])
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, post_id=pk, author_id=author_id,
+                           pub_date=pub_date) for pk, pub_date in batch],
+            ignore_conflicts=True
+        )
+        if len(batch) < batch_size:
+            return
+        last_pk = batch[-1][0]
+
+
+def backfill_authors(author_ids):
+    """
+    Дополняет ленты подписчиков авторов после загрузки записей через
+    bulk_create, который не отправляет сигналы. Записи со старыми датами
+    тоже попадают в ленты, поэтому копируется все, без since.
+    """
+    author_ids = sorted(set(author_ids))
+    batch_size = settings.POSTS_FANOUT_BATCH_SIZE
+    for start in range(0, len(author_ids), batch_size):
+        follows = Follow.objects.filter(
+            author_id__in=author_ids[start:start + batch_size]
+        ).values_list('user_id', 'author_id').order_by()
+        for user_id, author_id in follows.iterator():
+            backfill(user_id, author_id)
+
+
+def remove(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def pull(user_id):
+    """
+    Подтягивает в ленту новые записи авторов, которые работают по
+    модели «чтения», — их записи не рассылаются при публикации.
+    """
+    pulled = Follow.objects.filter(
+        user_id=user_id,
+        author__stats__follower_count__gt=settings.POSTS_FANOUT_LIMIT
+    ).values_list('author_id', flat=True)
+    for author_id in pulled:
+        latest = TimelineEntry.objects.filter(
+            user_id=user_id, author_id=author_id
+        ).aggregate(latest=Max('pub_date'))['latest']
+        backfill(user_id, author_id, since=latest)
+
+
+def timeline(user):
+    """
+    Лента подписок пользователя: диапазон по индексу (user, -pub_date).
+    """
+    pull(user.pk)
+    return TimelineEntry.objects.filter(user=user)
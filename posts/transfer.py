@@ -0,0 +1,234 @@
+import csv
+import json
+import threading
+from contextlib import contextmanager
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from . import search, stats, timeline
+from .cache import bump_version, invalidate_feeds
+from .media import recount_blobs
+from .models import (Comment, Group, Post, User, render_comment_text,
+                     render_post_text)
+
+# Поля каждого типа строк в порядке экспорта. В CSV все типы пишутся в
+# одну таблицу с общим набором столбцов и столбцом type.
+FIELDS = {
+    'group': ('id', 'title', 'slug', 'description'),
+    'post': ('id', 'author', 'group', 'text', 'pub_date', 'image'),
+    'comment': ('id', 'post', 'author', 'text', 'created'),
+}
+CSV_COLUMNS = ('type', 'id', 'title', 'slug', 'description', 'author',
+               'group', 'post', 'text', 'pub_date', 'created', 'image')
+
+
+def export_rows(chunk_size=2000):
+    """
+    Строки для экспорта: сообщества, затем записи, затем комментарии.
+    Данные читаются итератором, память не зависит от размера таблиц.
+    """
+    for row in Group.objects.order_by('pk').values(
+            *FIELDS['group']).iterator(chunk_size=chunk_size):
+        yield {'type': 'group', **row}
+    for row in Post.objects.order_by('pk').values(
+            'id', 'author__username', 'group__slug', 'text', 'pub_date',
+            'image').iterator(chunk_size=chunk_size):
+        yield {
+            'type': 'post', 'id': row['id'],
+            'author': row['author__username'], 'group': row['group__slug'],
+            'text': row['text'], 'pub_date': row['pub_date'].isoformat(),
+            'image': row['image'] or '',
+        }
+    for row in Comment.objects.order_by('pk').values(
+            'id', 'post_id', 'author__username', 'text',
+            'created').iterator(chunk_size=chunk_size):
+        yield {
+            'type': 'comment', 'id': row['id'], 'post': row['post_id'],
+            'author': row['author__username'], 'text': row['text'],
+            'created': row['created'].isoformat(),
+        }
+
+
+def write_jsonl(rows, stream):
+    for row in rows:
+        stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def write_csv(rows, stream):
+    writer = csv.DictWriter(stream, CSV_COLUMNS, restval='')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        yield {
+            field: row[field] or None
+            for field in ('type',) + FIELDS[row['type']]
+        }
+
+
+_timestamps_lock = threading.RLock()
+
+
+@contextmanager
+def keep_timestamps():
+    """
+    Отключает auto_now_add, чтобы bulk_create сохранил даты из файла.
+
+    Поля модели общие для всего процесса: пока блок выполняется, записи
+    из других потоков тоже сохраняются без автоматической даты. Поэтому
+    блок — только для команд управления, не для процесса сервера.
+    Одновременные блоки выполняются по очереди, вложенные работают.
+    """
+    fields = [Post._meta.get_field('pub_date'),
+              Comment._meta.get_field('created')]
+    with _timestamps_lock:
+        saved = [field.auto_now_add for field in fields]
+        for field in fields:
+            field.auto_now_add = False
+        try:
+            yield
+        finally:
+            for field, value in zip(fields, saved):
+                field.auto_now_add = value
+
+
+class Importer:
+    """
+    Загружает строки пакетами через bulk_create. Авторы и сообщества
+    берутся из заранее загруженных словарей; уже существующие id
+    пропускаются, поэтому прерванный импорт можно просто запустить снова.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.users = dict(User.objects.values_list('username', 'id'))
+        self.groups = dict(Group.objects.values_list('slug', 'id'))
+        self.created = {'group': 0, 'post': 0, 'comment': 0}
+        self.skipped = 0
+        # bulk_create не отправляет сигналы: счетчики и поисковый индекс
+        # дополняются в каждом пакете, а затронутые ленты и обсуждения
+        # сбрасываются, а ленты подписчиков авторов дополняются в конце
+        # загрузки.
+        self.feeds = set()
+        self.threads = set()
+        self.authors = set()
+
+    def run(self, rows, progress=None):
+        batch = []
+        kind = None
+        with keep_timestamps():
+            for row in rows:
+                if batch and row['type'] != kind:
+                    self.flush(kind, batch)
+                    batch = []
+                kind = row['type']
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    self.flush(kind, batch)
+                    batch = []
+                    if progress:
+                        progress(self.created, self.skipped)
+            if batch:
+                self.flush(kind, batch)
+        self.reset_sequences()
+        self.invalidate()
+        if self.created['post']:
+            # bulk_create не отправляет сигналы, ссылки на файлы
+            # пересчитываются целиком.
+            recount_blobs()
+        return self.created, self.skipped
+
+    @transaction.atomic
+    def flush(self, kind, rows):
+        model = {'group': Group, 'post': Post, 'comment': Comment}[kind]
+        existing = set(model.objects.filter(
+            pk__in=[int(row['id']) for row in rows]
+        ).values_list('pk', flat=True))
+        fresh = [row for row in rows if int(row['id']) not in existing]
+        self.skipped += len(rows) - len(fresh)
+        self.ensure_users(fresh)
+        objects = [getattr(self, f'build_{kind}')(row) for row in fresh]
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        if kind == 'group':
+            self.groups.update((obj.slug, obj.pk) for obj in objects)
+        elif kind == 'post':
+            stats.count_new(posts=objects)
+            search.index_new(posts=[(obj.pk, obj.text) for obj in objects])
+        else:
+            stats.count_new(comments=objects)
+            search.index_new(comments=[
+                (obj.pk, obj.text, obj.post_id) for obj in objects
+            ])
+        self.created[kind] += len(objects)
+
+    def ensure_users(self, rows):
+        missing = {row['author'] for row in rows if row.get('author')}
+        missing -= set(self.users)
+        if not missing:
+            return
+        new_users = []
+        for username in missing:
+            user = User(username=username)
+            user.set_unusable_password()
+            new_users.append(user)
+        User.objects.bulk_create(new_users)
+        self.users.update(User.objects.filter(
+            username__in=missing
+        ).values_list('username', 'id'))
+
+    def build_group(self, row):
+        return Group(id=int(row['id']), title=row['title'], slug=row['slug'],
+                     description=row['description'] or '')
+
+    def build_post(self, row):
+        self.feeds.update(['index', f'author:{row["author"]}'])
+        self.authors.add(self.users[row['author']])
+        if row['group']:
+            self.feeds.add(f'group:{row["group"]}')
+        return Post(
+            id=int(row['id']),
+            author_id=self.users[row['author']],
+            group_id=self.groups.get(row['group']) if row['group'] else None,
+            text=row['text'] or '',
+            text_html=render_post_text(row['text'] or ''),
+            pub_date=parse_datetime(row['pub_date']),
+            image=row['image'] or None,
+        )
+
+    def build_comment(self, row):
+        self.threads.add(int(row['post']))
+        return Comment(
+            id=int(row['id']),
+            post_id=int(row['post']),
+            author_id=self.users[row['author']],
+            text=row['text'] or '',
+            text_html=render_comment_text(row['text'] or ''),
+            created=parse_datetime(row['created']),
+        )
+
+    def invalidate(self):
+        timeline.backfill_authors(self.authors)
+        invalidate_feeds(self.feeds)
+        for pk in self.threads:
+            bump_version('thread', pk)
+
+    def reset_sequences(self):
+        # После вставки с явными id последовательности PostgreSQL
+        # нужно сдвинуть; для SQLite список запросов пуст.
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [Group, Post, Comment, User]
+        )
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
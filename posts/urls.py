@@ -9,12 +9,27 @@ urlpatterns = [
     path('new/',
          views.new_post,
          name='new_post'),
+    path('search/',
+         views.search,
+         name='search'),
+    path('follow/',
+         views.follow_index,
+         name='follow_index'),
     path('<str:username>/',
          views.profile,
          name='profile'),
+    path('<str:username>/follow/',
+         views.profile_follow,
+         name='profile_follow'),
+    path('<str:username>/unfollow/',
+         views.profile_unfollow,
+         name='profile_unfollow'),
     path('<str:username>/<int:post_id>/',
          views.post_view,
          name='post'),
+    path('<str:username>/<int:post_id>/comments/',
+         views.post_comments,
+         name='post_comments'),
     path(
         '<str:username>/<int:post_id>/edit/',
         views.post_edit,
@@ -1,15 +1,27 @@
+from urllib.parse import urlencode
+
 from django.shortcuts import render, get_object_or_404, redirect
-from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
-from .models import Post, Group, User, Comment
+from django.views.decorators.http import condition
+from yatube.sqlite.writes import write
+from .models import Post, Comment, Follow
 from . forms import PostForm, CommentForm
+from .cache import cache_feed_page, feed_etag, get_versions, make_etag
+from .object_cache import groups, users
+from .paginator import KeysetPaginator
+from .search import search as search_posts
+from .stats import get_count
+from .thumbnails import schedule_thumbnails
+from .timeline import timeline
+
+COMMENTS_PER_PAGE = 20
 
 
+@condition(etag_func=feed_etag(lambda: 'index'))
+@cache_feed_page(lambda: 'index')
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.for_feed()
+    paginator, page = KeysetPaginator(post_list, 10).paginate(request)
     return render(
         request,
         'index.html',
@@ -17,38 +29,42 @@ def index(request):
     )
 
 
+@condition(etag_func=feed_etag(lambda slug: f'group:{slug}'))
+@cache_feed_page(lambda slug: f'group:{slug}')
 def group_posts(request, slug):
-    groups = get_object_or_404(Group, slug=slug)
-    posts = groups.group_posts.all()
-    page_number = request.GET.get('page')
-    paginator = Paginator(posts, 10)
-    page = paginator.get_page(page_number)
+    group = groups.get_or_404(slug)
+    posts = Post.objects.for_feed().filter(group_id=group.id)
+    paginator, page = KeysetPaginator(posts, 10).paginate(request)
     return render(
         request,
         "group.html",
-        {"group": groups, 'page': page, 'paginator': paginator}
+        {"group": group, 'page': page, 'paginator': paginator}
     )
 
 
 @login_required
 def new_post(request):
-    form = PostForm(request.POST or None)
+    form = PostForm(request.POST or None, files=request.FILES or None)
     if request.method == 'POST':
         if form.is_valid():
             post = form.save(commit=False)
             post.author = request.user
-            post.save()
+            write(post.save)
+            schedule_thumbnails(post.image.name)
             return redirect('index')
         return render(request, 'new_post.html', {'form': form})
     return render(request, 'post_new.html', {'form': form})
 
 
+@condition(etag_func=feed_etag(lambda username: f'author:{username}'))
+@cache_feed_page(lambda username: f'author:{username}')
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = Post.objects.filter(author=author)
-    paginator = Paginator(posts, 10)
-    page_num = request.GET.get('page')
-    page = paginator.get_page(page_num)
+    author = users.get_or_404(username)
+    posts = Post.objects.for_feed().filter(author_id=author.id)
+    paginator, page = KeysetPaginator(posts, 10).paginate(request)
+    following = request.user.is_authenticated and Follow.objects.filter(
+        user=request.user, author=author
+    ).exists()
     return render(
         request,
         'profile.html',
@@ -56,19 +72,40 @@ def profile(request, username):
             'page': page,
             'paginator': paginator,
             'author': author,
-            'post_sum': posts.count()
+            'post_sum': get_count(author, 'post_count'),
+            'follower_sum': get_count(author, 'follower_count'),
+            'following_sum': get_count(author, 'following_count'),
+            'following': following
         }
     )
 
 
-def post_view(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+def post_etag(request, username, post_id):
+    """
+    ETag страницы записи: версии записи, ее комментариев и профиля автора
+    (счетчики в карточке).
+    """
+    versions = get_versions(
+        ('post', post_id), ('thread', post_id), ('feed', f'author:{username}')
+    )
+    return make_etag(request, *versions)
+
+
+def comment_page(request, post_id):
+    """
+    Порция комментариев к записи, новые сначала. Следующие порции
+    выбираются по курсору ?cursor= из пары (created, id).
+    """
+    comments = Comment.objects.for_thread().filter(post_id=post_id)
+    return KeysetPaginator(
+        comments, COMMENTS_PER_PAGE, ordering=('-created', 'id'),
+        page_number_limit=0
+    ).paginate(request)
+
+
+def render_post(request, post, form):
     author = post.author
-    comments = post.comments.all()  # Comment.objects.filter(post=post)
-    # form = CommentForm(instance=None)
-    form = CommentForm(request.POST or None,
-                       instance=None
-                       )
+    paginator, comments = comment_page(request, post.id)
     return render(
         request,
         'post.html',
@@ -76,10 +113,44 @@ def post_view(request, username, post_id):
             'post': post,
             'author': author,
             'items': comments,
-            'form': form
+            'form': form,
+            'post_sum': get_count(author, 'post_count'),
+            'follower_sum': get_count(author, 'follower_count'),
+            'following_sum': get_count(author, 'following_count'),
+            'comment_sum': get_count(post, 'comment_count')
         }
     )
 
+
+def post_queryset():
+    return Post.objects.for_feed().select_related('author__stats', 'stats')
+
+
+@condition(etag_func=post_etag)
+def post_view(request, username, post_id):
+    author = users.get_or_404(username)
+    post = get_object_or_404(post_queryset(), author_id=author.id, id=post_id)
+    # form = CommentForm(instance=None)
+    form = CommentForm(request.POST or None,
+                       instance=None
+                       )
+    return render_post(request, post, form)
+
+
+@condition(etag_func=post_etag)
+def post_comments(request, username, post_id):
+    """
+    Следующая порция комментариев без остальной страницы.
+    """
+    author = users.get_or_404(username)
+    get_object_or_404(Post.objects.only('id'), author_id=author.id, id=post_id)
+    paginator, comments = comment_page(request, post_id)
+    return render(
+        request,
+        'includes/comment_list.html',
+        {'items': comments, 'username': username, 'post_id': post_id}
+    )
+
 """
 def post_view(request, username, post_id):
     post = get_object_or_404(Post, pk=post_id, author__username=username)
@@ -95,7 +166,8 @@ def post_view(request, username, post_id):
 
 @login_required
 def post_edit(request, username, post_id):
-    post = get_object_or_404(Post, id=post_id, author__username=username)
+    author = users.get_or_404(username)
+    post = get_object_or_404(Post, id=post_id, author_id=author.id)
     if request.user != post.author:
         return redirect('post', username=username, post_id=post_id)
     form = PostForm(request.POST or None,
@@ -103,7 +175,8 @@ def post_edit(request, username, post_id):
                     instance=post
                     )
     if form.is_valid():
-        form.save()
+        post = write(form.save)
+        schedule_thumbnails(post.image.name)
         return redirect('post', username=username, post_id=post_id)
     return render(
         request,
@@ -115,6 +188,67 @@ def post_edit(request, username, post_id):
     )
 
 
+def attach_posts(page):
+    """
+    Заменяет строки страницы с полем post_id на сами записи.
+    """
+    posts = Post.objects.for_feed().in_bulk(
+        [row['post_id'] for row in page]
+    )
+    page.object_list = [
+        posts[row['post_id']] for row in page if row['post_id'] in posts
+    ]
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    results = search_posts(query)
+    paginator, page = KeysetPaginator(
+        results, 10, ordering=('-score', '-post_id')
+    ).paginate(request)
+    attach_posts(page)
+    return render(
+        request,
+        'search.html',
+        {
+            'query': query,
+            'page': page,
+            'paginator': paginator,
+            'extra_query': urlencode({'q': query}) + '&',
+        }
+    )
+
+
+@login_required
+def follow_index(request):
+    entries = timeline(request.user).values('post_id', 'pub_date')
+    paginator, page = KeysetPaginator(
+        entries, 10, ordering=('-pub_date', 'post_id')
+    ).paginate(request)
+    attach_posts(page)
+    return render(
+        request,
+        'follow.html',
+        {'page': page, 'paginator': paginator}
+    )
+
+
+@login_required
+def profile_follow(request, username):
+    author = users.get_or_404(username)
+    if author != request.user:
+        write(Follow.objects.get_or_create, user=request.user, author=author)
+    return redirect('profile', username=username)
+
+
+@login_required
+def profile_unfollow(request, username):
+    write(Follow.objects.filter(
+        user=request.user, author__username=username
+    ).delete)
+    return redirect('profile', username=username)
+
+
 def page_not_found(request, exception):
     return render(
         request,
@@ -130,8 +264,8 @@ def server_error(request):
 
 @login_required
 def add_comment(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
-    comments = Comment.objects.filter(post=post)
+    author = users.get_or_404(username)
+    post = get_object_or_404(post_queryset(), author_id=author.id, id=post_id)
     if request.user != post.author:
         return redirect('post', username=username, post_id=post_id)
     form = CommentForm(request.POST or None,
@@ -141,14 +275,8 @@ def add_comment(request, username, post_id):
         comment = form.save(commit=False)
         comment.post = post
         comment.author = request.user
-        comment.save()
+        write(comment.save)
         return redirect('post', username=username, post_id=post_id)
-    return render(
-        request,
-        'includes/comments.html',
-        {
-            'form': form,
-            'post': post,
-            'items': comments
-        }
-    )
+    # Ошибки формы показываются на странице записи с первой порцией
+    # комментариев.
+    return render_post(request, post, form)
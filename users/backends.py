@@ -0,0 +1,43 @@
+"""
+Пользователь текущего запроса из кеша.
+
+AuthenticationMiddleware на каждом запросе вошедшего пользователя
+загружает его из базы. CachedModelBackend берет его из общего кеша;
+запись сбрасывается после фиксации любого сохранения или удаления
+пользователя (смена пароля, правка в админке) и при выходе.
+
+Уровня в памяти процесса нет, и сброс виден всем процессам, которые
+делят кеш. Кеш в памяти одного процесса (PROCESS_LOCAL_CACHES) сброс в
+другом процессе не увидит, поэтому с ним пользователь загружается из
+базы, как в ModelBackend.
+
+Хеш пароля в кеш не попадает: объект кешируется как SessionUser с
+хешем сессии, с которым проверка сессии сравнивает сохраненный при
+входе. Объект всегда читается из основной базы, а не с реплики.
+"""
+from django.contrib.auth.backends import ModelBackend
+
+from posts.cache import cache_is_shared
+from posts.object_cache import ObjectCache
+
+from .models import SessionUser
+
+
+class SessionUserCache(ObjectCache):
+    def _dump(self, instance):
+        instance.session_auth_hash = instance.get_session_auth_hash()
+        del instance.password
+        return super()._dump(instance)
+
+
+session_users = SessionUserCache(
+    SessionUser._default_manager.using('default'), 'pk', local_size=0
+)
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        if not cache_is_shared():
+            return super().get_user(user_id)
+        user = session_users.get(user_id)
+        return user if self.user_can_authenticate(user) else None
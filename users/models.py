@@ -1,3 +1,25 @@
-from django.db import models
+from django.contrib.auth import get_user_model
 
-# Create your models here.
+User = get_user_model()
+
+
+class SessionUser(User):
+    """
+    Пользователь запроса из кеша (users.backends). Поле password не
+    загружено: хеш сессии вычисляется при загрузке в кеш и хранится в
+    session_auth_hash.
+
+    Сигналы моделей для прокси отправляются с sender=SessionUser, поэтому
+    обработчики сигналов User подключены и к нему.
+    """
+    session_auth_hash = None
+
+    class Meta:
+        proxy = True
+
+    def get_session_auth_hash(self):
+        # После set_password или загрузки пароля хеш считается заново:
+        # update_session_auth_hash должен получить новый.
+        if self.session_auth_hash is None or 'password' in self.__dict__:
+            return super().get_session_auth_hash()
+        return self.session_auth_hash
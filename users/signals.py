@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .backends import session_users
+from .models import SessionUser
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=SessionUser)
+@receiver(post_delete, sender=SessionUser)
+def invalidate_session_user(sender, instance, **kwargs):
+    session_users.invalidate(instance.pk)
+
+
+@receiver(user_logged_out)
+def forget_session_user(sender, user, **kwargs):
+    if user is not None:
+        session_users.invalidate(user.pk)
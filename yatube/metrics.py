@@ -0,0 +1,293 @@
+"""
+Метрики запросов в формате Prometheus.
+
+MetricsMiddleware для каждого запроса измеряет общее время, число и
+время SQL-запросов, время рендеринга шаблонов и обращения к страничному
+кешу и складывает их в гистограммы по имени представления. Гистограммы
+живут в памяти процесса: каждый воркер отдает свои значения, суммирует
+их Prometheus.
+
+Медленные запросы (дольше METRICS_SLOW_REQUEST_MS) пишутся в журнал
+yatube.metrics вместе с их SQL.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import HttpResponse
+from django.template.backends.django import (
+    DjangoTemplates, Template, reraise
+)
+from django.template.exceptions import TemplateDoesNotExist
+from django.utils.crypto import constant_time_compare
+
+from posts.cache import page_cache_lookup
+from posts.object_cache import object_cache_stats
+
+logger = logging.getLogger(__name__)
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """
+    Семейство гистограмм или счетчиков с метками.
+    """
+
+    def __init__(self, name, documentation, buckets=None):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.kind = 'counter' if buckets is None else 'histogram'
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            histogram = self.series.get(key)
+            if histogram is None:
+                histogram = self.series[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            series = sorted(self.series.items())
+            if self.kind == 'counter':
+                for key, value in series:
+                    lines.append(f'{self.name}{_labels(key)} {value}')
+                return lines
+            for key, histogram in series:
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',),
+                                        histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        self.name, _labels(key + (('le', str(bound)),)),
+                        cumulative
+                    ))
+                lines.append(f'{self.name}_sum{_labels(key)} '
+                             f'{histogram.sum:.6f}')
+                lines.append(f'{self.name}_count{_labels(key)} '
+                             f'{histogram.count}')
+        return lines
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ) + '}'
+
+
+REQUEST_DURATION = Metric(
+    'yatube_request_duration_seconds', 'Время обработки запроса',
+    TIME_BUCKETS
+)
+DB_QUERIES = Metric(
+    'yatube_db_queries', 'Число SQL-запросов на запрос', QUERY_BUCKETS
+)
+DB_DURATION = Metric(
+    'yatube_db_duration_seconds', 'Время SQL-запросов за запрос',
+    TIME_BUCKETS
+)
+TEMPLATE_DURATION = Metric(
+    'yatube_template_duration_seconds', 'Время рендеринга шаблонов',
+    TIME_BUCKETS
+)
+PAGE_CACHE = Metric(
+    'yatube_page_cache_total', 'Обращения к страничному кешу лент'
+)
+METRICS = (REQUEST_DURATION, DB_QUERIES, DB_DURATION, TEMPLATE_DURATION,
+           PAGE_CACHE)
+
+_local = threading.local()
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'template_time', 'cache', 'sql')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.cache = {}
+        self.sql = []
+
+
+def current():
+    """
+    Счетчики текущего запроса этого потока или None вне запроса.
+    """
+    return getattr(_local, 'stats', None)
+
+
+def _on_page_cache(sender, outcome, **kwargs):
+    stats = current()
+    if stats is not None:
+        stats.cache[outcome] = stats.cache.get(outcome, 0) + 1
+
+
+page_cache_lookup.connect(_on_page_cache, dispatch_uid='yatube.metrics')
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = current()
+        if stats is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Шаблонный движок Django, который учитывает время рендеринга в
+    метриках текущего запроса.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(
+                self.engine.get_template(template_name), self
+            )
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow = settings.METRICS_SLOW_REQUEST_MS / 1000
+        self.sql_limit = settings.METRICS_SLOW_SQL_LIMIT
+
+    def __call__(self, request):
+        stats = _local.stats = RequestStats()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(
+                        self._execute
+                    ))
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        REQUEST_DURATION.observe(duration, view=view)
+        DB_QUERIES.observe(stats.queries, view=view)
+        DB_DURATION.observe(stats.db_time, view=view)
+        TEMPLATE_DURATION.observe(stats.template_time, view=view)
+        for outcome, count in stats.cache.items():
+            PAGE_CACHE.inc(count, view=view, outcome=outcome)
+        if duration >= self.slow:
+            self.log_slow(request, view, duration, stats)
+        return response
+
+    def _execute(self, execute, sql, params, many, context):
+        stats = _local.stats
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.queries += 1
+            stats.db_time += elapsed
+            if len(stats.sql) < self.sql_limit:
+                stats.sql.append((elapsed, sql))
+
+    def log_slow(self, request, view, duration, stats):
+        queries = '\n'.join(
+            f'  {elapsed * 1000:.1f} ms  {sql}' for elapsed, sql in stats.sql
+        )
+        logger.warning(
+            'Медленный запрос %s %s (%s): %.0f ms, SQL %d за %.0f ms, '
+            'шаблоны %.0f ms\n%s',
+            request.method, request.get_full_path(), view, duration * 1000,
+            stats.queries, stats.db_time * 1000, stats.template_time * 1000,
+            queries
+        )
+
+
+def _object_cache_lines():
+    stats = object_cache_stats()
+    lines = [
+        '# HELP yatube_object_cache_total Обращения к кешу объектов',
+        '# TYPE yatube_object_cache_total counter',
+    ]
+    for model, outcomes in sorted(stats.items()):
+        for outcome in ('local', 'shared', 'miss'):
+            labels = _labels((('model', model), ('outcome', outcome)))
+            lines.append(f'yatube_object_cache_total{labels} '
+                         f'{outcomes.get(outcome, 0)}')
+    lines += [
+        '# HELP yatube_object_cache_hit_ratio Доля попаданий в кеш объектов',
+        '# TYPE yatube_object_cache_hit_ratio gauge',
+    ]
+    for model, outcomes in sorted(stats.items()):
+        if outcomes['hit_ratio'] is not None:
+            lines.append('yatube_object_cache_hit_ratio{} {:.4f}'.format(
+                _labels((('model', model),)), outcomes['hit_ratio']
+            ))
+    return lines
+
+
+def expose():
+    lines = [line for metric in METRICS for line in metric.expose()]
+    return '\n'.join(lines + _object_cache_lines()) + '\n'
+
+
+def _has_token(request):
+    # Адрес клиента не годится: за прокси на той же машине все запросы
+    # приходят с 127.0.0.1.
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and constant_time_compare(header, f'Bearer {token}')
+
+
+def metrics(request):
+    """
+    Метрики процесса для Prometheus. Доступны с заголовком
+    Authorization: Bearer METRICS_TOKEN и сотрудникам.
+    """
+    if not _has_token(request) and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(expose(), content_type=CONTENT_TYPE)
@@ -0,0 +1,126 @@
+"""
+Чтение с реплик.
+
+ReplicaMiddleware помечает GET-запросы к представлениям из
+DATABASE_REPLICA_VIEWS, и на время такого запроса ReplicaRouter отдает
+чтение одной из баз DATABASE_REPLICAS. Запись всегда идет в default.
+
+Реплика отстает от основной базы, поэтому клиент, который только что
+что-то записал, DATABASE_REPLICA_STICKY_SECONDS секунд читает из default
+и видит свои изменения. Срок хранится в cookie. Столько же из default
+читают все страницы, данные которых недавно изменились (use_primary()
+из posts.cache.get_versions): отрисованную с реплики старую страницу
+нельзя кешировать под новой версией.
+
+Локально реплику заменяет копия SQLite-файла, которую обновляет
+manage.py sync_replica --interval 1.
+"""
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+STICKY_COOKIE = 'primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Сессии читаются сразу после записи (вход), на реплику их не отправляем.
+PRIMARY_ONLY_APPS = {'sessions'}
+
+_state = threading.local()
+
+
+def _view_path(view_func):
+    return f'{view_func.__module__}.{view_func.__name__}'
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = getattr(_state, 'replica', None)
+        # После записи запрос дочитывает из основной базы.
+        if (alias is None or model._meta.app_label in PRIMARY_ONLY_APPS
+                or _state.wrote):
+            return 'default'
+        return alias
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На всех базах одни и те же данные.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Реплики получают схему вместе с данными.
+        return db == 'default'
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.replica = None
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = _state.wrote
+            _state.replica = None
+            _state.wrote = False
+        if wrote or request.method not in SAFE_METHODS:
+            sticky = settings.DATABASE_REPLICA_STICKY_SECONDS
+            response.set_cookie(
+                STICKY_COOKIE, str(int(time.time() + sticky)),
+                max_age=sticky, httponly=True, samesite='Lax'
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (settings.DATABASE_REPLICAS
+                and request.method in SAFE_METHODS
+                and _view_path(view_func) in settings.DATABASE_REPLICA_VIEWS
+                and not self.is_sticky(request)):
+            _state.replica = random.choice(settings.DATABASE_REPLICAS)
+
+    def is_sticky(self, request):
+        try:
+            return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+
+def use_primary():
+    """
+    До конца текущего запроса чтение идет из основной базы.
+    """
+    _state.replica = None
+
+
+def mark_written():
+    """
+    Отмечает запись в текущем запросе, как db_for_write. Нужно, когда
+    запись выполняет другой поток (очередь записи SQLite): флаг
+    хранится отдельно для каждого потока.
+    """
+    _state.wrote = True
+
+
+def sync(source='default', targets=None):
+    """
+    Копирует SQLite-базу source в реплики через backup API: копия
+    согласована, даже если в основную базу в это время пишут.
+    """
+    targets = settings.DATABASE_REPLICAS if targets is None else targets
+    primary = sqlite3.connect(connections[source].settings_dict['NAME'])
+    try:
+        for alias in targets:
+            replica = sqlite3.connect(connections[alias].settings_dict['NAME'])
+            try:
+                primary.backup(replica)
+            finally:
+                replica.close()
+    finally:
+        primary.close()
@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.metrics.MetricsMiddleware',
+    'yatube.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,7 +65,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'yatube.metrics.TimedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -84,13 +86,84 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# SQLite в режиме WAL: читатели не ждут писателей, писатели ждут друг
+# друга до timeout секунд. Дополнительные OPTIONS описаны в
+# yatube/sqlite/base.py.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'yatube.sqlite',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            'timeout': 20,
+            'begin_immediate': True,
+            'write_queue': False,
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'mmap_size': 256 * 1024 * 1024,
+                'cache_size': -64 * 1024,
+                'temp_store': 'MEMORY',
+            },
+        },
     }
 }
 
+# Реплика для чтения. Локально это копия db.sqlite3, которую обновляет
+# manage.py sync_replica --interval 1; чтобы читать из нее, добавьте
+# 'replica' в DATABASE_REPLICAS. См. yatube/replicas.py.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['yatube.replicas.ReplicaRouter']
+DATABASE_REPLICAS = []
+DATABASE_REPLICA_VIEWS = [
+    'posts.views.index',
+    'posts.views.group_posts',
+    'posts.views.profile',
+    'posts.views.post_view',
+    'posts.views.post_comments',
+    'posts.api.posts',
+    'posts.api.group_posts',
+    'posts.api.user_posts',
+    'posts.api.post_comments',
+    'posts.flatpages.flatpage',
+]
+# Сколько секунд после записи клиент читает из основной базы, а после
+# изменения данных страницы ее читают из основной базы все. Это время
+# должно быть больше отставания реплик, а часы серверов синхронизированы.
+DATABASE_REPLICA_STICKY_SECONDS = 5
+
+
+# Общий кеш всех процессов сервера: через него процессы узнают об
+# изменениях (версии страниц и фрагментов, сброс объектов и сессий), а
+# cache.add() служит блокировкой между процессами. Для нескольких
+# процессов нужен memcached, адрес которого задает MEMCACHED_LOCATION
+# (например, 127.0.0.1:11211): add() в нем атомарен. Без него кеш —
+# LocMemCache одного процесса; см. PROCESS_LOCAL_CACHES ниже. Тесты
+# очищают кеш, поэтому запускаются без MEMCACHED_LOCATION.
+if os.environ.get('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# Кеши в памяти одного процесса. С ними сессии и пользователь запроса
+# читаются из базы: выход и смена пароля в одном процессе не сбросили бы
+# их копии в остальных.
+PROCESS_LOCAL_CACHES = [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -132,6 +205,17 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 
+# При общем кеше сессия и пользователь запроса читаются из него. В
+# таблицу сессий пишется только измененная сессия
+# (SESSION_SAVE_EVERY_REQUEST выключен). С кешем из PROCESS_LOCAL_CACHES
+# сессии хранятся только в базе. CachedModelBackend — это ModelBackend
+# с кешем, второй бэкенд не нужен: он повторял бы проверку пароля.
+if CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
+
 LOGIN_URL = "/auth/login/"
 LOGIN_REDIRECT_URL = "index"
 # LOGOUT_REDIRECT_URL = "index"
@@ -141,10 +225,63 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 # Идентификатор текущего сайта
 SITE_ID = 1
+# Простые страницы отдаются из памяти процесса; браузеры и прокси могут
+# хранить их FLATPAGES_MAX_AGE секунд, а после этого проверяют по ETag.
+# Столько же после правки могут отдавать старую страницу другие процессы,
+# если кеш не общий (см. posts/flatpages.py).
+FLATPAGES_MAX_AGE = 5 * 60
 
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Миниатюры записей: геометрия -> параметры sorl-thumbnail. Создаются в
+# фоновом пуле при сохранении изображения, до этого шаблоны показывают
+# заглушку.
+THUMBNAIL_BACKEND = 'posts.thumbnails.DeferredThumbnailBackend'
+THUMBNAIL_ENGINE = 'posts.thumbnails.Engine'
+POST_THUMBNAILS = {
+    '960x339': {'crop': 'center', 'upscale': True},
+}
+POST_THUMBNAILS_ASYNC = True
+POST_THUMBNAILS_WORKERS = 2
+
+# Загрузки уменьшаются до POST_IMAGE_MAX_SIZE по большей стороне и
+# сохраняются без EXIF. Лента отдает <picture>: варианты шириной
+# POST_IMAGE_WIDTHS в POST_IMAGE_FORMATS (те, что умеет Pillow) и
+# запасную JPEG POST_IMAGE_FALLBACK для старых браузеров.
+POST_IMAGE_MAX_SIZE = 2560
+POST_IMAGE_WIDTHS = (480, 960, 1440)
+POST_IMAGE_FORMATS = ('AVIF', 'WEBP')
+POST_IMAGE_QUALITY = 80
+POST_IMAGE_FALLBACK = '960x339'
+POST_IMAGE_SIZES = '(min-width: 992px) 960px, 100vw'
+
+# Лента подписок: записи рассылаются подписчикам пакетами при публикации.
+# Записи авторов, у которых подписчиков больше POSTS_FANOUT_LIMIT,
+# подтягиваются в ленту читателя при ее открытии. При подписке в ленту
+# копируются все записи автора пакетами по POSTS_BACKFILL_BATCH_SIZE.
+POSTS_FANOUT_LIMIT = 1000
+POSTS_FANOUT_BATCH_SIZE = 500
+POSTS_BACKFILL_BATCH_SIZE = 500
+
+# Метрики запросов: /metrics/ доступен сотрудникам и с заголовком
+# Authorization: Bearer <METRICS_TOKEN>; без переменной окружения
+# METRICS_TOKEN — только сотрудникам. Запросы дольше
+# METRICS_SLOW_REQUEST_MS пишутся в журнал вместе с первыми
+# METRICS_SLOW_SQL_LIMIT SQL-запросами.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_SLOW_REQUEST_MS = 500
+METRICS_SLOW_SQL_LIMIT = 50
+
+# Кеш сообществ по slug и пользователей по username: LRU в памяти
+# процесса на OBJECT_CACHE_LOCAL_SIZE записей, которые живут
+# OBJECT_CACHE_LOCAL_TTL секунд, перед общим кешем. Отсутствующие объекты
+# кешируются на OBJECT_CACHE_MISSING_TIMEOUT секунд.
+OBJECT_CACHE_LOCAL_SIZE = 1024
+OBJECT_CACHE_LOCAL_TTL = 30
+OBJECT_CACHE_TIMEOUT = 600
+OBJECT_CACHE_MISSING_TIMEOUT = 60
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+SQLite для нескольких воркеров.
+
+ENGINE 'yatube.sqlite' — обычный бэкенд sqlite3 с дополнительными
+ключами OPTIONS:
+
+    'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', ...}
+        выполняются на каждом новом соединении;
+    'begin_immediate': True
+        транзакции открываются BEGIN IMMEDIATE: блокировка на запись
+        берется сразу и ждет timeout, а не падает с "database is locked"
+        при попытке повысить блокировку чтения посреди транзакции;
+    'write_queue': True
+        записи через yatube.sqlite.writes.write() выполняются одним
+        потоком процесса пакетами (см. writes.py).
+
+Остальные ключи, например 'timeout', передаются в sqlite3.connect.
+"""
+from django.db.backends.sqlite3 import base
+
+CUSTOM_OPTIONS = ('pragmas', 'begin_immediate', 'write_queue')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        for option in CUSTOM_OPTIONS:
+            kwargs.pop(option, None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas = self.settings_dict['OPTIONS'].get('pragmas', {})
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.settings_dict['OPTIONS'].get('begin_immediate'):
+            self.cursor().execute('BEGIN IMMEDIATE')
+        else:
+            super()._start_transaction_under_autocommit()
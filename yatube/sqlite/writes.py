@@ -0,0 +1,123 @@
+"""
+Очередь записи в пределах процесса.
+
+SQLite допускает одного писателя на всю базу. Когда потоки одного
+воркера пишут одновременно, они конкурируют за блокировку и ждут друг
+друга в busy timeout. С OPTIONS['write_queue'] записи через write()
+выполняет один поток: он забирает накопившиеся задания и выполняет их
+одной транзакцией (одна фиксация и один fsync на пакет), каждое задание —
+в своей точке сохранения, так что ошибка одного не откатывает остальные.
+Вызывающий поток получает результат только после фиксации.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.db import connections, transaction
+
+from yatube.replicas import mark_written
+
+BATCH_SIZE = 50
+
+
+class WriteQueue:
+    def __init__(self, using='default', batch_size=BATCH_SIZE):
+        self.using = using
+        self.batch_size = batch_size
+        self.jobs = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self._ensure_thread()
+        self.jobs.put((future, func, args, kwargs))
+        return future
+
+    def in_writer(self):
+        return threading.current_thread() is self.thread
+
+    def _ensure_thread(self):
+        # После fork поток писателя в дочернем процессе не существует.
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.jobs = queue.SimpleQueue()
+                self.pid = os.getpid()
+                self.thread = threading.Thread(
+                    target=self._run, name=f'sqlite-writer-{self.using}',
+                    daemon=True
+                )
+                self.thread.start()
+
+    def _next_batch(self):
+        batch = [self.jobs.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            self.run_batch(self._next_batch())
+
+    def run_batch(self, batch):
+        done = []
+        try:
+            with transaction.atomic(using=self.using):
+                for future, func, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction.atomic(using=self.using):
+                            done.append((future, func(*args, **kwargs)))
+                    except Exception as exc:
+                        future.set_exception(exc)
+        except Exception as exc:
+            # Не удалась сама фиксация: ни одно задание не записано.
+            for future, _ in done:
+                future.set_exception(exc)
+        else:
+            for future, result in done:
+                future.set_result(result)
+        finally:
+            connections[self.using].close_if_unusable_or_obsolete()
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue(using='default'):
+    with _queues_lock:
+        if using not in _queues:
+            _queues[using] = WriteQueue(using)
+        return _queues[using]
+
+
+def write(func, *args, using='default', **kwargs):
+    """
+    Выполняет func(*args, **kwargs) как одну транзакцию записи и
+    возвращает ее результат.
+
+    С включенной очередью функция выполняется в потоке писателя. Внутри
+    уже открытой транзакции и в самом писателе она выполняется сразу:
+    ожидание очереди, пока этот поток держит блокировку, никогда бы не
+    закончилось.
+    """
+    connection = connections[using]
+    queued = connection.settings_dict['OPTIONS'].get('write_queue')
+    if queued and not connection.in_atomic_block:
+        writes = get_queue(using)
+        if not writes.in_writer():
+            # Роутер отметит запись в потоке писателя, а липкое чтение
+            # из основной базы нужно запросу в этом потоке.
+            mark_written()
+            return writes.submit(func, *args, **kwargs).result()
+    with transaction.atomic(using=using):
+        return func(*args, **kwargs)
@@ -1,26 +1,36 @@
 from django.contrib import admin
 from django.urls import include, path
-from django.contrib.flatpages import views
 from django.conf import settings
 from django.conf.urls.static import static
 from django.conf.urls import handler404, handler500
 
+from posts.flatpages import flatpage
+from yatube.metrics import metrics
+
 handler404 = "posts.views.page_not_found" # noqa
 handler500 = "posts.views.server_error" # noqa
 
 urlpatterns = [
-    path('', include('posts.urls')),
     path("auth/", include("users.urls")),
     path("auth/", include("django.contrib.auth.urls")),
     path('admin/', admin.site.urls),
-    path('about/', include('django.contrib.flatpages.urls')),
+    path('metrics/', metrics, name='metrics'),
+    path('api/v1/', include('posts.api_urls')),
+    path('about/<path:url>', flatpage,
+         name='django.contrib.flatpages.views.flatpage'),
+]
+
+urlpatterns += [
+        path('about-us/', flatpage, {'url': '/about-us/'}, name='about'),
+        path('terms/', flatpage, {'url': '/terms/'}, name='terms'),
+        path('about-author/', flatpage, {'url': '/about-author/'}, name='about-author'),
+        path('about-spec/', flatpage, {'url': '/about-spec/'}, name='about-spec')
 ]
 
+# Маршрут профиля '<username>/' перехватывает любой одиночный сегмент,
+# поэтому записи подключаются после admin/ и flatpages.
 urlpatterns += [
-        path('about-us/', views.flatpage, {'url': '/about-us/'}, name='about'),
-        path('terms/', views.flatpage, {'url': '/terms/'}, name='terms'),
-        path('about-author/', views.flatpage, {'url': '/about-author/'}, name='about-author'),
-        path('about-spec/', views.flatpage, {'url': '/about-spec/'}, name='about-spec')
+    path('', include('posts.urls')),
 ]
 
 if settings.DEBUG: